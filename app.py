@@ -1,79 +1,64 @@
+import os
 import streamlit as st
 from streamlit_modal import Modal
 import time
+from utils import catalog
 from utils import image
 from utils import db
+from utils import history
 from utils import llm
+from utils import tracing
 
 # Layout with shopping page and chat sidebar
 st.set_page_config(page_title="💪 Healthy & Nutrition Shop 💪")
 st.markdown("<h1 style='text-align: center; color: black;'>🔛🔝 Top Products This Month</h1>", unsafe_allow_html=True)
 
-click_button = {i: None for i in range(1, 7)}
+## Products come from the shared catalog snapshot, a page at a time
+if "catalog_page" not in st.session_state:
+    st.session_state.catalog_page = 0
 
-# Create columns for shopping items
-col1, col2, col3 = st.columns(3, gap="large")
+products, page_count = catalog.get_page(st.session_state.catalog_page)
 
-with col1:
-    new_image = image.resize_image("image_product/1_61kakn7F+rL._AC_UL320_.jpg")
-    st.image(new_image, caption="""MuscleBlaze Beginner's Whey Protein (Chocolate 1 kg) - $16.19""")
+# Create rows of 3 columns for shopping items
+for row_start in range(0, len(products), 3):
+    cols = st.columns(3, gap="large")
 
-    col11, col12, col13 = st.columns(3)
-    with col12:
-        click_button[1] = st.button("Add", key=1)
-
-with col2:
-    new_image = image.resize_image("image_product/2_81hcIJfQLTL._AC_UL320_.jpg")
-    st.image(new_image, caption="""Endura Mass Weight Gainer - 500 g (Chocolate) - $6.76""")
-    
-    col21, col22, col23 = st.columns(3)
-    with col22:
-        click_button[2] = st.button("Add", key=2)
-
-with col3:
-    new_image = image.resize_image("image_product/3_713Cwx85MbL._AC_UL320_.jpg")
-    st.image(new_image, caption="""Neuherbs Skin Collagen, 210g | Collagen Supplement - $8.99""")
-    
-    col31, col32, col33 = st.columns(3)
-    with col32:
-        click_button[3] = st.button("Add", key=3)
-
-# Create columns for shopping items
-col4, col5, col6 = st.columns(3, gap="large")
-
-with col4:
-    new_image = image.resize_image("image_product/4_71fjiF6Q3yL._AC_UL320_.jpg")
-    st.image(new_image, caption="""Carbamide Forte Melatonin Gummies 10mg - $5.99""")
-    
-    col41, col42, col43 = st.columns(3)
-    with col42:
-        click_button[4] = st.button("Add", key=4)
-
-with col5:
-    new_image = image.resize_image("image_product/5_718gTJfVzuL._AC_UL320_.jpg")
-    st.image(new_image, caption="""Carbamide Forte Multivitamin (100 Veg Tablets) - $5.99""")
-    
-    col51, col52, col53 = st.columns(3)
-    with col52:
-        click_button[5] = st.button("Add", key=5)
-
-with col6:
-    new_image = image.resize_image("image_product/6_51BuPqiRAWS._AC_UL320_.jpg")
-    st.image(new_image, caption="""Follihair New Nutraceutical Pack of 30N Tablet... - $6.80""")
-    
-    col61, col62, col63 = st.columns(3)
-    with col62:
-        click_button[6] = st.button("Add", key=6)
-
-for k in range(1, 7):
-    if click_button[k]:
-        db.add_product_cart(product_id=k)
+    for col, product in zip(cols, products[row_start:row_start + 3]):
+        with col:
+            ## Bundled images go through the thumbnail cache; others are loaded by the browser
+            if os.path.exists(product["image"] or ""):
+                st.image(image.get_thumbnail(product["image"]), caption=product["caption"])
+            elif product["image"]:
+                st.image(product["image"], caption=product["caption"], use_column_width=True)
+            else:
+                st.caption(product["caption"])
+
+            _, col_button, _ = st.columns(3)
+            with col_button:
+                if st.button("Add", key=f"add_{product['id']}"):
+                    db.add_product_cart(product_id=product["id"])
+
+# Pagination
+if page_count > 1:
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("◀ Previous", disabled=st.session_state.catalog_page == 0):
+            st.session_state.catalog_page -= 1
+            st.rerun()
+    with col_page:
+        st.markdown(f"<p style='text-align: center; color: gray;'>Page {st.session_state.catalog_page + 1} of {page_count}</p>", unsafe_allow_html=True)
+    with col_next:
+        if st.button("Next ▶", disabled=st.session_state.catalog_page >= page_count - 1):
+            st.session_state.catalog_page += 1
+            st.rerun()
 
 st.markdown("<h4 style='text-align: center; color: black;'>💬 Chat with AI Clerk 🤖</h4>", unsafe_allow_html=True)
 
 ## Initialize chat history
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "history" not in st.session_state:
+    st.session_state.history = history.HistoryManager()
 
 ## Display chat messages from history on app rerun
 for message in st.session_state.messages:
@@ -90,7 +75,9 @@ if prompt := st.chat_input("Message AI Clerk 🤖"):
         st.markdown(prompt)
 
     # Display assistant response in chat message container
-    with st.chat_message("assistant"):
+    ## One trace per turn; its time not covered by the pipeline's spans is Streamlit rendering
+    with st.chat_message("assistant"), tracing.span("turn") as turn:
+        ## The spinner only covers the wait for the first token; the reply then streams in
         with st.spinner('Our clerk is thinking...'):
             response, is_stream = llm.reply_prompt(
                 messages=[
@@ -98,13 +85,15 @@ if prompt := st.chat_input("Message AI Clerk 🤖"):
                     for m in st.session_state.messages
                 ],
                 prompt=prompt,
+                history=st.session_state.history,
                 )
-            
-            if is_stream:
-                content = st.write_stream(response)
-            else:
-                st.write(response)
-                content = response
+
+        if is_stream:
+            content = st.write_stream(response)
+        else:
+            st.write(response)
+            content = response
+        turn.set(chars=len(content) if isinstance(content, str) else None)
     
     # Add assistant response to chat history
     st.session_state.messages.append({"role": "assistant", "content": content})
@@ -112,14 +101,11 @@ if prompt := st.chat_input("Message AI Clerk 🤖"):
 ## Cart at sidebar
 with st.sidebar:
     st.markdown("<h2 style='text-align: center; color: black;'>🛒 Shopping Cart 🛒</h2>", unsafe_allow_html=True)
-    db_url = db.get_db_url()
-    conn = st.connection("postgresql", type="sql", url=db_url)
-    sql_cart = db.get_sql_show_cart()
-    cart_1 = conn.query(sql_cart)
+    cart_1, cart_total = db.get_cart(user_id=1)
 
     if len(cart_1) > 0:
         st.dataframe(cart_1, hide_index=True)
-        st.write(f"<h5 style='text-align: left; color: black;'>Total Price: ${cart_1["Price"].sum().round(2)}</h5>", unsafe_allow_html=True)
+        st.write(f"<h5 style='text-align: left; color: black;'>Total Price: ${cart_total}</h5>", unsafe_allow_html=True)
 
         buy = st.button("Buy Now")
         buy_popup = Modal("Success", key="popup", max_width=400)
@@ -138,12 +124,8 @@ with st.sidebar:
 
                 if ok:
                     buy_popup.close()
-                    st.cache_data.clear()
                     st.rerun()
 
 
     else:
         st.write("<i><p style='text-align: center; color: gray;'>No product in the cart.</p></i>", unsafe_allow_html=True)
-
-# clear data cache
-st.cache_data.clear()
@@ -0,0 +1,8 @@
+-- Optional persistent layer for query embeddings (EMBED_CACHE_BACKEND=postgres)
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    key_hash TEXT PRIMARY KEY,          -- sha256 of provider tag:normalized text
+    embedding VECTOR NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS embedding_cache_created_at ON embedding_cache (created_at);
@@ -0,0 +1,15 @@
+-- Upgrade a product_listing table created with an untyped VECTOR column.
+-- pgvector can only index a vector column with a fixed dimension.
+ALTER TABLE product_listing
+  ALTER COLUMN embedded_description TYPE vector(1536) USING embedded_description::vector(1536);
+
+-- Stored keyword search document, so queries don't recompute to_tsvector for every row
+ALTER TABLE product_listing
+  ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', COALESCE(name, '')), 'A') ||
+    setweight(to_tsvector('english', COALESCE(description, '')), 'B')
+  ) STORED;
+
+CREATE INDEX IF NOT EXISTS product_listing_embedding_hnsw ON product_listing USING hnsw (embedded_description vector_cosine_ops);
+CREATE INDEX IF NOT EXISTS product_listing_search_vector_gin ON product_listing USING gin (search_vector);
+ANALYZE product_listing;
@@ -0,0 +1,21 @@
+-- One CART row per (user, product), so cart writes can be single-statement upserts.
+-- Merge duplicates left behind by the old SELECT-then-INSERT path first.
+WITH duplicates AS (
+  SELECT user_id, product_id, MIN(id) AS keep_id, SUM(quantity) AS quantity
+  FROM shopping_cart
+  WHERE status = 'CART'
+  GROUP BY user_id, product_id
+  HAVING COUNT(*) > 1
+),
+merged AS (
+  UPDATE shopping_cart sc
+  SET quantity = duplicates.quantity
+  FROM duplicates
+  WHERE sc.id = duplicates.keep_id
+)
+DELETE FROM shopping_cart sc
+USING duplicates
+WHERE sc.user_id = duplicates.user_id AND sc.product_id = duplicates.product_id
+  AND sc.status = 'CART' AND sc.id <> duplicates.keep_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS shopping_cart_cart_item ON shopping_cart (user_id, product_id) WHERE status = 'CART';
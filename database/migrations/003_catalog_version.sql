@@ -0,0 +1,20 @@
+-- A counter bumped by every statement that changes product_listing, so caches of
+-- search results can tell when the catalog they were built from is out of date.
+CREATE TABLE IF NOT EXISTS catalog_version (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  version BIGINT NOT NULL DEFAULT 0,
+  changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO catalog_version (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE catalog_version SET version = version + 1, changed_at = CURRENT_TIMESTAMP;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS product_listing_changed ON product_listing;
+CREATE TRIGGER product_listing_changed
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON product_listing
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
@@ -0,0 +1,27 @@
+-- Columns for incremental ingestion (python -m utils.ingest):
+-- source_key identifies a product across catalog files (the Amazon ASIN of its link, else the link),
+-- content_hash is sha256(name || '\n' || description) of the text the stored embedding was made from.
+ALTER TABLE product_listing ADD COLUMN IF NOT EXISTS source_key TEXT;
+ALTER TABLE product_listing ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+UPDATE product_listing
+SET source_key = COALESCE(substring(link from '/dp/([A-Z0-9]{10})'), NULLIF(link, ''), name)
+WHERE source_key IS NULL;
+
+-- Rows loaded with their embedding are current, so the first ingest doesn't re-embed them
+UPDATE product_listing
+SET content_hash = encode(sha256(convert_to(COALESCE(name, '') || E'\n' || COALESCE(description, ''), 'UTF8')), 'hex')
+WHERE content_hash IS NULL AND embedded_description IS NOT NULL;
+
+-- Listings that share a key keep it on their oldest row only
+UPDATE product_listing p
+SET source_key = p.source_key || '#' || p.id
+FROM (
+  SELECT source_key, MIN(id) AS keep_id
+  FROM product_listing
+  GROUP BY source_key
+  HAVING COUNT(*) > 1
+) duplicates
+WHERE p.source_key = duplicates.source_key AND p.id <> duplicates.keep_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS product_listing_source_key ON product_listing (source_key);
@@ -0,0 +1,20 @@
+-- Columns and indexes behind the search_products filters (utils/search_filters.py).
+-- discount_percent is derived from the two prices so it can be indexed and never drifts.
+ALTER TABLE product_listing
+  ADD COLUMN IF NOT EXISTS discount_percent FLOAT GENERATED ALWAYS AS (
+    CASE WHEN actual_price_dollar > 0
+      THEN 100 * (1 - discount_price_dollar / actual_price_dollar)
+    END
+  ) STORED;
+
+-- Categories are matched case-insensitively; sub_category alone is served by the second index
+CREATE INDEX IF NOT EXISTS product_listing_category ON product_listing (lower(main_category), lower(sub_category));
+CREATE INDEX IF NOT EXISTS product_listing_sub_category ON product_listing (lower(sub_category));
+CREATE INDEX IF NOT EXISTS product_listing_price ON product_listing (discount_price_dollar);
+CREATE INDEX IF NOT EXISTS product_listing_ratings ON product_listing (ratings);
+CREATE INDEX IF NOT EXISTS product_listing_discount_percent ON product_listing (discount_percent);
+
+-- Per-column statistics alone underestimate how category and price narrow together
+CREATE STATISTICS IF NOT EXISTS product_listing_category_price (dependencies, ndistinct)
+  ON main_category, sub_category, discount_price_dollar FROM product_listing;
+ANALYZE product_listing;
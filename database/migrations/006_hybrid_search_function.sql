@@ -0,0 +1,107 @@
+-- Hybrid product search installed server-side, so every lookup is one round trip returning ranked rows.
+-- Semantic (pgvector) and keyword (tsvector) matches are fused with reciprocal rank fusion:
+-- score = 1 / (k + semantic rank) + 1 / (k + keyword rank). Filters left NULL don't apply.
+
+-- The search_products filters (utils/search_filters.py); a plain SQL function, so it is inlined
+-- and the planner still sees the indexed expressions of 005_product_listing_filters.sql
+CREATE OR REPLACE FUNCTION product_filter_matches(
+  p product_listing,
+  min_price FLOAT, max_price FLOAT, main_category TEXT, sub_category TEXT, min_rating FLOAT, min_discount_percent FLOAT
+) RETURNS BOOLEAN AS $$
+  SELECT ($2 IS NULL OR p.discount_price_dollar >= $2)
+     AND ($3 IS NULL OR p.discount_price_dollar <= $3)
+     AND ($4 IS NULL OR lower(p.main_category) = lower($4))
+     AND ($5 IS NULL OR lower(p.sub_category) = lower($5))
+     AND ($6 IS NULL OR p.ratings >= $6)
+     AND ($7 IS NULL OR p.discount_percent >= $7)
+$$ LANGUAGE sql STABLE;
+
+-- The `candidates` products nearest to query_embedding, as (id, cosine distance).
+-- With compact_dimensions > 0 they come from the compact HNSW index of utils/vector_storage.py
+-- (rerank_candidates of them) and are re-ranked by the full vectors.
+CREATE OR REPLACE FUNCTION semantic_candidates(
+  query_embedding vector, candidates INT,
+  min_price FLOAT DEFAULT NULL, max_price FLOAT DEFAULT NULL, main_category TEXT DEFAULT NULL,
+  sub_category TEXT DEFAULT NULL, min_rating FLOAT DEFAULT NULL, min_discount_percent FLOAT DEFAULT NULL,
+  compact_dimensions INT DEFAULT 0, compact_precision TEXT DEFAULT 'half', rerank_candidates INT DEFAULT 100
+) RETURNS TABLE (id INT, distance FLOAT) AS $$
+#variable_conflict use_variable
+BEGIN
+  IF compact_dimensions > 0 AND compact_precision = 'half' THEN
+    RETURN QUERY
+      SELECT c.id, c.embedded_description <=> query_embedding
+      FROM (
+        SELECT p.id, p.embedded_description
+        FROM product_listing p
+        WHERE product_filter_matches(p, min_price, max_price, main_category, sub_category, min_rating, min_discount_percent)
+        ORDER BY p.embedded_compact <=> l2_normalize(subvector(query_embedding, 1, compact_dimensions))::halfvec
+        LIMIT GREATEST(rerank_candidates, candidates)
+      ) c
+      ORDER BY 2
+      LIMIT candidates;
+  ELSIF compact_dimensions > 0 THEN
+    RETURN QUERY
+      SELECT c.id, c.embedded_description <=> query_embedding
+      FROM (
+        SELECT p.id, p.embedded_description
+        FROM product_listing p
+        WHERE product_filter_matches(p, min_price, max_price, main_category, sub_category, min_rating, min_discount_percent)
+        ORDER BY p.embedded_compact <=> l2_normalize(subvector(query_embedding, 1, compact_dimensions))
+        LIMIT GREATEST(rerank_candidates, candidates)
+      ) c
+      ORDER BY 2
+      LIMIT candidates;
+  ELSE
+    RETURN QUERY
+      SELECT p.id, p.embedded_description <=> query_embedding
+      FROM product_listing p
+      WHERE product_filter_matches(p, min_price, max_price, main_category, sub_category, min_rating, min_discount_percent)
+      ORDER BY p.embedded_description <=> query_embedding
+      LIMIT candidates;
+  END IF;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Ranked product rows, best first: SELECT * FROM hybrid_search('whey protein', '[...]', max_price => 20)
+CREATE OR REPLACE FUNCTION hybrid_search(
+  search_query TEXT, query_embedding vector,
+  k INT DEFAULT 60, candidates INT DEFAULT 20, result_limit INT DEFAULT 5,
+  min_price FLOAT DEFAULT NULL, max_price FLOAT DEFAULT NULL, main_category TEXT DEFAULT NULL,
+  sub_category TEXT DEFAULT NULL, min_rating FLOAT DEFAULT NULL, min_discount_percent FLOAT DEFAULT NULL,
+  compact_dimensions INT DEFAULT 0, compact_precision TEXT DEFAULT 'half', rerank_candidates INT DEFAULT 100
+) RETURNS TABLE (id INT, name TEXT, discount_price_dollar FLOAT, description TEXT, link TEXT, score FLOAT) AS $$
+  WITH semantic_search AS (
+    SELECT s.id, RANK() OVER (ORDER BY s.distance) AS rank
+    FROM semantic_candidates(
+      query_embedding, candidates,
+      hybrid_search.min_price, hybrid_search.max_price, hybrid_search.main_category,
+      hybrid_search.sub_category, hybrid_search.min_rating, hybrid_search.min_discount_percent,
+      compact_dimensions, compact_precision, rerank_candidates
+    ) s
+  ),
+  keyword_search AS (
+    SELECT p.id, RANK() OVER (ORDER BY ts_rank_cd(p.search_vector, q) DESC) AS rank
+    FROM product_listing p, plainto_tsquery('english', search_query) q
+    WHERE p.search_vector @@ q
+      AND product_filter_matches(
+        p, hybrid_search.min_price, hybrid_search.max_price, hybrid_search.main_category,
+        hybrid_search.sub_category, hybrid_search.min_rating, hybrid_search.min_discount_percent
+      )
+    ORDER BY ts_rank_cd(p.search_vector, q) DESC
+    LIMIT candidates
+  ),
+  fused AS (
+    SELECT
+      COALESCE(semantic_search.id, keyword_search.id) AS id,
+      COALESCE(1.0 / (k + semantic_search.rank), 0.0) +
+      COALESCE(1.0 / (k + keyword_search.rank), 0.0) AS score
+    FROM semantic_search
+    FULL OUTER JOIN keyword_search ON semantic_search.id = keyword_search.id
+    ORDER BY score DESC
+    LIMIT result_limit
+  )
+  SELECT p.id, p.name, p.discount_price_dollar, p.description, p.link, fused.score::FLOAT
+  FROM fused
+  JOIN product_listing p ON p.id = fused.id
+  ORDER BY fused.score DESC, p.id
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,54 @@
+-- Keep cart and order status queries constant-time per user as order history grows.
+-- Active CART rows are served by the partial unique index of 002; paid rows get an order_id
+-- (one per pay_cart call) and their own partial index, and old orders can be moved to
+-- shopping_cart_archive (python -m utils.setup archive-orders) without leaving order_items.
+CREATE SEQUENCE IF NOT EXISTS shopping_cart_order_id;
+ALTER TABLE shopping_cart ADD COLUMN IF NOT EXISTS order_id BIGINT;
+
+-- Rows paid before this migration: one order per user and payment date
+UPDATE shopping_cart sc
+SET order_id = orders.order_id
+FROM (
+  SELECT user_id, status_date, nextval('shopping_cart_order_id') AS order_id
+  FROM (
+    SELECT DISTINCT user_id, status_date
+    FROM shopping_cart
+    WHERE status <> 'CART' AND order_id IS NULL
+    ORDER BY status_date, user_id
+  ) paid
+) orders
+WHERE sc.status <> 'CART' AND sc.order_id IS NULL
+  AND sc.user_id = orders.user_id AND sc.status_date IS NOT DISTINCT FROM orders.status_date;
+
+CREATE INDEX IF NOT EXISTS shopping_cart_user_orders ON shopping_cart (user_id, order_id DESC) WHERE status <> 'CART';
+
+CREATE TABLE IF NOT EXISTS shopping_cart_archive (LIKE shopping_cart);
+ALTER TABLE shopping_cart_archive ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS shopping_cart_archive_user_orders ON shopping_cart_archive (user_id, order_id DESC);
+
+-- Every order row, recent or archived; both halves are index scans in order_id order, so
+-- "the latest N orders of a user" merges them without reading the rest of the history
+CREATE OR REPLACE VIEW order_items AS
+  SELECT id, user_id, product_id, quantity, status, status_date, estimated_arrival_date, order_id
+  FROM shopping_cart
+  WHERE status <> 'CART'
+  UNION ALL
+  SELECT id, user_id, product_id, quantity, status, status_date, estimated_arrival_date, order_id
+  FROM shopping_cart_archive;
+
+-- Move orders that arrived more than `older_than` ago out of shopping_cart; returns the rows moved
+CREATE OR REPLACE FUNCTION archive_orders(older_than INTERVAL DEFAULT INTERVAL '90 days') RETURNS BIGINT AS $$
+  WITH moved AS (
+    DELETE FROM shopping_cart
+    WHERE status <> 'CART' AND estimated_arrival_date < CURRENT_DATE - older_than
+    RETURNING id, user_id, product_id, quantity, status, status_date, estimated_arrival_date, order_id
+  ),
+  archived AS (
+    INSERT INTO shopping_cart_archive (id, user_id, product_id, quantity, status, status_date, estimated_arrival_date, order_id)
+    SELECT * FROM moved
+    RETURNING 1
+  )
+  SELECT COUNT(*) FROM archived
+$$ LANGUAGE sql;
+
+ANALYZE shopping_cart;
@@ -0,0 +1,107 @@
+-- Tag every product vector with the model that made it ("<provider>:<model>:<dimensions>",
+-- see utils/embedding_providers.py), so query and catalog vectors always come from the same model.
+-- The vectors shipped in product_listing.csv were made with text-embedding-3-small.
+ALTER TABLE product_listing ADD COLUMN IF NOT EXISTS embedding_model TEXT;
+UPDATE product_listing
+SET embedding_model = 'openai:text-embedding-3-small:1536'
+WHERE embedded_description IS NOT NULL AND embedding_model IS NULL;
+
+-- Semantic search only matches products embedded by the query's model; the new embedding_model
+-- argument changes the signatures, so the 006 versions are dropped rather than overloaded
+DROP FUNCTION IF EXISTS hybrid_search(TEXT, vector, INT, INT, INT, FLOAT, FLOAT, TEXT, TEXT, FLOAT, FLOAT, INT, TEXT, INT);
+DROP FUNCTION IF EXISTS semantic_candidates(vector, INT, FLOAT, FLOAT, TEXT, TEXT, FLOAT, FLOAT, INT, TEXT, INT);
+
+CREATE OR REPLACE FUNCTION semantic_candidates(
+  query_embedding vector, candidates INT,
+  min_price FLOAT DEFAULT NULL, max_price FLOAT DEFAULT NULL, main_category TEXT DEFAULT NULL,
+  sub_category TEXT DEFAULT NULL, min_rating FLOAT DEFAULT NULL, min_discount_percent FLOAT DEFAULT NULL,
+  compact_dimensions INT DEFAULT 0, compact_precision TEXT DEFAULT 'half', rerank_candidates INT DEFAULT 100,
+  embedding_model TEXT DEFAULT NULL
+) RETURNS TABLE (id INT, distance FLOAT) AS $$
+#variable_conflict use_variable
+BEGIN
+  IF compact_dimensions > 0 AND compact_precision = 'half' THEN
+    RETURN QUERY
+      SELECT c.id, c.embedded_description <=> query_embedding
+      FROM (
+        SELECT p.id, p.embedded_description
+        FROM product_listing p
+        WHERE product_filter_matches(p, min_price, max_price, main_category, sub_category, min_rating, min_discount_percent)
+          AND (embedding_model IS NULL OR p.embedding_model = embedding_model)
+        ORDER BY p.embedded_compact <=> l2_normalize(subvector(query_embedding, 1, compact_dimensions))::halfvec
+        LIMIT GREATEST(rerank_candidates, candidates)
+      ) c
+      ORDER BY 2
+      LIMIT candidates;
+  ELSIF compact_dimensions > 0 THEN
+    RETURN QUERY
+      SELECT c.id, c.embedded_description <=> query_embedding
+      FROM (
+        SELECT p.id, p.embedded_description
+        FROM product_listing p
+        WHERE product_filter_matches(p, min_price, max_price, main_category, sub_category, min_rating, min_discount_percent)
+          AND (embedding_model IS NULL OR p.embedding_model = embedding_model)
+        ORDER BY p.embedded_compact <=> l2_normalize(subvector(query_embedding, 1, compact_dimensions))
+        LIMIT GREATEST(rerank_candidates, candidates)
+      ) c
+      ORDER BY 2
+      LIMIT candidates;
+  ELSE
+    RETURN QUERY
+      SELECT p.id, p.embedded_description <=> query_embedding
+      FROM product_listing p
+      WHERE product_filter_matches(p, min_price, max_price, main_category, sub_category, min_rating, min_discount_percent)
+        AND (embedding_model IS NULL OR p.embedding_model = embedding_model)
+      ORDER BY p.embedded_description <=> query_embedding
+      LIMIT candidates;
+  END IF;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Ranked product rows, best first: SELECT * FROM hybrid_search('whey protein', '[...]', embedding_model => 'local:all-MiniLM-L6-v2:384')
+CREATE OR REPLACE FUNCTION hybrid_search(
+  search_query TEXT, query_embedding vector,
+  k INT DEFAULT 60, candidates INT DEFAULT 20, result_limit INT DEFAULT 5,
+  min_price FLOAT DEFAULT NULL, max_price FLOAT DEFAULT NULL, main_category TEXT DEFAULT NULL,
+  sub_category TEXT DEFAULT NULL, min_rating FLOAT DEFAULT NULL, min_discount_percent FLOAT DEFAULT NULL,
+  compact_dimensions INT DEFAULT 0, compact_precision TEXT DEFAULT 'half', rerank_candidates INT DEFAULT 100,
+  embedding_model TEXT DEFAULT NULL
+) RETURNS TABLE (id INT, name TEXT, discount_price_dollar FLOAT, description TEXT, link TEXT, score FLOAT) AS $$
+  WITH semantic_search AS (
+    SELECT s.id, RANK() OVER (ORDER BY s.distance) AS rank
+    FROM semantic_candidates(
+      query_embedding, candidates,
+      hybrid_search.min_price, hybrid_search.max_price, hybrid_search.main_category,
+      hybrid_search.sub_category, hybrid_search.min_rating, hybrid_search.min_discount_percent,
+      compact_dimensions, compact_precision, rerank_candidates, hybrid_search.embedding_model
+    ) s
+  ),
+  keyword_search AS (
+    SELECT p.id, RANK() OVER (ORDER BY ts_rank_cd(p.search_vector, q) DESC) AS rank
+    FROM product_listing p, plainto_tsquery('english', search_query) q
+    WHERE p.search_vector @@ q
+      AND product_filter_matches(
+        p, hybrid_search.min_price, hybrid_search.max_price, hybrid_search.main_category,
+        hybrid_search.sub_category, hybrid_search.min_rating, hybrid_search.min_discount_percent
+      )
+    ORDER BY ts_rank_cd(p.search_vector, q) DESC
+    LIMIT candidates
+  ),
+  fused AS (
+    SELECT
+      COALESCE(semantic_search.id, keyword_search.id) AS id,
+      COALESCE(1.0 / (k + semantic_search.rank), 0.0) +
+      COALESCE(1.0 / (k + keyword_search.rank), 0.0) AS score
+    FROM semantic_search
+    FULL OUTER JOIN keyword_search ON semantic_search.id = keyword_search.id
+    ORDER BY score DESC
+    LIMIT result_limit
+  )
+  SELECT p.id, p.name, p.discount_price_dollar, p.description, p.link, fused.score::FLOAT
+  FROM fused
+  JOIN product_listing p ON p.id = fused.id
+  ORDER BY fused.score DESC, p.id
+$$ LANGUAGE sql STABLE;
+
+CREATE INDEX IF NOT EXISTS product_listing_embedding_model ON product_listing (embedding_model);
+ANALYZE product_listing;
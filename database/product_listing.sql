@@ -1,3 +1,5 @@
+CREATE EXTENSION IF NOT EXISTS vector;
+
 CREATE TABLE product_listing (
   id serial,
   name TEXT,
@@ -10,11 +12,22 @@ CREATE TABLE product_listing (
   discount_price_dollar FLOAT,
   actual_price_dollar FLOAT,
   description TEXT,
-  embedded_description VECTOR,
+  embedded_description vector(1536),
+  -- keyword search document, name weighted above description
+  search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', COALESCE(name, '')), 'A') ||
+    setweight(to_tsvector('english', COALESCE(description, '')), 'B')
+  ) STORED,
   PRIMARY KEY (id)
 );
 
+-- one-shot load of the bundled catalog; to refresh a catalog incrementally use python -m utils.ingest <file.csv>
 COPY product_listing(name,main_category,sub_category,image,link,ratings,no_of_ratings,discount_price_dollar,actual_price_dollar,description,embedded_description)
 FROM '/path/to/database/product_listing.csv'
 DELIMITER ','
 CSV HEADER;
+
+-- build the indexes after loading, it is much faster than maintaining them row by row
+CREATE INDEX product_listing_embedding_hnsw ON product_listing USING hnsw (embedded_description vector_cosine_ops);
+CREATE INDEX product_listing_search_vector_gin ON product_listing USING gin (search_vector);
+ANALYZE product_listing;
@@ -7,3 +7,6 @@ CREATE TABLE shopping_cart (
   	status_date DATE,
   	estimated_arrival_date DATE
 );
+
+-- at most one CART row per user and product, target of the cart upserts
+CREATE UNIQUE INDEX shopping_cart_cart_item ON shopping_cart (user_id, product_id) WHERE status = 'CART';
@@ -0,0 +1,508 @@
+## End-to-end latency benchmark that needs no OpenAI key and no shared database:
+## the OpenAI API is replaced by utils.fake_openai and Postgres by a throwaway pgvector
+## instance loaded from database/*.sql. Results are written as JSON so runs can be compared.
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from utils.fake_openai import FakeOpenAI
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE_DIR = os.path.join(ROOT_DIR, "database")
+RESULTS_DIR = os.path.join(ROOT_DIR, "bench_results")
+PGVECTOR_IMAGE = os.getenv("BENCH_PGVECTOR_IMAGE", "pgvector/pgvector:pg16")
+
+## One shopping session: (user message, tool calls the fake model answers it with).
+## Every db_llm tool appears at least once; user_id is filled in per session.
+SCENARIO = [
+    ("Hi! What can you help me with?", []),
+    ("Do you have whey protein under $20?", [
+        ("search_products", {"search_query": "whey protein", "filters": {"max_price": 20}}),
+    ]),
+    ("Which vitamins help with sleep?", [("search_products", {"search_query": "vitamins for sleep"})]),
+    ("Add the chocolate whey protein to my cart", [
+        ("add_product_to_cart", {"search_query": "chocolate whey protein", "quantity": 1}),
+    ]),
+    ("Add creatine and a multivitamin", [
+        ("add_products_to_cart", {"items": [{"search_query": "creatine monohydrate", "quantity": 1},
+                                            {"search_query": "multivitamin tablets", "quantity": 2}]}),
+    ]),
+    ("Show my cart", [("show_cart", {})]),
+    ("Make it 3 whey protein", [("update_product_quantity", {"search_query": "chocolate whey protein", "quantity": 3})]),
+    ("Remove the creatine", [("remove_product_from_cart", {"search_query": "creatine monohydrate"})]),
+    ("Show my cart and my orders", [("show_cart", {}), ("check_products_status", {})]),
+    ("I want to pay", [("pay_cart", {})]),
+    ("Where are my orders?", [("check_products_status", {})]),
+]
+
+## db_llm function behind each tool name, and the rows-only variant of the table tools
+DB_LLM_TOOLS = {"search_products": "search_products_llm"}
+ROW_TOOLS = {"show_cart": "get_cart_items", "check_products_status": "get_products_status"}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of values, q in [0, 100]."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2),
+    }
+
+
+class Recorder:
+    """Thread-safe lists of durations per stage name."""
+
+    def __init__(self):
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.durations.setdefault(stage, []).append(seconds)
+
+    def timed(self, stage, function):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return wrapper
+
+    def summary(self, prefix=""):
+        with self._lock:
+            return {
+                stage[len(prefix):]: summarize(values)
+                for stage, values in sorted(self.durations.items())
+                if stage.startswith(prefix)
+            }
+
+
+def session_script(session):
+    """
+    The scenario for one session as user session + 1. Messages are left as written so the intent
+    router sees them; the fake model tells sessions apart by the user id of the system message.
+    """
+    user_id = session + 1
+    turns = []
+    for message, calls in SCENARIO:
+        calls = [(name, dict(arguments, user_id=user_id) if name != "search_products" else arguments) for name, arguments in calls]
+        turns.append((message, calls))
+    return turns
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_for_postgres(params, timeout=60):
+    import psycopg2
+
+    deadline = time.time() + timeout
+    while True:
+        try:
+            psycopg2.connect(**params).close()
+            return
+        except psycopg2.OperationalError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.5)
+
+@contextmanager
+def disposable_postgres():
+    """
+    A throwaway Postgres with pgvector, removed on exit: a local initdb/pg_ctl cluster when
+    the binaries are on PATH (pgvector must be installed for them), otherwise a docker container.
+    """
+    port = free_port()
+    if shutil.which("initdb") and shutil.which("pg_ctl"):
+        data_dir = tempfile.mkdtemp(prefix="bench-postgres-")
+        subprocess.run(["initdb", "-D", data_dir, "-U", "bench", "--auth=trust"], check=True, capture_output=True)
+        subprocess.run(
+            ["pg_ctl", "-D", data_dir, "-w", "-l", os.path.join(data_dir, "postgres.log"),
+             "-o", f"-p {port} -k {data_dir} -c listen_addresses=localhost", "start"],
+            check=True, capture_output=True,
+        )
+        try:
+            params = {"user": "bench", "password": "", "host": "localhost", "port": port, "database": "postgres"}
+            _wait_for_postgres(params)
+            yield params
+        finally:
+            subprocess.run(["pg_ctl", "-D", data_dir, "-m", "immediate", "stop"], capture_output=True)
+            shutil.rmtree(data_dir, ignore_errors=True)
+    elif shutil.which("docker"):
+        container = subprocess.run(
+            ["docker", "run", "-d", "--rm", "-e", "POSTGRES_USER=bench", "-e", "POSTGRES_PASSWORD=bench",
+             "-e", "POSTGRES_DB=bench", "-p", f"127.0.0.1:{port}:5432", PGVECTOR_IMAGE],
+            check=True, capture_output=True, text=True,
+        ).stdout.strip()
+        try:
+            params = {"user": "bench", "password": "bench", "host": "localhost", "port": port, "database": "bench"}
+            _wait_for_postgres(params)
+            yield params
+        finally:
+            subprocess.run(["docker", "stop", container], capture_output=True)
+    else:
+        raise RuntimeError("The benchmark needs initdb and pg_ctl (with pgvector installed) or docker on PATH")
+
+def load_database(params):
+    """Create the app's tables from database/*.sql, load product_listing.csv and apply the migrations."""
+    import psycopg2
+    from utils.migrate import apply_migrations
+
+    conn = psycopg2.connect(**params)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            for name in ("users.sql", "shopping_cart.sql", "embedding_cache.sql"):
+                with open(os.path.join(DATABASE_DIR, name)) as file:
+                    cur.execute(file.read())
+
+            ## product_listing.sql copies from a server-side path; send the CSV from here instead
+            with open(os.path.join(DATABASE_DIR, "product_listing.sql")) as file:
+                sql = file.read()
+            copy = re.search(r"COPY (\w+\([^)]*\))\s+FROM '[^']*'[^;]*;", sql)
+            cur.execute(sql[:copy.start()])
+            with open(os.path.join(DATABASE_DIR, "product_listing.csv")) as file:
+                cur.copy_expert(f"COPY {copy.group(1)} FROM STDIN WITH (FORMAT csv, HEADER true)", file)
+            cur.execute(sql[copy.end():])
+
+        apply_migrations(conn)
+    finally:
+        conn.close()
+
+@contextmanager
+def existing_database(db_url):
+    from urllib.parse import urlparse
+
+    url = urlparse(db_url)
+    yield {"user": url.username, "password": url.password or "", "host": url.hostname,
+           "port": url.port or 5432, "database": url.path.lstrip("/")}
+
+def point_app_at(params, fake, embed_window_ms=5):
+    """Aim the app's modules at the disposable database and the fake API through their configure hooks."""
+    ## The OpenAI clients read these when they are created; utils.pool needs the DB* ones at import
+    os.environ.update(
+        OPENAI_BASE_URL=fake.base_url, OPENAI_KEY="fake",
+        DBUSER=params["user"], DBPASS=params["password"], DBHOST=params["host"], DBNAME=params["database"],
+    )
+    from utils import pool
+    from utils import embedding
+    from utils import embedding_providers
+
+    ## The catalog loaded from product_listing.csv is tagged with the model its vectors came from
+    embedding_providers.set_provider(embedding_providers.OpenAIProvider("text-embedding-3-small", 1536, version=""))
+    pool.configure(user=params["user"], password=params["password"], host=params["host"], port=params["port"],
+                   database=params["database"], sslmode="disable")
+    ## Memory-only cache; concurrent sessions are what the batch window is for (off by default in the app)
+    embedding.reset_cache(batch_window_ms=embed_window_ms)
+
+
+def reset_caches():
+    """Cold start: no embedding or search results carried over from the previous run."""
+    from utils import embedding
+    from utils import result_cache
+
+    embedding.get_cache().clear()
+    result_cache.invalidate()
+
+def reset_carts():
+    from utils import pool
+    from utils import cart_cache
+
+    with pool.cursor() as cur:
+        cur.execute("DELETE FROM shopping_cart")
+    cart_cache.clear()
+
+
+def run_session(session, recorder):
+    """Play one session's scenario through llm.reply_prompt; returns the number of turns."""
+    from utils import llm
+    from utils import history
+
+    conversation = history.HistoryManager()
+    messages = []
+    for message, _ in session_script(session):
+        messages.append({"role": "user", "content": message})
+        started = time.perf_counter()
+        response, _ = llm.reply_prompt(messages=list(messages), prompt=message, history=conversation, user_id=session + 1)
+        chunks = []
+        for chunk in response:
+            if not chunks:
+                recorder.add("reply.first_chunk", time.perf_counter() - started)
+            chunks.append(chunk)
+        recorder.add("reply.total", time.perf_counter() - started)
+        messages.append({"role": "assistant", "content": "".join(chunks)})
+    return len(messages) // 2
+
+async def run_session_async(session, recorder):
+    """run_session through llm_async.reply_prompt."""
+    from utils import llm_async
+    from utils import history
+
+    conversation = history.HistoryManager()
+    messages = []
+    for message, _ in session_script(session):
+        messages.append({"role": "user", "content": message})
+        started = time.perf_counter()
+        response, _ = await llm_async.reply_prompt(messages=list(messages), prompt=message, history=conversation,
+                                                   user_id=session + 1)
+        chunks = []
+        async for chunk in response:
+            if not chunks:
+                recorder.add("reply.first_chunk", time.perf_counter() - started)
+            chunks.append(chunk)
+        recorder.add("reply.total", time.perf_counter() - started)
+        messages.append({"role": "assistant", "content": "".join(chunks)})
+    return len(messages) // 2
+
+def run_async(function, *args):
+    """asyncio.run(function(*args)), closing the asyncpg pool of that loop before it ends."""
+    from utils import db_llm_async
+
+    async def main():
+        try:
+            return await function(*args)
+        finally:
+            await db_llm_async.close_pool()
+    return asyncio.run(main())
+
+@contextmanager
+def instrumented(recorder):
+    """Time every stage and tool call of reply_prompt (sync or async) from their tracing spans."""
+    from utils import tracing
+
+    def record(span, duration):
+        if span.name == "tool":
+            recorder.add(f"tool.{span.attributes.get('tool')}", duration)
+        else:
+            recorder.add(f"stage.{span.name}", duration)
+
+    enabled, trace_log = tracing.TRACING, tracing.TRACE_LOG
+    tracing.configure(enabled=True, trace_log=os.devnull)
+    tracing.add_listener(record)
+    try:
+        yield
+    finally:
+        tracing.remove_listener(record)
+        tracing.configure(enabled=enabled, trace_log=trace_log)
+
+def bench_db_llm(recorder, iterations, warm):
+    """Every db_llm tool called directly, without the model in between."""
+    from utils import db_llm
+
+    for session in range(iterations):
+        reset_carts()
+        if not warm:
+            reset_caches()
+        for _, calls in session_script(session):
+            for name, arguments in calls:
+                handler = getattr(db_llm, DB_LLM_TOOLS.get(name, name))
+                recorder.timed(f"db_llm.{name}", handler)(**arguments)
+                if name in ROW_TOOLS:
+                    recorder.timed(f"db_llm.{ROW_TOOLS[name]}", getattr(db_llm, ROW_TOOLS[name]))(**arguments)
+
+async def bench_db_llm_async(recorder, iterations, warm):
+    """bench_db_llm with the db_llm_async tools."""
+    from utils import db_llm_async
+
+    for session in range(iterations):
+        reset_carts()
+        if not warm:
+            reset_caches()
+        for _, calls in session_script(session):
+            for name, arguments in calls:
+                functions = [(name, DB_LLM_TOOLS.get(name, name))]
+                if name in ROW_TOOLS:
+                    functions.append((ROW_TOOLS[name], ROW_TOOLS[name]))
+                for stage, function in functions:
+                    started = time.perf_counter()
+                    await getattr(db_llm_async, function)(**arguments)
+                    recorder.add(f"db_llm.{stage}", time.perf_counter() - started)
+
+def bench_concurrency(sessions, rounds, warm):
+    """Run `sessions` conversations at once; returns throughput and the per-turn latencies."""
+    recorder = Recorder()
+    turns = 0
+    elapsed = 0.0
+    for _ in range(rounds):
+        reset_carts()
+        if warm:
+            run_session(0, Recorder())
+            reset_carts()
+        else:
+            reset_caches()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            turns += sum(executor.map(lambda session: run_session(session, recorder), range(sessions)))
+        elapsed += time.perf_counter() - started
+    return {
+        "sessions": sessions,
+        "turns": turns,
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(turns / elapsed, 2) if elapsed else None,
+        "reply": recorder.summary("reply."),
+    }
+
+def bench_concurrency_async(sessions, rounds, warm):
+    """bench_concurrency with the sessions as tasks of one event loop instead of threads."""
+    recorder = Recorder()
+    turns = 0
+    elapsed = 0.0
+    for _ in range(rounds):
+        reset_carts()
+        if warm:
+            run_async(run_session_async, 0, Recorder())
+            reset_carts()
+        else:
+            reset_caches()
+
+        async def all_sessions():
+            return await asyncio.gather(*(run_session_async(session, recorder) for session in range(sessions)))
+
+        started = time.perf_counter()
+        turns += sum(run_async(all_sessions))
+        elapsed += time.perf_counter() - started
+    return {
+        "sessions": sessions,
+        "turns": turns,
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(turns / elapsed, 2) if elapsed else None,
+        "reply": recorder.summary("reply."),
+    }
+
+def bench_pipeline(args, asynchronous=False):
+    """Per-stage, per-tool and concurrency numbers of the sync (threads) or async (asyncio) pipeline."""
+    recorder = Recorder()
+    if asynchronous:
+        run_async(bench_db_llm_async, recorder, args.iterations, args.warm)
+    else:
+        bench_db_llm(recorder, args.iterations, args.warm)
+    with instrumented(recorder):
+        for _ in range(args.iterations):
+            reset_carts()
+            if not args.warm:
+                reset_caches()
+            if asynchronous:
+                run_async(run_session_async, 0, recorder)
+            else:
+                run_session(0, recorder)
+
+    concurrency = bench_concurrency_async if asynchronous else bench_concurrency
+    return {
+        "stages": {**recorder.summary("reply."), **recorder.summary("stage.")},
+        "tools": recorder.summary("tool."),
+        "db_llm": recorder.summary("db_llm."),
+        "concurrency": [concurrency(sessions, args.rounds, args.warm) for sessions in args.concurrency],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    script = dict(session_script(0))
+    fake = FakeOpenAI(script, ttft=args.ttft_ms / 1000, token=args.token_ms / 1000, embed=args.embed_ms / 1000)
+
+    with fake, (existing_database(args.db) if args.db else disposable_postgres()) as params:
+        if not args.db:
+            print(f"Loading the benchmark database on port {params['port']}...")
+            load_database(params)
+        point_app_at(params, fake, args.embed_window_ms)
+
+        pipeline = bench_pipeline(args)
+        results = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "config": {
+                "iterations": args.iterations, "warm": args.warm, "ttft_ms": args.ttft_ms,
+                "token_ms": args.token_ms, "embed_ms": args.embed_ms, "embed_window_ms": args.embed_window_ms,
+                "response_mode": os.getenv("RESPONSE_MODE", "template"),
+                "search_engine": os.getenv("SEARCH_ENGINE", "sql"),
+                "intent_router": os.getenv("INTENT_ROUTER", "1") == "1",
+                "async": not args.skip_async,
+            },
+            **pipeline,
+        }
+        if not args.skip_async:
+            results["async"] = bench_pipeline(args, asynchronous=True)
+        results["openai_requests"] = dict(fake.requests)
+    return results
+
+def print_report(results, baseline=None):
+    def line(label, stats, old):
+        text = f"{label:<50} p50 {stats['p50_ms']:>9.1f}  p95 {stats['p95_ms']:>9.1f}  p99 {stats['p99_ms']:>9.1f} ms"
+        if old:
+            text += f"  (p50 {stats['p50_ms'] - old['p50_ms']:+.1f} ms vs baseline)"
+        print(text)
+
+    for prefix, pipeline, base in (("", results, baseline), ("async.", results.get("async"), (baseline or {}).get("async"))):
+        if not pipeline:
+            continue
+        for section in ("stages", "tools", "db_llm"):
+            for name, stats in pipeline[section].items():
+                line(f"{prefix}{section}.{name}", stats, (base or {}).get(section, {}).get(name))
+        for run in pipeline["concurrency"]:
+            print(f"{prefix + str(run['sessions']):>9} sessions: {run['turns_per_second']} turns/s, "
+                  f"reply p95 {run['reply'].get('total', {}).get('p95_ms')} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline latency benchmark of reply_prompt and the db_llm tools.")
+    parser.add_argument("--iterations", type=int, default=5, help="scenario runs for the per-stage numbers")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="concurrent sessions to measure")
+    parser.add_argument("--rounds", type=int, default=2, help="runs per concurrency level")
+    parser.add_argument("--warm", action="store_true", help="keep the embedding, search and cart caches between runs")
+    parser.add_argument("--ttft-ms", type=float, default=300, help="fake model latency before the first chunk")
+    parser.add_argument("--token-ms", type=float, default=10, help="fake model latency between chunks")
+    parser.add_argument("--embed-ms", type=float, default=50, help="fake embeddings request latency")
+    parser.add_argument("--embed-window-ms", type=float, default=5, help="embedding batch window of the sessions (EMBED_BATCH_WINDOW_MS)")
+    parser.add_argument("--skip-async", action="store_true", help="don't measure the asyncio pipeline (llm_async, db_llm_async)")
+    parser.add_argument("--db", help="postgresql:// URL of an already loaded, disposable database to use instead")
+    parser.add_argument("--output", help="JSON results path (default bench_results/<time>.json)")
+    parser.add_argument("--compare", help="earlier JSON results to show p50 differences against")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_report(results, baseline)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
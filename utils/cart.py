@@ -0,0 +1,178 @@
+import os
+import re
+from dotenv import load_dotenv
+from utils import cart_cache
+
+load_dotenv(override=True)
+
+## Single-statement cart writes. They rely on the partial unique index
+## shopping_cart_cart_item (user_id, product_id) WHERE status = 'CART'.
+
+def upsert_sql(source):
+    """INSERT ... ON CONFLICT adding the quantities of source (product_id, quantity rows) to the user's cart."""
+    return f"""
+        INSERT INTO shopping_cart (user_id, product_id, quantity, status)
+        SELECT %(user_id)s::INT, product_id, SUM(quantity), 'CART'
+        FROM {source}
+        GROUP BY product_id
+        ON CONFLICT (user_id, product_id) WHERE status = 'CART'
+        DO UPDATE SET quantity = shopping_cart.quantity + EXCLUDED.quantity
+        RETURNING product_id, quantity, (xmax = 0) AS inserted
+    """
+
+## Statements of the helpers below, with %(name)s placeholders; utils/db_llm_async.py runs
+## the same strings through numbered()
+ADD_ITEMS_SQL = upsert_sql("unnest(%(product_ids)s::int[], %(quantities)s::int[]) AS items(product_id, quantity)")
+
+REMOVE_ITEMS_SQL = """
+    DELETE FROM shopping_cart
+    WHERE user_id = %(user_id)s AND status = 'CART' AND product_id = ANY(%(product_ids)s::int[])
+    RETURNING product_id
+"""
+
+SET_QUANTITIES_SQL = """
+    UPDATE shopping_cart sc
+    SET quantity = items.quantity
+    FROM unnest(%(product_ids)s::int[], %(quantities)s::int[]) AS items(product_id, quantity)
+    WHERE sc.user_id = %(user_id)s AND sc.status = 'CART'
+        AND sc.product_id = items.product_id AND sc.quantity <> items.quantity
+    RETURNING sc.product_id
+"""
+
+def items_params(user_id, items):
+    """Parameters of ADD_ITEMS_SQL and SET_QUANTITIES_SQL for [(product_id, quantity)]."""
+    return {
+        "user_id": user_id,
+        "product_ids": [product_id for product_id, _ in items],
+        "quantities": [quantity for _, quantity in items],
+    }
+
+def add_items(cur, user_id, items):
+    """
+    Add [(product_id, quantity)] to the cart in one round trip.
+    Returns [(product_id, new_quantity, inserted)], inserted is False when the row already existed.
+    """
+    if not items:
+        return []
+    cur.execute(ADD_ITEMS_SQL, items_params(user_id, items))
+    results = cur.fetchall()
+    cart_cache.invalidate(user_id)
+
+    return results
+
+def remove_items(cur, user_id, product_ids):
+    """Delete the products from the cart in one round trip; returns the removed product ids."""
+    if not product_ids:
+        return []
+    cur.execute(REMOVE_ITEMS_SQL, {"user_id": user_id, "product_ids": list(product_ids)})
+    removed = [row[0] for row in cur.fetchall()]
+    cart_cache.invalidate(user_id)
+
+    return removed
+
+def set_quantities(cur, user_id, items):
+    """Set [(product_id, quantity)] in one round trip; returns the product ids whose quantity changed."""
+    if not items:
+        return []
+    cur.execute(SET_QUANTITIES_SQL, items_params(user_id, items))
+    updated = [row[0] for row in cur.fetchall()]
+    cart_cache.invalidate(user_id)
+
+    return updated
+
+## Order history (database/migrations/007_shopping_cart_orders.sql)
+STATUS_ORDERS = int(os.getenv("STATUS_ORDERS", 5))              # orders listed per check_products_status call
+STATUS_ORDER_PRODUCTS = int(os.getenv("STATUS_ORDER_PRODUCTS", 3))  # product names shown per order
+
+PAY_SQL = """
+    WITH new_order AS (
+        SELECT nextval('shopping_cart_order_id') AS order_id
+        WHERE EXISTS (SELECT 1 FROM shopping_cart WHERE user_id = %(user_id)s AND status = 'CART' AND quantity > 0)
+    )
+    UPDATE shopping_cart
+    SET status = 'PAID', status_date = CURRENT_DATE, estimated_arrival_date = CURRENT_DATE + 3,
+        order_id = new_order.order_id
+    FROM new_order
+    WHERE user_id = %(user_id)s AND status = 'CART'
+    RETURNING product_id
+"""
+
+def pay(cur, user_id):
+    """Turn the user's cart into one order in a single statement; returns the paid product ids."""
+    cur.execute(PAY_SQL, {"user_id": user_id})
+    paid = [row[0] for row in cur.fetchall()]
+    if paid:
+        cart_cache.invalidate(user_id)
+
+    return paid
+
+## Cart rows (first page only), one summary row per order of the page, latest first, and a hint row
+## carrying the key of the next page when older orders exist. Pages are keyed by order id
+## ("orders before #n"), so every page is an index range scan whatever the history size;
+## rows per call are bounded by the cart size and STATUS_ORDERS.
+ORDER_STATUS_SQL = """
+    WITH page_orders AS (
+        SELECT DISTINCT order_id
+        FROM order_items
+        WHERE user_id = %(user_id)s AND order_id < COALESCE(%(before)s::BIGINT, 9223372036854775807)
+        ORDER BY order_id DESC
+        LIMIT %(orders)s + 1
+    ),
+    listed AS (
+        SELECT order_id FROM page_orders ORDER BY order_id DESC LIMIT %(orders)s
+    ),
+    orders AS (
+        SELECT
+            oi.order_id,
+            MIN(oi.status) AS status,
+            MAX(oi.estimated_arrival_date) AS estimated_arrival_date,
+            SUM(oi.quantity) AS quantity,
+            COUNT(*) AS products,
+            (ARRAY_AGG(SUBSTRING(p.name, 1, 50) ORDER BY oi.id))[1:%(names)s] AS names
+        FROM order_items oi
+        JOIN product_listing p ON oi.product_id = p.id
+        WHERE oi.user_id = %(user_id)s AND oi.order_id IN (SELECT order_id FROM listed)
+        GROUP BY oi.order_id
+    )
+    SELECT name, quantity, status, estimated_arrival_date
+    FROM (
+        SELECT 0 AS section, NULL::BIGINT AS order_id, sc.id, p.name, sc.quantity::TEXT AS quantity, sc.status, sc.estimated_arrival_date
+        FROM shopping_cart sc
+        JOIN product_listing p ON sc.product_id = p.id
+        WHERE sc.user_id = %(user_id)s AND sc.status = 'CART' AND %(before)s::BIGINT IS NULL
+        UNION ALL
+        SELECT 1, order_id, NULL,
+            'Order #' || order_id || ': ' || ARRAY_TO_STRING(names, ', ')
+                || CASE WHEN products > %(names)s THEN ' and ' || (products - %(names)s) || ' more' ELSE '' END,
+            quantity::TEXT, status, estimated_arrival_date
+        FROM orders
+        UNION ALL
+        SELECT 2, NULL, NULL, 'Older orders: ask for orders before #' || (SELECT MIN(order_id) FROM listed), '', '', NULL
+        WHERE (SELECT COUNT(*) FROM page_orders) > %(orders)s
+    ) status_rows
+    ORDER BY section, order_id DESC, id
+"""
+
+def order_status_params(user_id, before_order_id=None, orders=STATUS_ORDERS):
+    return {
+        "user_id": user_id,
+        "before": int(before_order_id) if before_order_id else None,
+        "orders": orders,
+        "names": STATUS_ORDER_PRODUCTS,
+    }
+
+def order_status(cur, user_id, before_order_id=None, orders=STATUS_ORDERS):
+    """
+    (name, quantity, status, estimated_arrival_date) rows of the cart and the latest orders, or of
+    the orders older than before_order_id, see ORDER_STATUS_SQL.
+    """
+    cur.execute(ORDER_STATUS_SQL, order_status_params(user_id, before_order_id, orders))
+
+    return cur.fetchall()
+
+def numbered(sql, params):
+    """(sql, args) with the %(name)s placeholders turned into $1, $2, ... for asyncpg."""
+    names = list(dict.fromkeys(re.findall(r"%\((\w+)\)s", sql)))
+    for position, name in enumerate(names, start=1):
+        sql = sql.replace(f"%({name})s", f"${position}")
+    return sql, [params[name] for name in names]
@@ -0,0 +1,44 @@
+import threading
+
+## Per-user cache of the sidebar cart. Entries only go stale through invalidate(),
+## which every cart mutation (db.add_product_cart, db.buy_product_cart and the
+## db_llm cart tools) calls after writing, so reruns without a change never hit Postgres.
+_entries = {}
+_versions = {}
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+def get(user_id, loader):
+    """Cached loader(user_id) result for the user, loading it on the first read after a change."""
+    global hits, misses
+    with _lock:
+        version = _versions.get(user_id, 0)
+        entry = _entries.get(user_id)
+        if entry is not None and entry[0] == version:
+            hits += 1
+            return entry[1]
+        misses += 1
+
+    value = loader(user_id)
+
+    with _lock:
+        ## Don't store a result that a write made stale while it was loading
+        if _versions.get(user_id, 0) == version:
+            _entries[user_id] = (version, value)
+    return value
+
+def invalidate(user_id):
+    with _lock:
+        _versions[user_id] = _versions.get(user_id, 0) + 1
+        _entries.pop(user_id, None)
+
+def clear():
+    with _lock:
+        for user_id in _versions:
+            _versions[user_id] += 1
+        _entries.clear()
+
+def stats():
+    with _lock:
+        return {"users": len(_entries), "hits": hits, "misses": misses}
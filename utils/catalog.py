@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+from utils import pool
+
+## Storefront settings
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", 600))                          # seconds before the snapshot is reloaded
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", 6))
+CATALOG_PER_SUB_CATEGORY = int(os.getenv("CATALOG_PER_SUB_CATEGORY", 6))    # top-rated items kept per sub_category
+CATALOG_MAX_ITEMS = int(os.getenv("CATALOG_MAX_ITEMS", 240))                # upper bound on the snapshot size
+IMAGE_DIR = "image_product"
+
+
+def local_image(product_id, image_url):
+    """Bundled images are saved as image_product/<id>_<file name of the image URL>; fall back to the URL."""
+    if image_url:
+        path = os.path.join(IMAGE_DIR, f"{product_id}_{os.path.basename(image_url)}")
+        if os.path.exists(path):
+            return path
+    return image_url
+
+
+def _caption(name, price, max_length=50):
+    if len(name) > max_length:
+        name = name[:max_length].rstrip() + "..."
+    return f"{name} - ${price:.2f}"
+
+
+class CatalogSnapshot:
+    """
+    The storefront's featured products, held in memory and shared by every session.
+    Reloaded when older than the TTL or after invalidate(), so a rerun costs no database round trip.
+    """
+
+    def __init__(self, ttl=CATALOG_TTL, per_sub_category=CATALOG_PER_SUB_CATEGORY, max_items=CATALOG_MAX_ITEMS):
+        self.ttl = ttl
+        self.per_sub_category = per_sub_category
+        self.max_items = max_items
+        self.products = []
+        self.loaded_at = 0.0
+        self.version = 0
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with pool.cursor() as cur:
+            cur.execute("""
+                SELECT id, name, sub_category, image, discount_price_dollar, ratings
+                FROM (
+                    SELECT id, name, sub_category, image, discount_price_dollar, ratings,
+                        ROW_NUMBER() OVER (PARTITION BY sub_category ORDER BY ratings DESC NULLS LAST, id) AS position
+                    FROM product_listing
+                    WHERE discount_price_dollar IS NOT NULL
+                ) ranked
+                WHERE position <= %s
+                ORDER BY position, ratings DESC NULLS LAST, id
+                LIMIT %s
+            """, (self.per_sub_category, self.max_items))
+            rows = cur.fetchall()
+
+        return [
+            {
+                "id": product_id,
+                "name": name,
+                "sub_category": sub_category,
+                "image": local_image(product_id, image_url),
+                "price": price,
+                "ratings": ratings,
+                "caption": _caption(name, price),
+            }
+            for product_id, name, sub_category, image_url, price, ratings in rows
+        ]
+
+    def invalidate(self):
+        """Change signal: the next read reloads, e.g. after products are ingested or repriced."""
+        self._stale = True
+
+    def get_products(self):
+        if self._stale or time.time() - self.loaded_at > self.ttl:
+            with self._lock:
+                if self._stale or time.time() - self.loaded_at > self.ttl:
+                    self.products = self._load()
+                    self.loaded_at = time.time()
+                    self.version += 1
+                    self._stale = False
+        return self.products
+
+    def get_page(self, page=0, page_size=CATALOG_PAGE_SIZE):
+        """Products of one page and the number of pages."""
+        products = self.get_products()
+        page_count = max(1, -(-len(products) // page_size))
+        page = min(max(page, 0), page_count - 1)
+
+        return products[page * page_size:(page + 1) * page_size], page_count
+
+
+snapshot = CatalogSnapshot()
+
+def get_page(page=0, page_size=CATALOG_PAGE_SIZE):
+    return snapshot.get_page(page, page_size)
+
+def invalidate():
+    snapshot.invalidate()
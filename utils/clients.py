@@ -0,0 +1,44 @@
+import os
+import asyncio
+import threading
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+## One OpenAI client of each kind per process, built on first use so importing
+## the utils package never touches the network or pays for importing openai
+_clients = {}
+_lock = threading.Lock()
+## Async clients hold connections of the event loop they were first used on, so each
+## running loop gets its own (asyncio.run per call, a loop per thread)
+_async_clients = {}
+
+def _get(kind):
+    client = _clients.get(kind)
+    if client is None:
+        with _lock:
+            client = _clients.get(kind)
+            if client is None:
+                import openai
+
+                factory = openai.AsyncOpenAI if kind == "async" else openai.OpenAI
+                client = _clients[kind] = factory(api_key=os.getenv("OPENAI_KEY"))
+    return client
+
+def get_openai_client():
+    return _get("sync")
+
+def get_async_openai_client():
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _get("async")
+    client = _async_clients.get(loop)
+    if client is None:
+        with _lock:
+            for closed in [other for other in _async_clients if other.is_closed()]:
+                del _async_clients[closed]
+            import openai
+
+            client = _async_clients[loop] = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"))
+    return client
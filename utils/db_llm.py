@@ -1,238 +1,328 @@
 import os
-import openai
-import numpy as np
+import time
 import psycopg2
-from pgvector.psycopg2 import register_vector
 from dotenv import load_dotenv
+from utils import cart
+from utils import cart_cache
+from utils import embedding
+from utils import embedding_providers
+from utils import pool
+from utils import result_cache
+from utils import search_filters
+from utils import tracing
+from utils import vector_index
+from utils import vector_storage
 
 load_dotenv(override=True)
 
-client = openai.OpenAI(api_key=os.getenv("OPENAI_KEY"))
-
-## Set up Postgres
-DBUSER = os.environ["DBUSER"]
-DBPASS = os.environ["DBPASS"]
-DBHOST = os.environ["DBHOST"]
-DBNAME = os.environ["DBNAME"]
-## Use SSL if not connecting to localhost
-DBSSL = "disable"
-if DBHOST != "localhost":
-    DBSSL = "require"
-
-# Function to connect to the database
-try:
-    conn = psycopg2.connect(database=DBNAME, user=DBUSER, password=DBPASS, host=DBHOST, sslmode=DBSSL)
-    conn.autocommit = True
-    cur = conn.cursor()
-    register_vector(conn)
-    cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
-
-except Exception as error:
-    print(f"Error connecting to the database: {error}")
-    raise error
-
-def search_products_llm(search_query: str, price_filter: dict = None):
-    response = client.embeddings.create(input=search_query, model=os.getenv("OPENAI_EMBED"), dimensions=1536)
-    embedding = np.array(response.data[0].embedding)
-
-    where_price_filter = "WHERE 1=1"
-    if price_filter:
-        where_price_filter += f"AND discount_price_dollar {price_filter['comparison_operator']} {price_filter['value']}" 
-
-    SQL_search = f"""
-    WITH semantic_search AS (
-        SELECT id, RANK() OVER (ORDER BY embedded_description <=> %(embedding)s) AS rank
-        FROM product_listing
-        {where_price_filter}
-        ORDER BY embedded_description <=> %(embedding)s
-        LIMIT 20
-    ),
-    keyword_search AS (
-        SELECT id, RANK() OVER (ORDER BY ts_rank_cd(to_tsvector('english', description), query) DESC)
-        FROM product_listing, plainto_tsquery('english', %(query)s) query
-        {where_price_filter} AND to_tsvector('english', description) @@ query
-        ORDER BY ts_rank_cd(to_tsvector('english', description), query) DESC
-        LIMIT 20
-    )
-    SELECT
-        COALESCE(semantic_search.id, keyword_search.id) AS id,
-        COALESCE(1.0 / (%(k)s + semantic_search.rank), 0.0) +
-        COALESCE(1.0 / (%(k)s + keyword_search.rank), 0.0) AS score
-    FROM semantic_search
-    FULL OUTER JOIN keyword_search ON semantic_search.id = keyword_search.id
-    ORDER BY score DESC
-    LIMIT 5
+## Semantic search engine: "sql" runs the hybrid CTE in Postgres,
+## "numpy" ranks vectors in-process and only sends the keyword search to Postgres
+SEARCH_ENGINE = os.getenv("SEARCH_ENGINE", "sql")
+SEARCH_RRF_K = int(os.getenv("SEARCH_RRF_K", 60))                # RRF constant: score = 1 / (k + rank) per half
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", 20))      # semantic and keyword matches fused per search
+product_index = vector_index.VectorIndex()
+
+def hybrid_search_args(conditions=(), limit=5):
+    """Named arguments of the hybrid_search() SQL function (database/migrations/008_embedding_model.sql)."""
+    return {
+        "k": SEARCH_RRF_K,
+        "candidates": SEARCH_CANDIDATES,
+        "result_limit": limit,
+        **search_filters.function_args(conditions),
+        "compact_dimensions": vector_storage.EMBED_SEARCH_DIMENSIONS,
+        "compact_precision": vector_storage.EMBED_SEARCH_PRECISION,
+        "rerank_candidates": vector_storage.RERANK_CANDIDATES,
+        "embedding_model": embedding_providers.get_provider().tag,
+    }
+
+def hybrid_search_sql(args, query_sql="%(query)s", embedding_sql="%(embedding)s", first=None):
+    """
+    hybrid_search(...) call binding every argument in args. Placeholders are %(name)s (psycopg2),
+    or $first, $first+1, ... in the order of args (asyncpg).
     """
+    if first is None:
+        placeholders = [f"%({name})s" for name in args]
+    else:
+        placeholders = [f"${position}" for position in range(first, first + len(args))]
+    named = ", ".join(f"{name} => {placeholder}" for name, placeholder in zip(args, placeholders))
+    return f"hybrid_search({query_sql}, ({embedding_sql})::vector, {named})"
 
-    cur.execute(SQL_search, {"query": search_query, "embedding": embedding, "k": 60})
-    results = cur.fetchall()
+def keyword_search(cur, search_query, conditions=(), limit=20):
+    predicate, params = search_filters.to_sql(conditions)
+    params.update(query=search_query, limit=limit)
 
-    ## Fetch the videos by ID
-    ids = [result[0] for result in results]
+    cur.execute(f"""
+        SELECT id, RANK() OVER (ORDER BY ts_rank_cd(search_vector, query) DESC)
+        FROM product_listing, plainto_tsquery('english', %(query)s) query
+        WHERE search_vector @@ query {"AND " + predicate if predicate else ""}
+        ORDER BY ts_rank_cd(search_vector, query) DESC
+        LIMIT %(limit)s
+    """, params)
+
+    return cur.fetchall()
+
+def hybrid_search_numpy(cur, search_query, query_embedding, conditions=(), limit=5):
+    """Same RRF fusion as the SQL path, with the semantic half answered by the in-process index."""
+    product_index.ensure_fresh(cur.connection)
+    semantic = product_index.search(query_embedding, k=SEARCH_CANDIDATES, conditions=conditions)
+    keyword = keyword_search(cur, search_query, conditions=conditions, limit=SEARCH_CANDIDATES)
+
+    return vector_index.reciprocal_rank_fusion(semantic, keyword, k=SEARCH_RRF_K, limit=limit)
+
+def refresh_product_index(product_ids=None):
+    """Call after product_listing rows change; re-reads only those rows (or checks for new/deleted ones)."""
+    result_cache.invalidate()
+    if SEARCH_ENGINE != "numpy":
+        return
+    with pool.connection() as conn:
+        if product_ids is None:
+            product_index.sync(conn)
+        else:
+            product_index.refresh(conn, product_ids)
+
+def sync_catalog_version(cur):
+    """Let the search cache see catalog changes made by other processes (database/migrations/003_catalog_version.sql)."""
+    if not result_cache.search_cache.version_due():
+        return
+    try:
+        cur.execute(result_cache.CATALOG_VERSION_SQL)
+        version = cur.fetchone()[0]
+    except psycopg2.Error:
+        ## Migration not applied yet: entries only expire by TTL
+        version = None
+    result_cache.search_cache.set_version(version)
+
+def first_cart_product(cur, user_id, ranked_ids):
+    """Best-ranked product among ranked_ids that is in the user's cart, as (product_id, quantity)."""
     cur.execute("""
-                SELECT id, name, discount_price_dollar, description, link
-                FROM product_listing 
-                WHERE id = ANY(%s)"""
-                , (ids,))
-    results = cur.fetchall()
+        SELECT product_id, quantity
+        FROM shopping_cart
+        WHERE user_id = %s AND status = 'CART' AND product_id = ANY(%s)
+        ORDER BY ARRAY_POSITION(%s, product_id)
+        LIMIT 1
+    """, (user_id, ranked_ids, ranked_ids))
+
+    return cur.fetchone()
 
-    ## Format the results for the LLM
+## Format the results for the LLM
+def format_search_results(results):
+    """results are (id, name, price, description, link) rows."""
     if not results:
         return "No matched products"
-    
+
     formatted_results = ""
     for result in results:
         formatted_results += f"## {result[1]}\n\nprice: ${result[2]}\n\ndescription: {result[3]}\n\nURL: {result[4]}"
-    
+
     return formatted_results
 
-# 0. show a user's cart
-def show_cart(user_id=1):
-    # Query to get product details and quantity from the shopping cart
-    cur.execute("""
-        SELECT SUBSTRING(p.name, 1, 50) AS name, p.discount_price_dollar, sc.quantity, (p.discount_price_dollar * sc.quantity) AS total_price
-        FROM shopping_cart sc
-        JOIN product_listing p ON sc.product_id = p.id
-        WHERE sc.user_id = %s AND sc.status = 'CART'
-    """, (user_id,))
-    
-    cart_items = cur.fetchall()
-
-    if cart_items:
-        total_all_prices = 0
-        formatted_results = ""
-        for item in cart_items:
-            product_name, price, quantity, total_price = item
-            total_all_prices += total_price
-            formatted_results += f"Product: {product_name}, Price: {price}, Quantity: {quantity}, Total: {total_price}\n"
-        formatted_results += f"\nTotal Price: {total_all_prices}"
-
-        return formatted_results
-    else:
+def format_cart(cart_items):
+    """cart_items are (name, price, quantity, total_price) rows."""
+    if not cart_items:
         return "Your shopping cart is empty."
-    
-# 1. Add product to cart
-def add_product_to_cart(user_id, search_query: str, quantity):
-    try:
-        ## Turn the question into an embedding
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_KEY"))
-        response = client.embeddings.create(input=search_query, model=os.getenv("OPENAI_EMBED"), dimensions=1536)
-        embedding = np.array(response.data[0].embedding)
 
-        SQL_search = f"""
-        WITH semantic_search AS (
-            SELECT id, RANK() OVER (ORDER BY embedded_description <=> %(embedding)s) AS rank
-            FROM product_listing
-            ORDER BY embedded_description <=> %(embedding)s
-            LIMIT 20
-        ),
-        keyword_search AS (
-            SELECT id, RANK() OVER (ORDER BY ts_rank_cd(to_tsvector('english', description), query) DESC)
-            FROM product_listing, plainto_tsquery('english', %(query)s) query
-            WHERE to_tsvector('english', description) @@ query
-            ORDER BY ts_rank_cd(to_tsvector('english', description), query) DESC
-            LIMIT 20
-        )
-        SELECT
-            COALESCE(semantic_search.id, keyword_search.id) AS id,
-            COALESCE(1.0 / (%(k)s + semantic_search.rank), 0.0) +
-            COALESCE(1.0 / (%(k)s + keyword_search.rank), 0.0) AS score
-        FROM semantic_search
-        FULL OUTER JOIN keyword_search ON semantic_search.id = keyword_search.id
-        ORDER BY score DESC
-        LIMIT 1
-        """
+    total_all_prices = 0
+    formatted_results = ""
+    for item in cart_items:
+        product_name, price, quantity, total_price = item
+        total_all_prices += total_price
+        formatted_results += f"Product: {product_name}, Price: {price}, Quantity: {quantity}, Total: {total_price}\n"
+    formatted_results += f"\nTotal Price: {total_all_prices}"
 
-        cur.execute(SQL_search, {"query": search_query, "embedding": embedding, "k": 60})
-        result = cur.fetchone()
-        product_id = result[0]
+    return formatted_results
 
-        # Check if product already exists in the cart
+def format_products_status(items):
+    """items are (name, quantity, status, estimated_arrival_date) rows."""
+    if not items:
+        return "There are no products."
+
+    formatted_results = ""
+    for item in items:
+        product_name, quantity, status, est_arrival = item
+        formatted_results += f"Product: {product_name}, Quantity: {quantity}, Status: {status}, Estimated Date Arrival: {est_arrival}\n, "
+
+    return formatted_results
+
+def fetch_products(cur, ids):
+    """(id, name, price, description, link) rows of the products, in the order of ids."""
+    cur.execute("""
+        SELECT id, name, discount_price_dollar, description, link
+        FROM product_listing
+        WHERE id = ANY(%(ids)s)
+        ORDER BY ARRAY_POSITION(%(ids)s, id)
+    """, {"ids": ids})
+
+    return cur.fetchall()
+
+def search_products_llm(search_query: str, filters: dict = None):
+    conditions = search_filters.parse(filters)
+    query_embedding = embedding.get_cache().get(search_query)
+
+    with pool.cursor() as cur, tracing.span("db.search", engine=SEARCH_ENGINE, filters=search_filters.key(conditions)) as span:
+        ## A near-identical earlier search (same filters) skips the hybrid query
+        sync_catalog_version(cur)
+        ids = result_cache.search_cache.lookup(query_embedding, conditions)
+        span.set(cache_hit=ids is not None)
+        results = None
+        if ids is None:
+            started = time.perf_counter()
+            if SEARCH_ENGINE == "numpy":
+                ids = [product_id for product_id, _ in hybrid_search_numpy(cur, search_query, query_embedding, conditions=conditions, limit=5)]
+            else:
+                ## Ranked product rows in one round trip
+                args = hybrid_search_args(conditions, limit=5)
+                cur.execute(f"""
+                    SELECT id, name, discount_price_dollar, description, link
+                    FROM {hybrid_search_sql(args)}
+                """, {"query": search_query, "embedding": query_embedding, **args})
+                results = cur.fetchall()
+                ids = [result[0] for result in results]
+            result_cache.search_cache.store(query_embedding, conditions, ids, time.perf_counter() - started)
+        span.set(rows=len(ids))
+
+        if results is None:
+            results = fetch_products(cur, ids)
+
+        return format_search_results(results)
+
+def cached_search_answer(search_query, filters=None):
+    """Written answer of a near-identical earlier search, if SEARCH_CACHE_ANSWERS is on."""
+    if not result_cache.SEARCH_CACHE_ANSWERS:
+        return None
+    conditions = search_filters.parse(filters)
+    return result_cache.search_cache.lookup_answer(embedding.get_cache().get(search_query), conditions)
+
+def store_search_answer(search_query, answer, answer_seconds, filters=None):
+    if result_cache.SEARCH_CACHE_ANSWERS:
+        conditions = search_filters.parse(filters)
+        result_cache.search_cache.store_answer(embedding.get_cache().get(search_query), conditions, answer, answer_seconds)
+
+# 0. show a user's cart
+def get_cart_items(user_id=1):
+    """(name, price, quantity, total_price) rows of the user's cart."""
+    with pool.cursor() as cur:
+        # Query to get product details and quantity from the shopping cart
         cur.execute("""
-            SELECT quantity 
-            FROM shopping_cart 
-            WHERE user_id = %s AND product_id = %s AND shopping_cart.status = 'CART'
-        """, (user_id, product_id))
-        
-        result = cur.fetchone()
-        
-        if result:
-            # If the product exists, update the quantity
-            new_quantity = result[0] + quantity
-            cur.execute("""
-                UPDATE shopping_cart 
-                SET quantity = %s 
-                WHERE user_id = %s AND product_id = %s AND shopping_cart.status = 'CART'
-            """, (new_quantity, user_id, product_id))
-
-            return "Done. Already add your product more."
-        else:
-            # If the product doesn't exist, insert a new row
-            cur.execute("""
-                INSERT INTO shopping_cart (user_id, product_id, quantity, status) 
-                VALUES (%s, %s, %s, 'CART')
-            """, (user_id, product_id, quantity))
+            SELECT SUBSTRING(p.name, 1, 50) AS name, p.discount_price_dollar, sc.quantity, (p.discount_price_dollar * sc.quantity) AS total_price
+            FROM shopping_cart sc
+            JOIN product_listing p ON sc.product_id = p.id
+            WHERE sc.user_id = %s AND sc.status = 'CART'
+        """, (user_id,))
+
+        return cur.fetchall()
 
+def show_cart(user_id=1):
+    return format_cart(get_cart_items(user_id))
+    
+# 1. Add product to cart
+def add_products_to_cart(user_id, items):
+    """
+    Add several products at once, e.g. "add 2 whey and 1 multivitamin".
+    items are {"search_query": ..., "quantity": ...}. With the sql engine every query is
+    resolved to its best product and upserted into the cart in a single statement.
+    Nothing is added when an item matches no product; the reply names those items.
+    """
+    try:
+        queries = [item["search_query"] for item in items]
+        quantities = [int(item.get("quantity") or 1) for item in items]
+        ## Turn the questions into embeddings
+        query_embeddings = [embedding.get_cache().get(search_query) for search_query in queries]
+
+        with pool.cursor() as cur:
+            if SEARCH_ENGINE == "numpy":
+                product_ids = []
+                for search_query, query_embedding in zip(queries, query_embeddings):
+                    best = hybrid_search_numpy(cur, search_query, query_embedding, limit=1)
+                    product_ids.append(best[0][0] if best else None)
+                unmatched = [search_query for search_query, product_id in zip(queries, product_ids) if product_id is None]
+                if unmatched:
+                    return "Error: no matched product for " + ", ".join(unmatched)
+                results = cart.add_items(cur, user_id, list(zip(product_ids, quantities)))
+            else:
+                args = hybrid_search_args(limit=1)
+                SQL_add = f"""
+                WITH items AS (
+                    SELECT query, embedding, quantity
+                    FROM unnest(%(queries)s::text[], %(embeddings)s::vector[], %(quantities)s::int[])
+                        AS t(query, embedding, quantity)
+                ),
+                matches AS (
+                    SELECT items.query, best.id AS product_id, items.quantity
+                    FROM items
+                    LEFT JOIN LATERAL {hybrid_search_sql(args, "items.query", "items.embedding")} best ON TRUE
+                ),
+                ## All or nothing, like the numpy engine
+                matched AS (
+                    SELECT product_id, quantity
+                    FROM matches
+                    WHERE NOT EXISTS (SELECT 1 FROM matches WHERE product_id IS NULL)
+                ),
+                added AS ({cart.upsert_sql("matched")})
+                SELECT product_id, quantity, inserted, NULL::TEXT AS unmatched
+                FROM added
+                UNION ALL
+                SELECT NULL, NULL, NULL, query
+                FROM matches
+                WHERE product_id IS NULL
+                """
+
+                cur.execute(SQL_add, {
+                    "queries": queries,
+                    "embeddings": query_embeddings,
+                    "quantities": quantities,
+                    "user_id": user_id,
+                    **args,
+                })
+                rows = cur.fetchall()
+                unmatched = [row[3] for row in rows if row[3] is not None]
+                if unmatched:
+                    return "Error: no matched product for " + ", ".join(unmatched)
+                results = [row[:3] for row in rows]
+                cart_cache.invalidate(user_id)
+
+        if not results:
+            return "Error: no matched product"
+        if all(inserted for _, _, inserted in results):
             return "Done. The product is in the shopping cart."
+        return "Done. Already add your product more."
 
     except (Exception, psycopg2.DatabaseError) as error:
         return f"Error: {error}"
+
+def add_product_to_cart(user_id, search_query: str, quantity=1):
+    return add_products_to_cart(user_id, [{"search_query": search_query, "quantity": quantity}])
     
 # 2. Remove product from cart
 def remove_product_from_cart(user_id, search_query):
     try:
         ## Turn the question into an embedding
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_KEY"))
-        response = client.embeddings.create(input=search_query, model=os.getenv("OPENAI_EMBED"), dimensions=1536)
-        embedding = np.array(response.data[0].embedding)
+        query_embedding = embedding.get_cache().get(search_query)
 
+        args = hybrid_search_args(limit=5)
         SQL_search = f"""
-        WITH semantic_search AS (
-            SELECT id, RANK() OVER (ORDER BY embedded_description <=> %(embedding)s) AS rank
-            FROM product_listing
-            ORDER BY embedded_description <=> %(embedding)s
-            LIMIT 20
-        ),
-        keyword_search AS (
-            SELECT id, RANK() OVER (ORDER BY ts_rank_cd(to_tsvector('english', description), query) DESC)
-            FROM product_listing, plainto_tsquery('english', %(query)s) query
-            WHERE to_tsvector('english', description) @@ query
-            ORDER BY ts_rank_cd(to_tsvector('english', description), query) DESC
-            LIMIT 20
-        ),
-        search AS (
-            SELECT
-                COALESCE(semantic_search.id, keyword_search.id) AS id,
-                COALESCE(1.0 / (%(k)s + semantic_search.rank), 0.0) +
-                COALESCE(1.0 / (%(k)s + keyword_search.rank), 0.0) AS score
-            FROM semantic_search
-            FULL OUTER JOIN keyword_search ON semantic_search.id = keyword_search.id
-            ORDER BY score DESC
-            LIMIT 5
-        )
-
         SELECT shopping_cart.product_id
-        FROM shopping_cart
-        INNER JOIN search ON shopping_cart.product_id = search.id
+        FROM {hybrid_search_sql(args)} search
+        INNER JOIN shopping_cart ON shopping_cart.product_id = search.id
         WHERE shopping_cart.user_id = %(user_id)s AND shopping_cart.status = 'CART'
         ORDER BY search.score DESC
         LIMIT 1
         """
 
-        cur.execute(SQL_search, {"query": search_query, "embedding": embedding, "k": 60, "user_id": user_id})
-        result = cur.fetchone()
-
-        if result:
-            product_id = result[0]
-            cur.execute("""
-                DELETE 
-                FROM shopping_cart 
-                WHERE user_id = %s AND product_id = %s AND status = 'CART'
-            """, (user_id, product_id))
-
-            return "Done"
-        else:
-            return "The product isn't in the cart."
+        with pool.cursor() as cur:
+            if SEARCH_ENGINE == "numpy":
+                ranked_ids = [product_id for product_id, _ in hybrid_search_numpy(cur, search_query, query_embedding, limit=5)]
+                result = first_cart_product(cur, user_id, ranked_ids)
+            else:
+                cur.execute(SQL_search, {"query": search_query, "embedding": query_embedding, "user_id": user_id, **args})
+                result = cur.fetchone()
+
+            if result:
+                product_id = result[0]
+                cart.remove_items(cur, user_id, [product_id])
+
+                return "Done"
+            else:
+                return "The product isn't in the cart."
     
     except (Exception, psycopg2.DatabaseError) as error:
         return f"Error: {error}"
@@ -242,60 +332,35 @@ def update_product_quantity(user_id, search_query, quantity=1):
     try:
         # Check if product already exists in the cart
         ## Turn the question into an embedding
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_KEY"))
-        response = client.embeddings.create(input=search_query, model=os.getenv("OPENAI_EMBED"), dimensions=1536)
-        embedding = np.array(response.data[0].embedding)
+        query_embedding = embedding.get_cache().get(search_query)
 
+        args = hybrid_search_args(limit=5)
         SQL_search = f"""
-        WITH semantic_search AS (
-            SELECT id, RANK() OVER (ORDER BY embedded_description <=> %(embedding)s) AS rank
-            FROM product_listing
-            ORDER BY embedded_description <=> %(embedding)s
-            LIMIT 20
-        ),
-        keyword_search AS (
-            SELECT id, RANK() OVER (ORDER BY ts_rank_cd(to_tsvector('english', description), query) DESC)
-            FROM product_listing, plainto_tsquery('english', %(query)s) query
-            WHERE to_tsvector('english', description) @@ query
-            ORDER BY ts_rank_cd(to_tsvector('english', description), query) DESC
-            LIMIT 20
-        ),
-        search AS (
-            SELECT
-                COALESCE(semantic_search.id, keyword_search.id) AS id,
-                COALESCE(1.0 / (%(k)s + semantic_search.rank), 0.0) +
-                COALESCE(1.0 / (%(k)s + keyword_search.rank), 0.0) AS score
-            FROM semantic_search
-            FULL OUTER JOIN keyword_search ON semantic_search.id = keyword_search.id
-            ORDER BY score DESC
-            LIMIT 5
-        )
-
         SELECT shopping_cart.product_id, shopping_cart.quantity
-        FROM shopping_cart
-        INNER JOIN search ON shopping_cart.product_id = search.id
+        FROM {hybrid_search_sql(args)} search
+        INNER JOIN shopping_cart ON shopping_cart.product_id = search.id
         WHERE shopping_cart.user_id = %(user_id)s AND shopping_cart.status = 'CART'
         ORDER BY search.score DESC
         LIMIT 1
         """
 
-        cur.execute(SQL_search, {"query": search_query, "embedding": embedding, "k": 60, "user_id": user_id})
-        result = cur.fetchone()
+        with pool.cursor() as cur:
+            if SEARCH_ENGINE == "numpy":
+                ranked_ids = [product_id for product_id, _ in hybrid_search_numpy(cur, search_query, query_embedding, limit=5)]
+                result = first_cart_product(cur, user_id, ranked_ids)
+            else:
+                cur.execute(SQL_search, {"query": search_query, "embedding": query_embedding, "user_id": user_id, **args})
+                result = cur.fetchone()
+
+            if not result:
+                return "The product is not in the cart."
+            if result[1] == quantity:
+                return "Please validate your quantity. They are same."
 
-        if result[1] == quantity:
-            return "Please validate your quantity. They are same."
-        elif result:
             product_id = result[0]
-            
-            cur.execute("""
-                UPDATE shopping_cart 
-                SET quantity = %s 
-                WHERE user_id = %s AND product_id = %s AND status = 'CART'
-            """, (quantity, user_id, product_id))
+            cart.set_quantities(cur, user_id, [(product_id, quantity)])
 
             return "Done"
-        else:
-            return "The product is not in the cart."
 
     except (Exception, psycopg2.DatabaseError) as error:
         return f"Error: {error}"
@@ -306,47 +371,22 @@ def pay_cart(user_id=1):
     Just Update that the user already paid for their products
     """
     try:
-        # Check if product already exists in the cart
-        cur.execute("""
-            SELECT product_id 
-            FROM shopping_cart 
-            WHERE user_id = %s AND quantity > 0 AND status = 'CART'
-        """, (user_id, ))
-
-        results = cur.fetchall()
-        if results:
-            cur.execute("""
-                        UPDATE shopping_cart 
-                        SET status = 'PAID', status_date = CURRENT_DATE, estimated_arrival_date = CURRENT_DATE + 3
-                        WHERE user_id = %s AND status = 'CART'
-                    """, (user_id, ))
-            
-            return "Done"
-        else:
-            return "There are no products in the shopping cart."
+        with pool.cursor() as cur:
+            if cart.pay(cur, user_id):
+                return "Done"
+            else:
+                return "There are no products in the shopping cart."
     
     except (Exception, psycopg2.DatabaseError) as error:
         return f"Error: {error}"
     
-def check_products_status(user_id=1):
+def get_products_status(user_id=1, before_order_id=None):
+    """(name, quantity, status, estimated_arrival_date) rows of the cart and of the latest orders, cart.STATUS_ORDERS per call."""
+    with pool.cursor() as cur:
+        return cart.order_status(cur, user_id, before_order_id)
+
+def check_products_status(user_id=1, before_order_id=None):
     try:
-        # Check if product already exists in the cart
-        cur.execute("""
-                    SELECT p.name, sc.quantity, sc.status, sc.estimated_arrival_date
-                    FROM shopping_cart sc
-                    JOIN product_listing p ON sc.product_id = p.id
-                    WHERE sc.user_id = %s
-                    """, (user_id, ))
-
-        items = cur.fetchall()
-        if items:
-            formatted_results = ""
-            for item in items:
-                product_name, quantity, status, est_arrival = item
-                formatted_results += f"Product: {product_name}, Quantity: {quantity}, Status: {status}, Estimated Date Arrival: {est_arrival}\n, "
-            
-            return formatted_results
-        else:
-            return "There are no products."
+        return format_products_status(get_products_status(user_id, before_order_id))
     except (Exception, psycopg2.DatabaseError) as error:
         return f"Error: {error}"
@@ -0,0 +1,245 @@
+## asyncio twins of the db_llm tools on an asyncpg pool. Independent steps overlap:
+## the cart lookup runs while the query is being embedded and searched, and several items resolve concurrently.
+import time
+import asyncio
+import asyncpg
+from pgvector.asyncpg import register_vector
+from utils import pool as db_pool
+from utils import vector_storage
+from utils import db_llm
+from utils import cart
+from utils import cart_cache
+from utils import embedding
+from utils import result_cache
+from utils import search_filters
+from utils import tracing
+
+## One pool per event loop: asyncpg connections can't be used from another loop, and the
+## loop of an asyncio.run call is closed when it returns. Pools of closed loops are dropped.
+_pools = {}
+_pool_locks = {}
+_embedding_model_checked = False
+
+async def _init_connection(conn):
+    await register_vector(conn)
+    for setting in vector_storage.session_settings():
+        try:
+            await conn.execute(setting)
+        except asyncpg.PostgresError:
+            pass
+
+async def get_pool():
+    """asyncpg pool of the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        for closed in [other for other in list(_pools) if other.is_closed()]:
+            _pools.pop(closed, None)
+            _pool_locks.pop(closed, None)
+        async with _pool_locks.setdefault(loop, asyncio.Lock()):
+            pool = _pools.get(loop)
+            if pool is None:
+                pool = await asyncpg.create_pool(
+                    dsn=db_pool.get_db_url(),
+                    min_size=db_pool.DB_POOL_MIN,
+                    max_size=db_pool.DB_POOL_MAX,
+                    ssl=db_pool.DBSSL == "require",
+                    init=_init_connection,
+                )
+                _pools[loop] = pool
+                await _check_embedding_model(pool)
+    return pool
+
+async def close_pool():
+    """Close the running loop's pool, e.g. at the end of an asyncio.run."""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
+
+async def _check_embedding_model(pool):
+    """Async twin of pool.check_embedding_model, once per process."""
+    global _embedding_model_checked
+    from utils import embedding_providers
+
+    if _embedding_model_checked:
+        return
+    _embedding_model_checked = True
+    try:
+        rows = await pool.fetch(embedding_providers.CATALOG_MODELS_SQL)
+    except asyncpg.PostgresError:
+        return
+    warning = embedding_providers.catalog_warning([tuple(row) for row in rows])
+    if warning:
+        print(warning)
+
+async def hybrid_search(search_query, conditions=(), limit=5):
+    """Ranked (id, name, discount_price_dollar, description, link, score) records from the hybrid_search() SQL function."""
+    query_embedding = await embedding.get_cache().aget(search_query)
+    args = db_llm.hybrid_search_args(conditions, limit)
+    pool = await get_pool()
+
+    return await pool.fetch(f"SELECT * FROM {db_llm.hybrid_search_sql(args, '$1', '$2', first=3)}",
+                            search_query, query_embedding, *args.values())
+
+async def _cart_quantities(user_id):
+    pool = await get_pool()
+    rows = await pool.fetch("""
+        SELECT product_id, quantity
+        FROM shopping_cart
+        WHERE user_id = $1 AND status = 'CART'
+    """, user_id)
+
+    return {row["product_id"]: row["quantity"] for row in rows}
+
+async def _search_in_cart(user_id, search_query):
+    """Best-ranked match that is in the user's cart as (product_id, quantity), or None."""
+    ranked, quantities = await asyncio.gather(hybrid_search(search_query, limit=5), _cart_quantities(user_id))
+    for row in ranked:
+        if row["id"] in quantities:
+            return row["id"], quantities[row["id"]]
+    return None
+
+async def sync_catalog_version():
+    """Async twin of db_llm.sync_catalog_version."""
+    if not result_cache.search_cache.version_due():
+        return
+    pool = await get_pool()
+    try:
+        version = await pool.fetchval(result_cache.CATALOG_VERSION_SQL)
+    except asyncpg.PostgresError:
+        version = None
+    result_cache.search_cache.set_version(version)
+
+async def search_products_llm(search_query: str, filters: dict = None):
+    conditions = search_filters.parse(filters)
+    query_embedding, _ = await asyncio.gather(embedding.get_cache().aget(search_query), sync_catalog_version())
+    pool = await get_pool()
+    with tracing.span("db.search", engine="asyncpg", filters=search_filters.key(conditions)) as span:
+        ids = result_cache.search_cache.lookup(query_embedding, conditions)
+        span.set(cache_hit=ids is not None)
+        if ids is None:
+            started = time.perf_counter()
+            rows = await hybrid_search(search_query, conditions=conditions, limit=5)
+            ids = [row["id"] for row in rows]
+            result_cache.search_cache.store(query_embedding, conditions, ids, time.perf_counter() - started)
+        else:
+            rows = await pool.fetch("""
+                SELECT id, name, discount_price_dollar, description, link
+                FROM product_listing
+                WHERE id = ANY($1)
+                ORDER BY ARRAY_POSITION($1, id)
+            """, ids)
+        span.set(rows=len(ids))
+
+    return db_llm.format_search_results([tuple(row)[:5] for row in rows])
+
+async def cached_search_answer(search_query, filters=None):
+    if not result_cache.SEARCH_CACHE_ANSWERS:
+        return None
+    conditions = search_filters.parse(filters)
+    return result_cache.search_cache.lookup_answer(await embedding.get_cache().aget(search_query), conditions)
+
+async def store_search_answer(search_query, answer, answer_seconds, filters=None):
+    if result_cache.SEARCH_CACHE_ANSWERS:
+        conditions = search_filters.parse(filters)
+        result_cache.search_cache.store_answer(await embedding.get_cache().aget(search_query), conditions, answer, answer_seconds)
+
+async def get_cart_items(user_id=1):
+    pool = await get_pool()
+    cart_items = await pool.fetch("""
+        SELECT SUBSTRING(p.name, 1, 50) AS name, p.discount_price_dollar, sc.quantity, (p.discount_price_dollar * sc.quantity) AS total_price
+        FROM shopping_cart sc
+        JOIN product_listing p ON sc.product_id = p.id
+        WHERE sc.user_id = $1 AND sc.status = 'CART'
+    """, user_id)
+
+    return [tuple(item) for item in cart_items]
+
+async def show_cart(user_id=1):
+    return db_llm.format_cart(await get_cart_items(user_id))
+
+async def _fetch_cart(sql, params):
+    """Run one of the utils/cart.py statements on the pool."""
+    sql, args = cart.numbered(sql, params)
+    pool = await get_pool()
+    return await pool.fetch(sql, *args)
+
+async def add_products_to_cart(user_id, items):
+    """Resolve every item concurrently, then upsert them all in one statement."""
+    try:
+        ranked = await asyncio.gather(*(hybrid_search(item["search_query"], limit=1) for item in items))
+        unmatched = [item["search_query"] for item, result in zip(items, ranked) if not result]
+        if unmatched:
+            return "Error: no matched product for " + ", ".join(unmatched)
+        product_ids = [result[0][0] for result in ranked]
+        quantities = [int(item.get("quantity") or 1) for item in items]
+
+        rows = await _fetch_cart(cart.ADD_ITEMS_SQL, cart.items_params(user_id, list(zip(product_ids, quantities))))
+        cart_cache.invalidate(user_id)
+
+        if all(row["inserted"] for row in rows):
+            return "Done. The product is in the shopping cart."
+        return "Done. Already add your product more."
+
+    except Exception as error:
+        return f"Error: {error}"
+
+async def add_product_to_cart(user_id, search_query: str, quantity=1):
+    return await add_products_to_cart(user_id, [{"search_query": search_query, "quantity": quantity}])
+
+async def remove_product_from_cart(user_id, search_query):
+    try:
+        result = await _search_in_cart(user_id, search_query)
+        if result is None:
+            return "The product isn't in the cart."
+
+        await _fetch_cart(cart.REMOVE_ITEMS_SQL, {"user_id": user_id, "product_ids": [result[0]]})
+        cart_cache.invalidate(user_id)
+        return "Done"
+
+    except Exception as error:
+        return f"Error: {error}"
+
+async def update_product_quantity(user_id, search_query, quantity=1):
+    try:
+        result = await _search_in_cart(user_id, search_query)
+        if result is None:
+            return "The product is not in the cart."
+        if result[1] == quantity:
+            return "Please validate your quantity. They are same."
+
+        await _fetch_cart(cart.SET_QUANTITIES_SQL, cart.items_params(user_id, [(result[0], quantity)]))
+        cart_cache.invalidate(user_id)
+        return "Done"
+
+    except Exception as error:
+        return f"Error: {error}"
+
+async def pay_cart(user_id=1):
+    """
+    This function is to pay for products in the cart. The payment is fake.
+    Just Update that the user already paid for their products
+    """
+    try:
+        paid = await _fetch_cart(cart.PAY_SQL, {"user_id": user_id})
+
+        if paid:
+            cart_cache.invalidate(user_id)
+            return "Done"
+        else:
+            return "There are no products in the shopping cart."
+
+    except Exception as error:
+        return f"Error: {error}"
+
+async def get_products_status(user_id=1, before_order_id=None):
+    items = await _fetch_cart(cart.ORDER_STATUS_SQL, cart.order_status_params(user_id, before_order_id))
+
+    return [tuple(item) for item in items]
+
+async def check_products_status(user_id=1, before_order_id=None):
+    try:
+        return db_llm.format_products_status(await get_products_status(user_id, before_order_id))
+
+    except Exception as error:
+        return f"Error: {error}"
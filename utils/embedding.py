@@ -0,0 +1,456 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+from dotenv import load_dotenv
+from utils import embedding_providers
+from utils import tracing
+
+load_dotenv(override=True)
+
+## Cache settings
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 10000))          # max entries in memory
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", 7 * 24 * 3600))  # seconds, 0 = never expire
+EMBED_CACHE_BACKEND = os.getenv("EMBED_CACHE_BACKEND", "memory")      # memory, disk or postgres
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", ".embedding_cache.sqlite3")
+EMBED_CACHE_PERSIST_SIZE = int(os.getenv("EMBED_CACHE_PERSIST_SIZE", 1000000))
+
+## Request batching: cache misses of concurrent sessions share embeddings.create calls
+## A window delays every miss by up to its length, so it only pays off under concurrent sessions:
+## off for the threads of the Streamlit app, on for the asyncio pipeline that serves many conversations
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", 0))              # threads: wait this long for more inputs, 0 = only merge identical ones
+EMBED_ASYNC_BATCH_WINDOW_MS = float(os.getenv("EMBED_ASYNC_BATCH_WINDOW_MS", 5))  # the same for aembed()
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", 64))              # inputs per embeddings.create call
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+
+def normalize_text(text):
+    """Collapse whitespace and case so 'Whey  Protein ' and 'whey protein' share one entry."""
+    return " ".join(str(text).split()).casefold()
+
+
+def make_key(model_tag, text):
+    return f"{model_tag}:{normalize_text(text)}"
+
+
+class SqliteStore:
+    """On-disk second layer, survives restarts of the Streamlit process."""
+
+    def __init__(self, path, max_size=EMBED_CACHE_PERSIST_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key_hash TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embedding_cache_created_at ON embedding_cache (created_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT embedding, created_at FROM embedding_cache WHERE key_hash = ?", (_hash_key(key),)
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32), row[1]
+
+    def put(self, key, embedding, created_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embedding_cache (key_hash, embedding, created_at) VALUES (?, ?, ?)",
+                (_hash_key(key), np.asarray(embedding, dtype=np.float32).tobytes(), created_at),
+            )
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM embedding_cache WHERE key_hash = ?", (_hash_key(key),))
+            self._conn.commit()
+
+    def prune(self, ttl):
+        with self._lock:
+            if ttl:
+                self._conn.execute("DELETE FROM embedding_cache WHERE created_at < ?", (time.time() - ttl,))
+            self._conn.execute("""
+                DELETE FROM embedding_cache WHERE key_hash IN (
+                    SELECT key_hash FROM embedding_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_size,))
+            self._conn.commit()
+
+
+class PostgresStore:
+    """Second layer shared by every app process, stored next to the catalog (see database/embedding_cache.sql)."""
+
+    def __init__(self, pool, max_size=EMBED_CACHE_PERSIST_SIZE):
+        self.max_size = max_size
+        self._pool = pool
+
+    def get(self, key):
+        with self._pool.cursor() as cur:
+            cur.execute("""
+                SELECT embedding, EXTRACT(EPOCH FROM created_at)
+                FROM embedding_cache
+                WHERE key_hash = %s
+            """, (_hash_key(key),))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return np.asarray(row[0], dtype=np.float32), float(row[1])
+
+    def put(self, key, embedding, created_at):
+        with self._pool.cursor() as cur:
+            cur.execute("""
+                INSERT INTO embedding_cache (key_hash, embedding, created_at)
+                VALUES (%s, %s, TO_TIMESTAMP(%s))
+                ON CONFLICT (key_hash) DO UPDATE SET embedding = EXCLUDED.embedding, created_at = EXCLUDED.created_at
+            """, (_hash_key(key), np.asarray(embedding, dtype=np.float32), created_at))
+
+    def delete(self, key):
+        with self._pool.cursor() as cur:
+            cur.execute("DELETE FROM embedding_cache WHERE key_hash = %s", (_hash_key(key),))
+
+    def prune(self, ttl):
+        with self._pool.cursor() as cur:
+            if ttl:
+                cur.execute("DELETE FROM embedding_cache WHERE created_at < NOW() - %s * INTERVAL '1 second'", (ttl,))
+            cur.execute("""
+                DELETE FROM embedding_cache WHERE key_hash IN (
+                    SELECT key_hash FROM embedding_cache ORDER BY created_at DESC OFFSET %s
+                )
+            """, (self.max_size,))
+
+
+def _hash_key(key):
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def make_store(pool=None, backend=EMBED_CACHE_BACKEND):
+    """Pick the persistent layer from EMBED_CACHE_BACKEND; None means memory only."""
+    if backend == "disk":
+        return SqliteStore(EMBED_CACHE_PATH)
+    if backend == "postgres":
+        if pool is None:
+            raise ValueError("The postgres embedding cache needs a connection pool")
+        return PostgresStore(pool)
+    return None
+
+
+class EmbeddingBatcher:
+    """
+    Turns concurrent single-text embedding requests into few provider calls. Identical texts already
+    waiting or in flight share one result (single-flight); distinct texts arriving within
+    window_ms of the first one are embedded in one batch (one embeddings.create call with OpenAI).
+    The first caller of a batch waits out the window and makes the call for everyone.
+    Threads use embed(), the asyncio pipeline aembed() with async_window_ms; the two never share a batch.
+    """
+
+    def __init__(self, provider, window_ms=EMBED_BATCH_WINDOW_MS, max_batch=EMBED_BATCH_MAX,
+                 async_window_ms=EMBED_ASYNC_BATCH_WINDOW_MS):
+        self.provider = provider
+        self.window = window_ms / 1000
+        self.async_window = async_window_ms / 1000
+        self.max_batch = max_batch
+        self._lock = threading.Condition()
+        self._inflight = {}
+        self._pending = []
+        self._async_inflight = {}
+        self._async_pending = []
+        self._async_full = None
+        self._async_loop = None
+        self._async_leaders = set()
+        self.requests = 0
+        self.calls = 0
+        self.inputs = 0
+        self.coalesced = 0
+        self.queue_seconds = 0.0
+
+    def _record(self, batch, started):
+        ## batch is [(text, future, enqueued_at)]
+        with self._lock:
+            self.calls += 1
+            self.inputs += len(batch)
+            for _, _, enqueued_at in batch:
+                self.queue_seconds += started - enqueued_at
+        ## Histograms only with tracing on, like spans; stats() needs just the counters above
+        if not tracing.TRACING:
+            return
+        labels = {"provider": self.provider.name}
+        tracing.metrics.observe("embedding_batch_size", labels, len(batch), buckets=BATCH_SIZE_BUCKETS)
+        for _, _, enqueued_at in batch:
+            tracing.metrics.observe("embedding_queue_seconds", labels, started - enqueued_at)
+
+    def embed(self, text):
+        """Embedding of text (already normalized) as a float32 array."""
+        enqueued_at = time.perf_counter()
+        with self._lock:
+            self.requests += 1
+            future = self._inflight.get(text)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = self._inflight[text] = Future()
+                self._pending.append((text, future, enqueued_at))
+                leader = len(self._pending) == 1
+                if len(self._pending) >= self.max_batch:
+                    self._lock.notify_all()
+
+        if leader:
+            self._lead(enqueued_at)
+        return future.result()
+
+    def _lead(self, enqueued_at):
+        deadline = enqueued_at + self.window
+        with self._lock:
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if self._pending:
+                ## Overflow gets a leader of its own
+                threading.Thread(target=self._lead, args=(time.perf_counter() - self.window,), daemon=True).start()
+
+        started = time.perf_counter()
+        self._record(batch, started)
+        try:
+            with tracing.span("embedding.api", provider=self.provider.name, inputs=len(batch)) as span:
+                tokens = self.provider.tokens
+                vectors = self.provider.embed([text for text, _, _ in batch])
+                span.set(tokens=self.provider.tokens - tokens)
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+        except Exception as error:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            with self._lock:
+                for text, _, _ in batch:
+                    self._inflight.pop(text, None)
+
+    async def aembed(self, text):
+        """Async twin of embed(); batches are gathered on the running event loop."""
+        enqueued_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        if self._async_full is None or self._async_loop is not loop:
+            ## First use, or a new loop (asyncio.run per call): nothing pending can be shared
+            self._async_loop = loop
+            self._async_full = asyncio.Event()
+            self._async_inflight, self._async_pending = {}, []
+
+        with self._lock:
+            self.requests += 1
+        future = self._async_inflight.get(text)
+        if future is not None:
+            with self._lock:
+                self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = self._async_inflight[text] = loop.create_future()
+        self._async_pending.append((text, future, enqueued_at))
+        if len(self._async_pending) == 1:
+            self._async_full.clear()
+            self._start_async_leader(loop)
+        elif len(self._async_pending) >= self.max_batch:
+            self._async_full.set()
+        return await asyncio.shield(future)
+
+    def _start_async_leader(self, loop):
+        ## Keep a reference, the loop only holds tasks weakly
+        task = loop.create_task(self._alead())
+        self._async_leaders.add(task)
+        task.add_done_callback(self._async_leaders.discard)
+
+    async def _alead(self):
+        if self.async_window > 0:
+            try:
+                await asyncio.wait_for(self._async_full.wait(), self.async_window)
+            except asyncio.TimeoutError:
+                pass
+        batch, self._async_pending = self._async_pending[:self.max_batch], self._async_pending[self.max_batch:]
+        if self._async_pending:
+            self._async_full.set()
+            self._start_async_leader(asyncio.get_running_loop())
+
+        started = time.perf_counter()
+        self._record(batch, started)
+        try:
+            with tracing.span("embedding.api", provider=self.provider.name, inputs=len(batch)) as span:
+                tokens = self.provider.tokens
+                vectors = await self.provider.aembed([text for text, _, _ in batch])
+                span.set(tokens=self.provider.tokens - tokens)
+            for (_, future, _), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+        except Exception as error:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            for text, _, _ in batch:
+                self._async_inflight.pop(text, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "api_calls": self.calls,
+                "coalesced": self.coalesced,
+                "mean_batch_size": self.inputs / self.calls if self.calls else 0.0,
+                "mean_queue_ms": self.queue_seconds / self.inputs * 1000 if self.inputs else 0.0,
+            }
+
+
+class EmbeddingCache:
+    """
+    Query embedding cache keyed on (provider tag, normalized text).
+    An LRU layer lives in memory; an optional store (disk or Postgres) sits behind it.
+    """
+
+    def __init__(self, provider=None, max_size=EMBED_CACHE_SIZE, ttl=EMBED_CACHE_TTL, store=None,
+                 batch_window_ms=EMBED_BATCH_WINDOW_MS):
+        ## Defaults to the EMBED_PROVIDER backend; a local model is only loaded on the first lookup
+        self.provider = provider or embedding_providers.get_provider()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self.batcher = EmbeddingBatcher(self.provider, window_ms=batch_window_ms)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._puts_since_prune = 0
+
+    def _expired(self, created_at):
+        return bool(self.ttl) and time.time() - created_at > self.ttl
+
+    def _lookup_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[1]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+        return None
+
+    def _lookup_store(self, key):
+        if self.store is None:
+            return None
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[1]):
+            self.store.delete(key)
+            return None
+        self._remember(key, entry[0], entry[1])
+        with self._lock:
+            self.store_hits += 1
+        return entry[0]
+
+    def _save(self, key, embedding):
+        created_at = time.time()
+        self._remember(key, embedding, created_at)
+        if self.store is not None:
+            self.store.put(key, embedding, created_at)
+            self._puts_since_prune += 1
+            if self._puts_since_prune >= 1000:
+                self._puts_since_prune = 0
+                self.store.prune(self.ttl)
+        return embedding
+
+    def get(self, text):
+        """Return the embedding of text as a float32 array, calling the API only on a miss."""
+        key = make_key(self.provider.tag, text)
+
+        embedding = self._lookup_memory(key)
+        if embedding is None:
+            embedding = self._lookup_store(key)
+        if embedding is not None:
+            return embedding
+
+        with self._lock:
+            self.misses += 1
+        return self._save(key, self.batcher.embed(normalize_text(text)))
+
+    async def aget(self, text):
+        """Async twin of get() for the asyncio pipeline; the persistent store is read off the event loop."""
+        key = make_key(self.provider.tag, text)
+
+        embedding = self._lookup_memory(key)
+        if embedding is None and self.store is not None:
+            embedding = await asyncio.to_thread(self._lookup_store, key)
+        if embedding is not None:
+            return embedding
+
+        with self._lock:
+            self.misses += 1
+        embedding = await self.batcher.aembed(normalize_text(text))
+        if self.store is None:
+            return self._save(key, embedding)
+        return await asyncio.to_thread(self._save, key, embedding)
+
+    def _remember(self, key, embedding, created_at):
+        with self._lock:
+            self._entries[key] = (embedding, created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.store_hits) / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Process-wide query embedding cache, created on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from utils import pool
+
+                _cache = EmbeddingCache(store=make_store(pool))
+    return _cache
+
+def reset_cache(**options):
+    """
+    Replace the process-wide cache with EmbeddingCache(**options), e.g. after
+    embedding_providers.set_provider(); without a store it is memory-only.
+    """
+    global _cache
+    with _cache_lock:
+        _cache = EmbeddingCache(**options)
+    return _cache
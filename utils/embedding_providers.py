@@ -0,0 +1,188 @@
+## Embedding backends. Each one turns a list of texts into float32 vectors and has a tag
+## "<provider>:<model>:<dimensions>" stored with every catalog vector (product_listing.embedding_model),
+## so searches only compare query and product vectors made by the same model.
+import os
+import asyncio
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from utils import clients
+
+load_dotenv(override=True)
+
+## Provider settings
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "openai")          # openai, or local for an ONNX model on the CPU
+EMBED_DIMENSIONS = int(os.getenv("EMBED_DIMENSIONS", 1536))      # openai only; must match product_listing.embedded_description
+EMBED_LOCAL_MODEL_PATH = os.getenv("EMBED_LOCAL_MODEL_PATH", "models/all-MiniLM-L6-v2")  # directory with model.onnx and tokenizer.json
+EMBED_LOCAL_MAX_TOKENS = int(os.getenv("EMBED_LOCAL_MAX_TOKENS", 256))
+EMBED_LOCAL_THREADS = int(os.getenv("EMBED_LOCAL_THREADS", 0))  # onnxruntime intra-op threads, 0 = its default
+EMBED_MODEL_VERSION = os.getenv("EMBED_MODEL_VERSION", "")     # bump to re-embed the catalog after replacing a local model
+
+## product_listing.csv ships vectors of this model (see database/migrations/008_embedding_model.sql)
+CSV_EMBEDDING_MODEL = "openai:text-embedding-3-small:1536"
+
+## Product vectors per model; searches only see those of the current provider's tag
+CATALOG_MODELS_SQL = """
+    SELECT embedding_model, COUNT(*)
+    FROM product_listing
+    WHERE embedded_description IS NOT NULL
+    GROUP BY embedding_model
+"""
+
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    return usage.total_tokens if usage is not None else None
+
+
+class OpenAIProvider:
+    """embeddings.create on the OpenAI API (or OPENAI_BASE_URL)."""
+
+    name = "openai"
+
+    def __init__(self, model=None, dimensions=EMBED_DIMENSIONS, client=None, async_client=None, version=EMBED_MODEL_VERSION):
+        ## Clients default to the process-wide ones from utils.clients, resolved on the first call
+        self.model = model or os.getenv("OPENAI_EMBED") or "text-embedding-3-small"
+        self.dimensions = dimensions
+        self.version = version
+        self.client = client
+        self.async_client = async_client
+        self.tokens = 0
+
+    @property
+    def tag(self):
+        return f"{self.name}:{self.model}:{self.dimensions}{':' + self.version if self.version else ''}"
+
+    def _vectors(self, response):
+        tokens = _usage_tokens(response)
+        if tokens:
+            self.tokens += tokens
+        return [np.array(item.embedding, dtype=np.float32) for item in sorted(response.data, key=lambda item: item.index)]
+
+    def embed(self, texts):
+        client = self.client or clients.get_openai_client()
+        return self._vectors(client.embeddings.create(input=texts, model=self.model, dimensions=self.dimensions))
+
+    async def aembed(self, texts):
+        async_client = self.async_client or clients.get_async_openai_client()
+        return self._vectors(await async_client.embeddings.create(input=texts, model=self.model, dimensions=self.dimensions))
+
+
+class LocalOnnxProvider:
+    """
+    A sentence embedding model (e.g. all-MiniLM-L6-v2 exported to ONNX, optionally quantized) run
+    on the CPU with onnxruntime: mean pooling over the tokens, then L2 normalization.
+    Needs `pip install onnxruntime tokenizers`; loaded on first use.
+    """
+
+    name = "local"
+
+    def __init__(self, path=EMBED_LOCAL_MODEL_PATH, max_tokens=EMBED_LOCAL_MAX_TOKENS, threads=EMBED_LOCAL_THREADS,
+                 version=EMBED_MODEL_VERSION):
+        self.path = path
+        self.model = os.path.basename(os.path.normpath(path))
+        self.version = version
+        self.max_tokens = max_tokens
+        self.threads = threads
+        self.tokens = 0
+        self._session = None
+        self._tokenizer = None
+        self._dimensions = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._session is not None:
+            return
+        with self._lock:
+            if self._session is not None:
+                return
+            try:
+                import onnxruntime
+                from tokenizers import Tokenizer
+            except ImportError as error:
+                raise RuntimeError("EMBED_PROVIDER=local needs `pip install onnxruntime tokenizers`") from error
+
+            model_file = os.path.join(self.path, "model_quantized.onnx")
+            if not os.path.exists(model_file):
+                model_file = os.path.join(self.path, "model.onnx")
+            options = onnxruntime.SessionOptions()
+            if self.threads:
+                options.intra_op_num_threads = self.threads
+            session = onnxruntime.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+
+            tokenizer = Tokenizer.from_file(os.path.join(self.path, "tokenizer.json"))
+            tokenizer.enable_truncation(max_length=self.max_tokens)
+            tokenizer.enable_padding()
+            self._tokenizer = tokenizer
+            self._inputs = {model_input.name for model_input in session.get_inputs()}
+            self._dimensions = session.get_outputs()[0].shape[-1]
+            self._session = session
+
+    @property
+    def dimensions(self):
+        self._load()
+        return self._dimensions
+
+    @property
+    def tag(self):
+        return f"{self.name}:{self.model}:{self.dimensions}{':' + self.version if self.version else ''}"
+
+    def embed(self, texts):
+        self._load()
+        encodings = self._tokenizer.encode_batch(list(texts))
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._inputs:
+            feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        self.tokens += int(attention_mask.sum())
+
+        token_embeddings = self._session.run(None, feeds)[0]
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return list((pooled / norms).astype(np.float32))
+
+    async def aembed(self, texts):
+        ## onnxruntime releases the GIL while it runs, so a worker thread keeps the event loop free
+        return await asyncio.to_thread(self.embed, texts)
+
+
+PROVIDERS = {"openai": OpenAIProvider, "local": LocalOnnxProvider}
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def make_provider(name=EMBED_PROVIDER):
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown EMBED_PROVIDER: {name}, expected one of {', '.join(PROVIDERS)}")
+    return PROVIDERS[name]()
+
+def catalog_warning(rows, tag=None):
+    """
+    Warning for CATALOG_MODELS_SQL rows when the catalog has vectors but none made by tag (default:
+    the current provider), in which case semantic search silently finds nothing; None when they match.
+    """
+    counts = {model: count for model, count in rows}
+    tag = tag or get_provider().tag
+    if not counts or tag in counts:
+        return None
+    found = ", ".join(f"{model or 'untagged'} ({count})" for model, count in counts.items())
+    return (f"Warning: no product vectors were made by {tag}, the catalog has {found}; searches are keyword-only. "
+            "Check EMBED_PROVIDER, OPENAI_EMBED and EMBED_MODEL_VERSION, or re-embed with python -m utils.ingest")
+
+def get_provider():
+    """Process-wide provider chosen by EMBED_PROVIDER, created on first use."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = make_provider()
+    return _provider
+
+def set_provider(provider=None):
+    """Replace the process-wide provider (benchmarks, scripts); None goes back to EMBED_PROVIDER on next use."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,216 @@
+## A local stand-in for the OpenAI API, for benchmarks that must not call the real one.
+## Embeddings are deterministic (texts sharing words get close vectors) and chat completions
+## follow a script: a user message found in the script gets its tool calls, anything else gets text.
+import re
+import json
+import math
+import time
+import base64
+import random
+import struct
+import argparse
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = "Here is what I found for you. These products are popular with our customers and fit what you asked for. Would you like me to add one of them to your shopping cart?"
+
+
+@functools.lru_cache(maxsize=4096)
+def _word_vector(word, dims):
+    rng = random.Random(word)
+    return [rng.gauss(0.0, 1.0) for _ in range(dims)]
+
+def fake_embedding(text, dims=1536):
+    """Sum of per-word random vectors, L2-normalized: the same text always maps to the same vector."""
+    vector = [0.0] * dims
+    for word in re.findall(r"\w+", text.lower()) or [""]:
+        for i, value in enumerate(_word_vector(word, dims)):
+            vector[i] += value
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class FakeOpenAI:
+    """
+    script maps a user message to the tool calls the routing completion should make,
+    as [(function_name, arguments)]; a user_id argument is set to the id in the system message. Latencies are in seconds: ttft before the first chunk
+    of a completion, token between streamed chunks, embed per embeddings request.
+    """
+
+    def __init__(self, script=None, ttft=0.3, token=0.01, embed=0.05, answer=DEFAULT_ANSWER, host="127.0.0.1", port=0):
+        self.script = script or {}
+        self.ttft = ttft
+        self.token = token
+        self.embed = embed
+        self.answer = answer
+        self.requests = {"embeddings": 0, "chat": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def embeddings(self, body):
+        self._count("embeddings")
+        time.sleep(self.embed)
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dims = body.get("dimensions") or 1536
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(text, dims)
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{dims}f", *vector)).decode()
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(len(text.split()) for text in inputs)
+        return {"object": "list", "data": data, "model": body.get("model"), "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    def tool_calls_for(self, body):
+        ## Only the routing completion offers tools; summaries and write-ups get text
+        if not body.get("tools"):
+            return []
+        users = [message for message in body.get("messages", []) if message.get("role") == "user"]
+        if not users:
+            return []
+        calls = self.script.get(users[-1]["content"], [])
+        user_id = self.user_id(body)
+        if user_id is not None:
+            calls = [(name, dict(arguments, user_id=user_id) if "user_id" in arguments else arguments) for name, arguments in calls]
+        return [
+            {"id": f"call_{index}", "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+            for index, (name, arguments) in enumerate(calls)
+        ]
+
+    @staticmethod
+    def user_id(body):
+        """The id from "The user's id is N." of the system message, or None."""
+        for message in body.get("messages", []):
+            if message.get("role") == "system":
+                match = re.search(r"The user's id is (\d+)", message.get("content") or "")
+                if match:
+                    return int(match.group(1))
+        return None
+
+    def chat(self, body):
+        """Non-streaming completion."""
+        self._count("chat")
+        time.sleep(self.ttft)
+        tool_calls = self.tool_calls_for(body)
+        message = {"role": "assistant", "content": None if tool_calls else self.answer}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        return {
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def chat_chunks(self, body):
+        """Streaming completion: yields (delay, delta, finish_reason) the way the API splits them."""
+        self._count("chat")
+        tool_calls = self.tool_calls_for(body)
+        if not tool_calls:
+            words = self.answer.split(" ")
+            for i, word in enumerate(words):
+                yield self.ttft if i == 0 else self.token, {"content": word if i == 0 else " " + word}, None
+            yield 0.0, {}, "stop"
+            return
+
+        delay = self.ttft
+        for index, tool_call in enumerate(tool_calls):
+            yield delay, {"tool_calls": [{"index": index, "id": tool_call["id"], "type": "function",
+                                          "function": {"name": tool_call["function"]["name"], "arguments": ""}}]}, None
+            delay = self.token
+            arguments = tool_call["function"]["arguments"]
+            for start in range(0, len(arguments), 8):
+                yield self.token, {"tool_calls": [{"index": index, "function": {"arguments": arguments[start:start + 8]}}]}, None
+        yield 0.0, {}, "tool_calls"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, payload, status=200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.endswith("/embeddings"):
+                    self._json(fake.embeddings(body))
+                elif self.path.endswith("/chat/completions") and body.get("stream"):
+                    self._stream(body)
+                elif self.path.endswith("/chat/completions"):
+                    self._json(fake.chat(body))
+                else:
+                    self._json({"error": {"message": f"{self.path} is not faked"}}, status=404)
+
+            def _stream(self, body):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for delay, delta, finish_reason in fake.chat_chunks(body):
+                    time.sleep(delay)
+                    chunk = {
+                        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": body.get("model"),
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI API (embeddings and chat completions).")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--script", help="JSON file mapping a user message to [[function_name, arguments], ...]")
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=10)
+    parser.add_argument("--embed-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    script = {}
+    if args.script:
+        with open(args.script) as file:
+            script = json.load(file)
+    fake = FakeOpenAI(script, ttft=args.ttft_ms / 1000, token=args.token_ms / 1000, embed=args.embed_ms / 1000, port=args.port)
+    print(f"Fake OpenAI API on {fake.base_url} (set OPENAI_BASE_URL to use it)")
+    fake.start()._thread.join()
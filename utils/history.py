@@ -0,0 +1,183 @@
+import os
+import re
+import threading
+from utils import clients
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+## History settings
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 3000))      # tokens of history sent with each turn
+HISTORY_KEEP_MESSAGES = int(os.getenv("HISTORY_KEEP_MESSAGES", 4))      # most recent messages always kept verbatim
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", 300))  # upper bound on the rolling summary
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL") or os.getenv("OPENAI_MODEL")
+MESSAGE_OVERHEAD = 4                                                    # tokens the chat format adds per message
+
+SUMMARY_PROMPT = "You keep a running summary of a conversation between a shop clerk and a user. Update the summary with the new messages. Keep what the user wants, their budget, products mentioned, and what was added to, removed from or paid in the cart. Leave out greetings and product tables. Answer with the summary only, at most a few sentences."
+
+## A markdown table: a header row followed by a |---| separator row and its body
+TABLE = re.compile(r"(?m)^\|.*\|[ \t]*\n\|[ \t:\-|]+\|[ \t]*\n(?:\|.*\|[ \t]*(?:\n|$))*")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    ## tiktoken is optional; without it tokens are estimated from the text length
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    try:
+                        _encoding = tiktoken.encoding_for_model(SUMMARY_MODEL or "")
+                    except KeyError:
+                        _encoding = tiktoken.get_encoding("o200k_base")
+                except ImportError:
+                    _encoding = False
+    return _encoding
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def message_tokens(message):
+    return MESSAGE_OVERHEAD + count_tokens(message["content"] or "")
+
+def compact(message):
+    """
+    Assistant messages with the tables of an answered tool call (cart, order status, search results)
+    keep their text but not the rows; the model calls the tool again if it needs them.
+    """
+    if message["role"] != "assistant" or "|" not in (message["content"] or ""):
+        return message
+    content = TABLE.sub(lambda table: f"(table of {table.group(0).count(chr(10)) - 1} rows omitted)\n", message["content"])
+    return {"role": message["role"], "content": content}
+
+def _last_assistant(messages):
+    return max((i for i, message in enumerate(messages) if message["role"] == "assistant"), default=None)
+
+def _transcript(messages):
+    return "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+
+def _fallback_summary(summary, messages):
+    ## Without the model, keep the user's own words, clipped to the summary budget
+    text = " ".join(filter(None, [summary] + [message["content"] for message in messages if message["role"] == "user"]))
+    max_chars = HISTORY_SUMMARY_TOKENS * 4
+    return text[-max_chars:]
+
+
+class HistoryManager:
+    """
+    Fits one conversation into a token budget. The most recent messages are sent verbatim;
+    older ones are folded into a rolling summary. The summary is only extended with the
+    messages that have just left the window, so each message is summarized once.
+    Keep one instance per conversation, e.g. in st.session_state.
+    """
+
+    def __init__(self, budget=HISTORY_TOKEN_BUDGET, keep_messages=HISTORY_KEEP_MESSAGES):
+        self.budget = budget
+        self.keep_messages = keep_messages
+        self.summary = ""
+        self.summarized = 0    # messages[:summarized] are covered by the summary
+        self.summary_calls = 0
+
+    def _window_start(self, messages):
+        """Index of the first message sent verbatim."""
+        if len(messages) < self.summarized:
+            ## A new conversation in the same session
+            self.summary, self.summarized = "", 0
+
+        last_assistant = _last_assistant(messages)
+        sizes = [
+            message_tokens(message if i == last_assistant else compact(message))
+            for i, message in enumerate(messages[self.summarized:], start=self.summarized)
+        ]
+        if not self.summary and sum(sizes) <= self.budget:
+            return self.summarized
+
+        ## Once there is a summary, leave room for it to grow to its full size
+        budget = self.budget - HISTORY_SUMMARY_TOKENS - MESSAGE_OVERHEAD
+        start = len(messages)
+        used = 0
+        while start > self.summarized:
+            tokens = sizes[start - 1 - self.summarized]
+            if used + tokens > budget and len(messages) - start >= min(self.keep_messages, len(messages)):
+                break
+            used += tokens
+            start -= 1
+
+        ## Older turns that are about to be summarized are over budget; summarize a little more
+        ## so the verbatim window opens on a user message
+        if start > self.summarized:
+            while start < len(messages) - 1 and messages[start]["role"] != "user":
+                start += 1
+        return start
+
+    def _build(self, messages):
+        ## The latest answer stays whole so follow-ups like "remove the second one" still resolve
+        last_assistant = _last_assistant(messages)
+        fitted = [
+            message if i == last_assistant else compact(message)
+            for i, message in enumerate(messages[self.summarized:], start=self.summarized)
+        ]
+        if self.summary:
+            fitted.insert(0, {"role": "system", "content": "Summary of the earlier conversation: " + self.summary})
+        return fitted
+
+    def _summary_messages(self, evicted):
+        return [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Current summary:\n{self.summary or '(empty)'}\n\nNew messages:\n{_transcript(evicted)}"},
+        ]
+
+    def fit(self, messages):
+        """The messages to send this turn: an optional summary message followed by the recent turns."""
+        start = self._window_start(messages)
+        if start > self.summarized:
+            evicted = [compact(message) for message in messages[self.summarized:start]]
+            try:
+                response = clients.get_openai_client().chat.completions.create(
+                    model=SUMMARY_MODEL,
+                    messages=self._summary_messages(evicted),
+                    max_tokens=HISTORY_SUMMARY_TOKENS,
+                )
+                self.summary = response.choices[0].message.content.strip()
+            except Exception as error:
+                print(f"Error: {error}")
+                self.summary = _fallback_summary(self.summary, evicted)
+            self.summarized = start
+            self.summary_calls += 1
+        return self._build(messages)
+
+    async def afit(self, messages):
+        """fit() for llm_async, summarizing with the async client."""
+        start = self._window_start(messages)
+        if start > self.summarized:
+            evicted = [compact(message) for message in messages[self.summarized:start]]
+            try:
+                response = await clients.get_async_openai_client().chat.completions.create(
+                    model=SUMMARY_MODEL,
+                    messages=self._summary_messages(evicted),
+                    max_tokens=HISTORY_SUMMARY_TOKENS,
+                )
+                self.summary = response.choices[0].message.content.strip()
+            except Exception as error:
+                print(f"Error: {error}")
+                self.summary = _fallback_summary(self.summary, evicted)
+            self.summarized = start
+            self.summary_calls += 1
+        return self._build(messages)
+
+    def stats(self, messages):
+        fitted = self._build(messages)
+        return {
+            "messages": len(messages),
+            "sent": len(fitted),
+            "summarized": self.summarized,
+            "tokens": sum(message_tokens(message) for message in fitted),
+            "budget": self.budget,
+            "summary_calls": self.summary_calls,
+        }
@@ -1,8 +1,81 @@
+import os
+import glob
+import hashlib
+import argparse
+import functools
 from PIL import Image
 
+## Thumbnail settings
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", ".thumbnail_cache")
+THUMBNAIL_WIDTHS = (300, 600)        # derivatives generated when pre-warming
+THUMBNAIL_ASPECT = 720 / 600         # height / width of a storefront tile
+THUMBNAIL_QUALITY = 80
+
 def resize_image(image_file, size=(600, 720)):
     image = Image.open(image_file)
     new_image = image.resize(size)
 
     return new_image
 
+@functools.lru_cache(maxsize=1024)
+def _content_hash(image_file, mtime_ns, file_size):
+    ## mtime and size are part of the key so an edited file is hashed again
+    with open(image_file, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def content_hash(image_file):
+    stat = os.stat(image_file)
+    return _content_hash(image_file, stat.st_mtime_ns, stat.st_size)
+
+def thumbnail_path(image_file, width=600):
+    """Where the derivative lives: keyed by the source's content, not its name."""
+    return os.path.join(THUMBNAIL_DIR, f"{content_hash(image_file)}_{width}.webp")
+
+def make_thumbnail(image_file, width=600):
+    """Generate the WebP derivative of image_file if it isn't on disk yet, and return its path."""
+    path = thumbnail_path(image_file, width)
+    if os.path.exists(path):
+        return path
+
+    size = (width, round(width * THUMBNAIL_ASPECT))
+    with Image.open(image_file) as image:
+        thumbnail = image.convert("RGB").resize(size, Image.LANCZOS)
+
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    ## Write then rename, so a concurrent reader never sees a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    thumbnail.save(tmp_path, format="WEBP", quality=THUMBNAIL_QUALITY, method=6)
+    os.replace(tmp_path, path)
+
+    return path
+
+@functools.lru_cache(maxsize=512)
+def _thumbnail_bytes(image_file, width, mtime_ns, file_size):
+    with open(make_thumbnail(image_file, width), "rb") as file:
+        return file.read()
+
+def get_thumbnail(image_file, width=600):
+    """Encoded WebP bytes for st.image, served from memory after the first call in this process."""
+    stat = os.stat(image_file)
+    return _thumbnail_bytes(image_file, width, stat.st_mtime_ns, stat.st_size)
+
+def warm_thumbnails(folder="image_product", widths=THUMBNAIL_WIDTHS):
+    """Generate every derivative for the images in folder; returns how many files were processed."""
+    files = sorted(
+        path for path in glob.glob(os.path.join(folder, "*"))
+        if os.path.splitext(path)[1].lower() in (".jpg", ".jpeg", ".png", ".webp")
+    )
+    for image_file in files:
+        for width in widths:
+            make_thumbnail(image_file, width)
+
+    return len(files)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate storefront thumbnails.")
+    parser.add_argument("folder", nargs="?", default="image_product")
+    parser.add_argument("--widths", type=int, nargs="+", default=list(THUMBNAIL_WIDTHS))
+    args = parser.parse_args()
+
+    count = warm_thumbnails(args.folder, args.widths)
+    print(f"Thumbnails for {count} images are in {THUMBNAIL_DIR}")
@@ -0,0 +1,305 @@
+## Incremental catalog ingestion: python -m utils.ingest products.csv
+## Rows are streamed into a staging table with binary COPY, only new or changed products
+## (by a hash of name + description) are embedded, and everything is upserted by source_key.
+import os
+import re
+import csv
+import sys
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from dotenv import load_dotenv
+from utils import clients
+from utils import db_llm_async
+from utils import embedding_providers
+
+load_dotenv(override=True)
+
+## Ingestion settings
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", 5000))      # CSV rows staged and upserted per transaction
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", 256))     # texts per embedding call
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", 8))       # embeddings calls in flight
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", 6))
+
+COLUMNS = ("name", "main_category", "sub_category", "image", "link", "ratings", "no_of_ratings",
+           "discount_price_dollar", "actual_price_dollar", "description")
+FLOAT_COLUMNS = ("ratings", "discount_price_dollar", "actual_price_dollar")
+STAGING_COLUMNS = ("line", "source_key", "content_hash") + COLUMNS
+
+
+def natural_key(link, name):
+    """Same rule as database/migrations/004: the ASIN of an Amazon link, else the link, else the name."""
+    match = re.search(r"/dp/([A-Z0-9]{10})", link or "")
+    if match:
+        return match.group(1)
+    return link or name
+
+def content_hash(name, description):
+    return hashlib.sha256(f"{name or ''}\n{description or ''}".encode("utf-8")).hexdigest()
+
+def embedding_text(name, description):
+    ## The stored vectors are of the description, like the ones shipped in product_listing.csv
+    return (description or name or "").strip() or " "
+
+def _float(value):
+    value = (value or "").replace(",", "").replace("$", "").strip()
+    return float(value) if value else None
+
+def _vector(text):
+    return [float(value) for value in text.strip("[] \n").split(",")] if text else None
+
+
+def read_products(path):
+    """Yield (staging record, csv embedding text) per CSV row, in file order."""
+    ## Embedding columns are far longer than csv's default field limit
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline="", encoding="utf-8") as file:
+        for line, row in enumerate(csv.DictReader(file), start=2):
+            values = {column: (row.get(column) or None) for column in COLUMNS}
+            for column in FLOAT_COLUMNS:
+                values[column] = _float(values[column])
+            record = (
+                line,
+                natural_key(values["link"], values["name"]),
+                content_hash(values["name"], values["description"]),
+                *(values[column] for column in COLUMNS),
+            )
+            yield record, row.get("embedded_description")
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _retryable(error):
+    try:
+        import openai
+    except ImportError:
+        return False
+
+    return isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                              openai.InternalServerError))
+
+def _retry_after(error):
+    """Seconds the API asked us to wait, if it said."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class Embedder:
+    """Embeds many texts with batched, concurrent provider calls and backs off on rate limits."""
+
+    def __init__(self, provider=None, batch_size=INGEST_EMBED_BATCH, concurrency=INGEST_CONCURRENCY,
+                 max_retries=INGEST_MAX_RETRIES):
+        provider = provider or embedding_providers.get_provider()
+        if isinstance(provider, embedding_providers.OpenAIProvider) and provider.async_client is None:
+            ## Retries are ours, so the client's own are turned off
+            provider = embedding_providers.OpenAIProvider(
+                provider.model, provider.dimensions,
+                async_client=clients.get_async_openai_client().with_options(max_retries=0),
+            )
+        self.provider = provider
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self._limit = asyncio.Semaphore(concurrency)
+        self.requests = 0
+        self.retries = 0
+        self._tokens_before = provider.tokens
+
+    @property
+    def tokens(self):
+        return self.provider.tokens - self._tokens_before
+
+    async def _embed_batch(self, texts):
+        async with self._limit:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self.requests += 1
+                    return [vector.tolist() for vector in await self.provider.aembed(texts)]
+                except Exception as error:
+                    if attempt == self.max_retries or not _retryable(error):
+                        raise
+                    self.retries += 1
+                    ## Sleeping while holding the semaphore slows every worker down, which is what a 429 asks for
+                    await asyncio.sleep(_retry_after(error) or min(60.0, 2 ** attempt) * (0.5 + random.random()))
+
+    async def embed(self, texts):
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self._embed_batch(batch) for batch in batches))
+        return [vector for batch in results for vector in batch]
+
+
+async def _prepare(conn):
+    await conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS ingest_products (
+            line BIGINT, source_key TEXT, content_hash TEXT,
+            name TEXT, main_category TEXT, sub_category TEXT, image TEXT, link TEXT, ratings FLOAT,
+            no_of_ratings TEXT, discount_price_dollar FLOAT, actual_price_dollar FLOAT, description TEXT
+        );
+        CREATE TEMP TABLE IF NOT EXISTS ingest_embeddings (source_key TEXT PRIMARY KEY, embedding vector);
+        CREATE TEMP TABLE IF NOT EXISTS ingest_seen (source_key TEXT);
+        TRUNCATE ingest_products, ingest_embeddings, ingest_seen;
+    """)
+
+async def column_dimensions(conn):
+    """Declared dimensions of product_listing.embedded_description (None when it is an untyped vector)."""
+    typmod = await conn.fetchval("""
+        SELECT atttypmod FROM pg_attribute
+        WHERE attrelid = 'product_listing'::regclass AND attname = 'embedded_description'
+    """)
+    return typmod if typmod and typmod > 0 else None
+
+async def switch_model(conn, dimensions):
+    """
+    Re-type embedded_description for a model of other dimensions. Every vector is cleared (and
+    re-embedded by this ingest); the compact column is dropped, rebuild it with python -m utils.vector_storage build.
+    """
+    async with conn.transaction():
+        await conn.execute("DROP INDEX IF EXISTS product_listing_compact_hnsw")
+        await conn.execute("ALTER TABLE product_listing DROP COLUMN IF EXISTS embedded_compact")
+        await conn.execute(f"ALTER TABLE product_listing ALTER COLUMN embedded_description TYPE vector({int(dimensions)}) USING NULL")
+        await conn.execute("UPDATE product_listing SET embedding_model = NULL")
+
+## Last row of the chunk wins when a key appears twice
+LATEST_STAGED = "SELECT DISTINCT ON (source_key) * FROM ingest_products ORDER BY source_key, line DESC"
+
+UPSERT_SQL = f"""
+    INSERT INTO product_listing (source_key, content_hash, {", ".join(COLUMNS)}, embedded_description, embedding_model)
+    SELECT s.source_key, s.content_hash, {", ".join("s." + column for column in COLUMNS)}, e.embedding,
+           CASE WHEN e.embedding IS NOT NULL THEN $1::TEXT END
+    FROM ({LATEST_STAGED}) s
+    LEFT JOIN ingest_embeddings e USING (source_key)
+    WHERE TRUE  -- keeps ON CONFLICT from being parsed as a join condition
+    ON CONFLICT (source_key) DO UPDATE SET
+        {", ".join(f"{column} = EXCLUDED.{column}" for column in COLUMNS)},
+        embedded_description = COALESCE(EXCLUDED.embedded_description, product_listing.embedded_description),
+        embedding_model = CASE WHEN EXCLUDED.embedded_description IS NULL THEN product_listing.embedding_model
+                               ELSE EXCLUDED.embedding_model END,
+        content_hash = CASE WHEN EXCLUDED.embedded_description IS NULL THEN product_listing.content_hash
+                            ELSE EXCLUDED.content_hash END
+    -- unchanged rows are not rewritten
+    WHERE EXCLUDED.embedded_description IS NOT NULL
+       OR ({", ".join("product_listing." + column for column in COLUMNS)})
+          IS DISTINCT FROM ({", ".join("EXCLUDED." + column for column in COLUMNS)})
+    RETURNING (xmax = 0) AS inserted
+"""
+
+async def ingest_chunk(conn, chunk, embedder, stats, use_csv_embeddings=False, track_seen=False):
+    records = [record for record, _ in chunk]
+    await conn.execute("TRUNCATE ingest_products, ingest_embeddings")
+    await conn.copy_records_to_table("ingest_products", records=records, columns=STAGING_COLUMNS)
+    if track_seen:
+        await conn.execute("INSERT INTO ingest_seen SELECT source_key FROM ingest_products")
+
+    ## New keys, changed name/description, rows that never got an embedding or got it from another model
+    model = embedder.provider.tag
+    stale = await conn.fetch(f"""
+        SELECT s.source_key, s.name, s.description
+        FROM ({LATEST_STAGED}) s
+        LEFT JOIN product_listing p ON p.source_key = s.source_key
+        WHERE p.id IS NULL OR p.embedded_description IS NULL OR p.content_hash IS DISTINCT FROM s.content_hash
+           OR p.embedding_model IS DISTINCT FROM $1
+    """, model)
+
+    vectors = {}
+    if use_csv_embeddings:
+        csv_vectors = {record[1]: text for record, text in chunk if text}
+        for row in stale:
+            if row["source_key"] in csv_vectors:
+                vectors[row["source_key"]] = _vector(csv_vectors[row["source_key"]])
+    to_embed = [row for row in stale if row["source_key"] not in vectors]
+    if to_embed:
+        embedded = await embedder.embed([embedding_text(row["name"], row["description"]) for row in to_embed])
+        vectors.update(zip((row["source_key"] for row in to_embed), embedded))
+
+    async with conn.transaction():
+        if vectors:
+            await conn.copy_records_to_table("ingest_embeddings", records=list(vectors.items()),
+                                             columns=("source_key", "embedding"))
+        written = await conn.fetch(UPSERT_SQL, model)
+
+    inserted = sum(1 for row in written if row["inserted"])
+    stats["rows"] += len(records)
+    stats["inserted"] += inserted
+    stats["updated"] += len(written) - inserted
+    stats["embedded"] += len(to_embed)
+    stats["csv_embeddings"] += len(vectors) - len(to_embed)
+
+async def ingest(path, chunk_rows=INGEST_CHUNK_ROWS, embedder=None, use_csv_embeddings=False, delete_missing=False,
+                 allow_switch=False, progress=print):
+    """Upsert every product of the CSV at path; returns counts of what changed."""
+    embedder = embedder or Embedder()
+    model = embedder.provider.tag
+    if use_csv_embeddings and model != embedding_providers.CSV_EMBEDDING_MODEL:
+        raise ValueError(f"The CSV embeddings are {embedding_providers.CSV_EMBEDDING_MODEL}, not {model}")
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "deleted": 0, "embedded": 0, "csv_embeddings": 0}
+    started = time.perf_counter()
+
+    pool = await db_llm_async.get_pool()
+    async with pool.acquire() as conn:
+        dimensions = await column_dimensions(conn)
+        if dimensions and dimensions != embedder.provider.dimensions:
+            if not allow_switch:
+                raise ValueError(f"embedded_description holds {dimensions}-dimension vectors but {model} makes "
+                                 f"{embedder.provider.dimensions}; rerun with --switch-model to re-embed the catalog")
+            progress(f"Switching embedded_description from {dimensions} to {embedder.provider.dimensions} dimensions")
+            await switch_model(conn, embedder.provider.dimensions)
+
+        await _prepare(conn)
+        for chunk in chunked(read_products(path), chunk_rows):
+            await ingest_chunk(conn, chunk, embedder, stats, use_csv_embeddings, track_seen=delete_missing)
+            progress(f"{stats['rows']} rows, {stats['inserted']} new, {stats['updated']} changed, "
+                     f"{stats['embedded']} embedded ({time.perf_counter() - started:.0f}s)")
+
+        if delete_missing:
+            await conn.execute("CREATE INDEX IF NOT EXISTS ingest_seen_key ON ingest_seen (source_key)")
+            result = await conn.execute("""
+                DELETE FROM product_listing p
+                WHERE NOT EXISTS (SELECT 1 FROM ingest_seen s WHERE s.source_key = p.source_key)
+            """)
+            stats["deleted"] = int(result.split()[-1])
+        await conn.execute("ANALYZE product_listing")
+
+    stats.update(requests=embedder.requests, retries=embedder.retries, tokens=embedder.tokens,
+                 seconds=round(time.perf_counter() - started, 1))
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a product CSV into product_listing, embedding only new or changed rows.")
+    parser.add_argument("path", nargs="?", default="database/product_listing.csv")
+    parser.add_argument("--chunk-rows", type=int, default=INGEST_CHUNK_ROWS)
+    parser.add_argument("--batch-size", type=int, default=INGEST_EMBED_BATCH, help="texts per embedding call")
+    parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY, help="embedding calls in flight")
+    parser.add_argument("--use-csv-embeddings", action="store_true",
+                        help="trust the CSV's embedded_description column instead of calling the API for those rows "
+                             "(only with the OpenAI model the CSV was made with)")
+    parser.add_argument("--switch-model", action="store_true",
+                        help="when EMBED_PROVIDER makes vectors of other dimensions, re-type the column and re-embed everything")
+    parser.add_argument("--delete-missing", action="store_true",
+                        help="delete products that are not in the CSV (their cart and order rows are left dangling)")
+    args = parser.parse_args()
+
+    async def main():
+        embedder = Embedder(batch_size=args.batch_size, concurrency=args.concurrency)
+        return await ingest(args.path, args.chunk_rows, embedder, args.use_csv_embeddings, args.delete_missing,
+                            args.switch_model)
+
+    stats = asyncio.run(main())
+    print(", ".join(f"{key}: {value}" for key, value in stats.items()))
+    print("Running apps pick up the changes through catalog_version, including the SEARCH_ENGINE=numpy index.")
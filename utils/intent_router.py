@@ -0,0 +1,312 @@
+## Local intent router: short, unambiguous commands ("show my cart", "pay now", "add 2 whey protein")
+## are sent straight to their db_llm tool, skipping the routing completion and its tool schemas.
+## Everything else, and anything the rules are not sure about, still goes to the model.
+## python -m utils.intent_router eval reports precision, coverage and latency per threshold.
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from dotenv import load_dotenv
+from utils import tracing
+
+load_dotenv(override=True)
+
+## Router settings
+INTENT_ROUTER = os.getenv("INTENT_ROUTER", "1") == "1"
+INTENT_ROUTER_THRESHOLD = float(os.getenv("INTENT_ROUTER_THRESHOLD", 0.9))  # lower routes more turns, and more wrong ones
+
+## Default user id of the routed tool calls; llm.reply_prompt passes the conversation's own
+USER_ID = 1
+CONFIDENCE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0)
+
+NUMBERS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+           "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+
+## Politeness around the command, stripped before matching
+PREFIX = re.compile(r"^(?:(?:hi|hey|hello|ok|okay|so|and|now|please|pls|can you|could you|would you|will you|"
+                    r"can i|could i|may i|i want to|i wanna|i'd like to|i would like to|let me|let's|just|go ahead and)\b[\s,]*)+")
+SUFFIX = re.compile(r"(?:[\s,]+(?:please|pls|now|thanks|thank you|for me))+$")
+
+## Turns that cancel, negate or refer back to earlier messages always go to the model
+NEGATION = re.compile(r"\b(?:don't|dont|do not|not|never|no|cancel|undo|without|instead|wait|but)\b")
+REFERENCES = {"it", "this", "that", "them", "these", "those", "one", "ones", "first", "second", "third", "last",
+              "same", "another", "other", "everything", "all", "cart", "items", "products", "something"}
+## Item words that make an add/remove a search rather than a command
+SEARCH_WORDS = re.compile(r"\b(?:best|cheap|cheapest|good|recommend\w*|under|below|over|above|less|more than|"
+                          r"which|what|any|some kind|for|with)\b|[$?]|\b(?:and|or)\b|,")
+## Item words that tie it to something other than the cart ("add milk to coffee", "put the kettle on")
+PREPOSITIONS = {"to", "into", "onto", "in", "on", "off", "out", "from", "of", "at"}
+
+CART = r"(?:my |the )?(?:shopping )?(?:cart|basket)"
+## "products" alone may mean the catalog ("show products"), so it only counts next to "status"
+ORDERS = r"(?:my |the )?(?:orders?|purchases|deliver(?:y|ies)|packages?|parcels?)"
+QUANTITY = r"(?P<quantity>\d+|" + "|".join(NUMBERS) + ")"
+UNITS = r"(?:(?:more |x )|(?:bottles?|packs?|boxes?|tubs?|bags?|jars?|units?|pieces?|cans?) of )?"
+ITEM = r"(?:the |some |a |an |my )?(?P<item>[a-z0-9][a-z0-9 &'%.+-]*?)"
+
+## intent: [(pattern, confidence of a whole-message match)]
+RULES = {
+    "show_cart": [
+        (rf"(?:show|view|see|display|open|check|list)(?: me)? {CART}(?: items| contents)?", 0.97),
+        (rf"what(?:'s| is) in {CART}", 0.97),
+        (CART, 0.9),
+    ],
+    "pay_cart": [
+        (r"(?:pay|checkout)(?: for)?(?: (?:my|the) (?:shopping )?(?:cart|order|products|items))?", 0.95),
+        (rf"(?:buy|purchase) (?:everything|all|all the items|all the products) in {CART}", 0.95),
+        (r"(?:proceed|go) to (?:checkout|payment)", 0.95),
+        (r"place (?:my|the) order", 0.9),
+        ## "check out my cart" may only mean "look at it"
+        (rf"check out(?: {CART})?", 0.8),
+    ],
+    "check_products_status": [
+        (rf"where(?:'s|'re| is| are) {ORDERS}", 0.95),
+        (rf"(?:check|show|track|view|see|list)(?: me)? {ORDERS}(?: status| statuses)?", 0.95),
+        (r"(?:check |show |view )?(?:the |my )?(?:order|delivery|product|products) status(?:es)?", 0.95),
+        (rf"(?:check |show |view )?(?:the )?status of (?:{ORDERS}|(?:my |the )?products)", 0.95),
+        (rf"when (?:will|does|do) {ORDERS} (?:arrive|come|get here)", 0.9),
+    ],
+    ## Writes to the cart pass the default threshold only when the message is clearly about the cart:
+    ## "add" is, "put", "remove", "take out" and "change" only when they name it ("drop the price")
+    "add_product_to_cart": [
+        (rf"add(?: {QUANTITY})? {UNITS}{ITEM}(?: (?:to|into|in) {CART})?", 0.95),
+        (rf"put(?: {QUANTITY})? {UNITS}{ITEM} (?:into|in) {CART}", 0.95),
+        (rf"put(?: {QUANTITY})? {UNITS}{ITEM}", 0.8),
+    ],
+    "remove_product_from_cart": [
+        (rf"(?:remove|delete|drop)(?: all)? {ITEM} (?:from|out of) {CART}", 0.95),
+        (rf"take {ITEM} out of {CART}", 0.95),
+        (rf"(?:remove|delete|drop)(?: all)? {ITEM}", 0.8),
+        (rf"take {ITEM} out", 0.8),
+    ],
+    "update_product_quantity": [
+        (rf"(?:change|set|update|make)(?: the)?(?: (?:quantity|number|amount) of)? {ITEM}(?: quantity)? in {CART} to {QUANTITY}", 0.95),
+        (rf"(?:change|set|update|make)(?: the)?(?: (?:quantity|number|amount) of)? {ITEM}(?: quantity)? to {QUANTITY}", 0.8),
+        (rf"make it {QUANTITY} {UNITS}{ITEM}", 0.8),
+    ],
+}
+## Word boundaries keep partial matches from ending mid-word
+COMPILED = {intent: [(re.compile(rf"\b(?:{pattern})\b"), confidence) for pattern, confidence in rules]
+            for intent, rules in RULES.items()}
+
+
+def normalize(text):
+    text = " ".join(str(text).replace("’", "'").casefold().split())
+    text = re.sub(r"[\s.!?,;:]+$", "", text)
+    previous = None
+    while previous != text:
+        previous = text
+        text = SUFFIX.sub("", PREFIX.sub("", text)).strip()
+    return text
+
+def _arguments(intent, match):
+    """Tool arguments of a match, or None when its item or quantity isn't usable as is."""
+    groups = match.groupdict()
+    arguments = {"user_id": USER_ID}
+    if "item" in groups:
+        item = groups["item"].strip()
+        words = item.split()
+        if not words or len(words) > 6 or REFERENCES.intersection(words) or SEARCH_WORDS.search(item):
+            return None
+        if PREPOSITIONS.intersection(words):
+            return None
+        ## A number left in the item is a quantity the rule has no place for ("remove 2 whey protein")
+        if words[0].isdigit() or words[0] in NUMBERS:
+            return None
+        arguments["search_query"] = item
+    if groups.get("quantity"):
+        quantity = groups["quantity"]
+        quantity = NUMBERS[quantity] if quantity in NUMBERS else int(quantity)
+        if quantity < 1:
+            return None
+        arguments["quantity"] = quantity
+    elif intent == "add_product_to_cart":
+        arguments["quantity"] = 1
+    return arguments
+
+def classify(text):
+    """
+    Best (intent, arguments, confidence) for text, or None. A rule matching only part of the
+    message scores its confidence times the share of the message it covers, and messages
+    matched by rules of two intents ("show my cart and my orders") score 0.
+    """
+    text = normalize(text)
+    if not text or NEGATION.search(text):
+        return None
+
+    candidates = []
+    for intent, rules in COMPILED.items():
+        best = None
+        for pattern, confidence in rules:
+            match = pattern.fullmatch(text)
+            if match is None:
+                match = pattern.search(text)
+                if match is None or match.end() == match.start():
+                    continue
+                confidence *= (match.end() - match.start()) / len(text)
+            arguments = _arguments(intent, match)
+            if arguments is not None and (best is None or confidence > best[2]):
+                best = (intent, arguments, confidence)
+        if best is not None:
+            candidates.append(best)
+
+    if not candidates:
+        return None
+    candidates.sort(key=lambda candidate: candidate[2], reverse=True)
+    intent, arguments, confidence = candidates[0]
+    if len(candidates) > 1 and candidates[1][2] > 0.5:
+        confidence = 0.0
+    return intent, arguments, round(confidence, 3)
+
+def route(text, threshold=INTENT_ROUTER_THRESHOLD):
+    """(tool name, arguments, confidence) to run without the model, or None to ask the model."""
+    with tracing.span("routing.local") as span:
+        result = classify(text)
+        routed = result is not None and result[2] >= threshold
+        if result is None:
+            span.set(routed=False)
+        else:
+            span.set(intent=result[0], confidence=result[2], routed=routed)
+            if tracing.TRACING:
+                tracing.metrics.observe("intent_router_confidence", {"intent": result[0]}, result[2],
+                                        buckets=CONFIDENCE_BUCKETS)
+    return result if routed else None
+
+
+## Labelled messages for `eval`: (message, expected tool or None for "ask the model", expected arguments or None)
+EXAMPLES = [
+    ("Show my cart", "show_cart", {}),
+    ("show me my shopping cart please", "show_cart", {}),
+    ("What's in my cart?", "show_cart", {}),
+    ("what is in my basket", "show_cart", {}),
+    ("cart", "show_cart", {}),
+    ("I want to pay", "pay_cart", {}),
+    ("Pay now", "pay_cart", {}),
+    ("checkout please", "pay_cart", {}),
+    ("proceed to checkout", "pay_cart", {}),
+    ("buy everything in my cart", "pay_cart", {}),
+    ("Where are my orders?", "check_products_status", {}),
+    ("where's my package", "check_products_status", {}),
+    ("track my order", "check_products_status", {}),
+    ("order status", "check_products_status", {}),
+    ("check the status of my products", "check_products_status", {}),
+    ("when will my order arrive", "check_products_status", {}),
+    ("Add the chocolate whey protein to my cart", "add_product_to_cart", {"search_query": "chocolate whey protein", "quantity": 1}),
+    ("add 2 creatine monohydrate", "add_product_to_cart", {"search_query": "creatine monohydrate", "quantity": 2}),
+    ("please add three bottles of fish oil to the cart", "add_product_to_cart", {"search_query": "fish oil", "quantity": 3}),
+    ("Remove the creatine from my cart", "remove_product_from_cart", {"search_query": "creatine"}),
+    ("delete fish oil from my cart", "remove_product_from_cart", {"search_query": "fish oil"}),
+    ("take the multivitamin out of my basket", "remove_product_from_cart", {"search_query": "multivitamin"}),
+    ("put two tubs of whey protein in my cart", "add_product_to_cart", {"search_query": "whey protein", "quantity": 2}),
+    ("set the quantity of whey protein in my cart to 4", "update_product_quantity", {"search_query": "whey protein", "quantity": 4}),
+    ("change multivitamin in the cart to 2", "update_product_quantity", {"search_query": "multivitamin", "quantity": 2}),
+    ("add 1000 whey protein", "add_product_to_cart", {"search_query": "whey protein", "quantity": 1000}),
+    ## Must go to the model
+    ("Hi! What can you help me with?", None, None),
+    ("Do you have whey protein under $20?", None, None),
+    ("Which vitamins help with sleep?", None, None),
+    ("Add creatine and a multivitamin", None, None),
+    ("add it to my cart", None, None),
+    ("add the first one", None, None),
+    ("add the cheapest protein bar", None, None),
+    ("add a protein powder for my mom", None, None),
+    ("Show my cart and my orders", None, None),
+    ("don't pay yet", None, None),
+    ("how do I pay with a credit card", None, None),
+    ("should I add creatine to my diet", None, None),
+    ("remove everything from my cart", None, None),
+    ("check out my cart", None, None),
+    ("remove 2 whey protein from my cart", None, None),
+    ("show products", None, None),
+    ("list products", None, None),
+    ("show me my products", None, None),
+    ## Cart verbs without the cart: likely about something else, or a follow-up the model resolves
+    ("delete my account", None, None),
+    ("drop the price", None, None),
+    ("take the dog out", None, None),
+    ("remove the protein from my list", None, None),
+    ("put the kettle on", None, None),
+    ("add milk to coffee", None, None),
+    ("Remove the creatine", None, None),
+    ("change multivitamin to 2", None, None),
+    ("Make it 3 whey protein", None, None),
+    ("is whey protein good for weight loss", None, None),
+    ("I want to buy something for my joints", None, None),
+]
+
+def load_examples(path):
+    """JSON lines of {"message": ..., "intent": tool or null, "arguments": {...} or null}."""
+    with open(path) as file:
+        rows = [json.loads(line) for line in file if line.strip()]
+    return [(row["message"], row.get("intent"), row.get("arguments")) for row in rows]
+
+def _correct(result, intent, arguments):
+    if result[0] != intent:
+        return False
+    expected = dict(arguments or {})
+    return all(result[1].get(name) == value for name, value in expected.items())
+
+def evaluate(examples=EXAMPLES, thresholds=(0.5, 0.7, 0.8, 0.9, 0.95), repeat=100):
+    """
+    Per threshold: precision of the routed turns (right tool and arguments), coverage of the
+    turns that should be routed, and how many turns that should reach the model were routed anyway.
+    """
+    results = []
+    durations = []
+    for message, intent, arguments in examples:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = classify(message)
+        durations.append((time.perf_counter() - started) / repeat)
+        results.append((message, intent, arguments, result))
+
+    routable = sum(1 for _, intent, _, _ in results if intent is not None)
+    report = {"examples": len(results), "routable": routable, "thresholds": []}
+    for threshold in thresholds:
+        routed = [(message, intent, arguments, result) for message, intent, arguments, result in results
+                  if result is not None and result[2] >= threshold]
+        correct = [row for row in routed if _correct(row[3], row[1], row[2])]
+        report["thresholds"].append({
+            "threshold": threshold,
+            "routed": len(routed),
+            "precision": round(len(correct) / len(routed), 3) if routed else None,
+            "coverage": round(len(correct) / routable, 3) if routable else None,
+            "wrong": [(message, result[0], result[1]) for message, intent, arguments, result in routed
+                      if not _correct(result, intent, arguments)],
+        })
+
+    durations.sort()
+    report["latency_us"] = {
+        "p50": round(durations[len(durations) // 2] * 1e6, 1),
+        "p99": round(durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1e6, 1),
+        "max": round(durations[-1] * 1e6, 1),
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local intent router tools.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    evaluate_parser = subcommands.add_parser("eval", help="precision, coverage and latency of the router per threshold")
+    evaluate_parser.add_argument("--examples", help="JSON lines of labelled messages instead of the built-in ones")
+    evaluate_parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.7, 0.8, 0.9, 0.95])
+    classify_parser = subcommands.add_parser("classify", help="show what the router does with messages")
+    classify_parser.add_argument("messages", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "classify":
+        for message in args.messages:
+            result = classify(message)
+            routed = result is not None and result[2] >= INTENT_ROUTER_THRESHOLD
+            print(f"{message!r}: {result} -> {'routed' if routed else 'model'}")
+        sys.exit(0)
+
+    report = evaluate(load_examples(args.examples) if args.examples else EXAMPLES, args.thresholds)
+    print(f"{report['examples']} examples, {report['routable']} routable; "
+          f"classify p50 {report['latency_us']['p50']} us, p99 {report['latency_us']['p99']} us")
+    for row in report["thresholds"]:
+        print(f"threshold {row['threshold']:.2f}: routed {row['routed']:>3}, precision {row['precision']}, coverage {row['coverage']}")
+        for message, intent, arguments in row["wrong"]:
+            print(f"    wrong: {message!r} -> {intent} {arguments}")
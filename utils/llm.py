@@ -1,15 +1,25 @@
 import os
 import json
-import openai
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from utils import clients
 from utils import db_llm
+from utils import history as chat_history
+from utils import intent_router
+from utils import result_cache
+from utils import templates
+from utils import tracing
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
 MODEL_NAME = os.getenv("OPENAI_MODEL")
-client = openai.OpenAI(api_key=os.getenv("OPENAI_KEY"))
-system_message = [
-    {"role": "system", "content": "The user's id is 1. You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. You are responsible to answer questions from the users. If the user don't know what to buy, just ask them for more detail about what the user wants. Try to convince the user to buy something the user need. If question isn't about health, nutrition, exercise, and products in the shop, don't answer the question and said the question isn't related."},
-]
+def system_messages(user_id=intent_router.USER_ID):
+    return [
+        {"role": "system", "content": f"The user's id is {user_id}. You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. You are responsible to answer questions from the users. If the user don't know what to buy, just ask them for more detail about what the user wants. Try to convince the user to buy something the user need. If question isn't about health, nutrition, exercise, and products in the shop, don't answer the question and said the question isn't related."},
+    ]
+
+system_message = system_messages()
+
 custom_functions = [
     {
         "name": "search_products",
@@ -21,17 +31,33 @@ custom_functions = [
                     "type": "string",
                     "description": "Query string to use for full text search, e.g. 'protein powder'",
                 },
-               "price_filter": {
+                "filters": {
                     "type": "object",
-                    "description": "Filter search results based on price of the product",
+                    "description": "Only return products matching all of these; leave out what the user didn't ask for",
                     "properties": {
-                        "comparison_operator": {
+                        "min_price": {
+                            "type": "number",
+                            "description": "Lowest price in dollars, e.g. 10",
+                        },
+                        "max_price": {
+                            "type": "number",
+                            "description": "Highest price in dollars, e.g. 30 for 'under $30'",
+                        },
+                        "main_category": {
+                            "type": "string",
+                            "description": "Main category of the product, e.g. 'beauty & health'",
+                        },
+                        "sub_category": {
                             "type": "string",
-                            "description": "Operator to compare the column value, either '>', '<', '>=', '<=', '='",  # noqa
+                            "description": "Sub category of the product, e.g. 'Diet & Nutrition'",
                         },
-                        "value": {
+                        "min_rating": {
                             "type": "number",
-                            "description": "Value to compare against, e.g. 30",
+                            "description": "Lowest average rating out of 5, e.g. 4",
+                        },
+                        "min_discount_percent": {
+                            "type": "number",
+                            "description": "Lowest discount from the list price in percent, e.g. 20",
                         },
                     },
                 },
@@ -75,6 +101,38 @@ custom_functions = [
             "required": ["user_id", "search_query"],
         },
     },
+    {
+        "name": "add_products_to_cart",
+        "description": "Add several different products into a shopping cart in PostgreSQL database at once, e.g. '2 whey protein and 1 multivitamin'",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "user_id": {
+                    "type": "integer",
+                    "description": "User identification, e.g. 1",
+                },
+                "items": {
+                    "type": "array",
+                    "description": "Products to add",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "search_query": {
+                                "type": "string",
+                                "description": "Query string to use for full text search, e.g. 'protein powder'",
+                            },
+                            "quantity": {
+                                "type": "integer",
+                                "description": "The number of products added, e.g. 3",
+                            },
+                        },
+                        "required": ["search_query"],
+                    },
+                },
+            },
+            "required": ["user_id", "items"],
+        },
+    },
     {
         "name": "remove_product_from_cart",
         "description": "Remove products out of a shopping cart in PostgreSQL database based on user",
@@ -131,131 +189,347 @@ custom_functions = [
     },
     {
         "name": "check_products_status",
-        "description": "Check status of products the user choose in PostgreSQL database",
+        "description": "Check status of products the user choose in PostgreSQL database: the cart and the latest orders",
         "parameters": {
             "type": "object",
             "properties": {
                 "user_id": {
                     "type": "integer",
                     "description": "User identification, e.g. 1",
-                }
+                },
+                "before_order_id": {
+                    "type": "integer",
+                    "description": "Only orders older than this order number, from an 'ask for orders before #n' line; omit for the cart and the latest orders",
+                },
             },
             "required": ["user_id"],
         },
     },
 ]
 
-def reply_prompt(messages, prompt):
-    response = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=system_message + messages,
-        functions=custom_functions,
-        function_call="auto",  # Automatically call the function if needed
-    )
-
-    # Extract the function call details from the response
-    response_message = response.choices[0].message
-    function_call = response_message.function_call
-
-    if function_call:
-        function_name = function_call.name
-        function_args = json.loads(function_call.arguments)
-        print("function_args: ", function_name, "function_args: ", function_args)
-        
-        # Check if the function call matches the defined schema
-        if function_name == "search_products":
-            ## Call the function with arguments
-            formatted_results = db_llm.search_products_llm(*list(function_args.values()))
-
-            response_stream = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to know whether products are in the store. Then, convince the user to buy products in the list. Say apology and don't show recommendation if no matched product in sources. You just show the product name with bold format, italic price in dollar behind the name, and description with bullet point."},
-                    {"role": "user", "content": prompt + "\n\nSources:\n\n" + formatted_results}
-                ],
-                stream=True
-            )
-            return response_stream, True
-        elif function_name == "show_cart":
-            ## Call the function with arguments
-            formatted_results = db_llm.show_cart(*list(function_args.values()))
-
-            response_stream = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. You just tell the user the products (in the sources) in the shopping cart in table format with total price under the table. The header of the table including only Product, Price, Quantity, and Total. If it is empty, tell that it is empty and convince the user to buy something."},
-                    {"role": "user", "content": prompt + "\n\nSources:\n\n" + formatted_results}
-                ],
-                stream=True
-            )
-            return response_stream, True
-        elif function_name == "add_product_to_cart":
-            ## Call the function with arguments
-            formatted_results = db_llm.add_product_to_cart(*list(function_args.values()))
-
-            response_stream = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to add products into the shopping cart. If done, means the system add completely, don't want to know product name, and ask the user to buy others. If error, beg the user to try again."},
-                    {"role": "user", "content": prompt + "\n\nSources:\n\n" + formatted_results}
-                ],
-                stream=True
-            )
-            return response_stream, True
-        elif function_name == "remove_product_from_cart":
-            ## Call the function with arguments
-            formatted_results = db_llm.remove_product_from_cart(*list(function_args.values()))
-
-            response_stream = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to remove products out of the shopping cart. If done, means the system add completely, don't want to know product name, and ask the user to buy others. If error, beg the user to try again."},
-                    {"role": "user", "content": prompt + "\n\nSources:\n\n" + formatted_results}
-                ],
-                stream=True
-            )
-            return response_stream, True
-        elif function_name == "update_product_quantity":
-            ## Call the function with arguments
-            formatted_results = db_llm.update_product_quantity(*list(function_args.values()))
-
-            response_stream = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to update quantity of a product in the shopping cart. If done, means the system add completely, don't want to know product name, and ask the user to buy others. If error, beg the user to try again."},
-                    {"role": "user", "content": prompt + "\n\nSources:\n\n" + formatted_results}
-                ],
-                stream=True
-            )
-            return response_stream, True
-        elif function_name == "pay_cart":
-            ## Call the function with arguments
-            formatted_results = db_llm.pay_cart(*list(function_args.values()))
-            
-            response_stream = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to buy products in the shopping cart. If done, means the payment is complete, don't want to know product name, will receive all products in a few days, and tell later about this fake payment in bracket. If no products, tell them no products in the cart and convince the user to buy. If error, beg the user to try again."},
-                    {"role": "user", "content": prompt + "\n\nSources:\n\n" + formatted_results}
-                ],
-                stream=True
-            )
-            return response_stream, True
-        elif function_name == "check_products_status":
-            ## Call the function with arguments
-            formatted_results = db_llm.check_products_status(*list(function_args.values()))
-
-            response_stream = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to check the products current status provided in the source. You just explain the details about the products. The date format is 'ddd d mmm yy'. If no products, tell them no products in the cart and convince the user to buy. If error, beg the user to try again."},
-                    {"role": "user", "content": prompt + "\n\nSources:\n\n" + formatted_results}
-                ],
-                stream=True
-            )
-            return response_stream, True
+## System prompts for the follow-up completion that writes up each function's result
+function_prompts = {
+    "search_products": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to know whether products are in the store. Then, convince the user to buy products in the list. Say apology and don't show recommendation if no matched product in sources. You just show the product name with bold format, italic price in dollar behind the name, and description with bullet point.",
+    "show_cart": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. You just tell the user the products (in the sources) in the shopping cart in table format with total price under the table. The header of the table including only Product, Price, Quantity, and Total. If it is empty, tell that it is empty and convince the user to buy something.",
+    "add_product_to_cart": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to add products into the shopping cart. If done, means the system add completely, don't want to know product name, and ask the user to buy others. If error, beg the user to try again.",
+    "add_products_to_cart": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to add products into the shopping cart. If done, means the system add completely, don't want to know product name, and ask the user to buy others. If error, beg the user to try again.",
+    "remove_product_from_cart": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to remove products out of the shopping cart. If done, means the system add completely, don't want to know product name, and ask the user to buy others. If error, beg the user to try again.",
+    "update_product_quantity": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to update quantity of a product in the shopping cart. If done, means the system add completely, don't want to know product name, and ask the user to buy others. If error, beg the user to try again.",
+    "pay_cart": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to buy products in the shopping cart. If done, means the payment is complete, don't want to know product name, will receive all products in a few days, and tell later about this fake payment in bracket. If no products, tell them no products in the cart and convince the user to buy. If error, beg the user to try again.",
+    "check_products_status": "You are a polite clerk of a healthy and nutrition shop named 💪 Healthy & Nutrition Shop 💪. The user wants to check the products current status provided in the source. You just explain the details about the products. The date format is 'ddd d mmm yy'. If no products, tell them no products in the cart and convince the user to buy. If error, beg the user to try again.",
+}
+
+## Tools API schema and the db_llm handler behind each tool
+tools = [{"type": "function", "function": function} for function in custom_functions]
+tool_handlers = {
+    "search_products": db_llm.search_products_llm,
+    "show_cart": db_llm.show_cart,
+    "add_product_to_cart": db_llm.add_product_to_cart,
+    "add_products_to_cart": db_llm.add_products_to_cart,
+    "remove_product_from_cart": db_llm.remove_product_from_cart,
+    "update_product_quantity": db_llm.update_product_quantity,
+    "pay_cart": db_llm.pay_cart,
+    "check_products_status": db_llm.check_products_status,
+}
+
+## With RESPONSE_MODE=template these tools return rows, rendered locally into tables
+row_handlers = {
+    "show_cart": db_llm.get_cart_items,
+    "check_products_status": db_llm.get_products_status,
+}
+row_formatters = {
+    "show_cart": db_llm.format_cart,
+    "check_products_status": db_llm.format_products_status,
+}
+
+## Independent tool calls of one turn run concurrently on a bounded, process-wide pool
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", 4))
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+## Calls of one turn that touch the same cart keep the model's order: a cart write waits for every
+## earlier cart call, a cart read for the earlier writes. Searches never wait.
+CART_WRITES = {"add_product_to_cart", "add_products_to_cart", "remove_product_from_cart", "update_product_quantity", "pay_cart"}
+CART_READS = {"show_cart", "check_products_status"}
+
+class CallOrder:
+    """The earlier calls of a turn (futures or asyncio tasks) each new tool call has to wait for."""
+
+    def __init__(self):
+        self.last_write = None
+        self.reads = []
+
+    def schedule(self, function_name, start):
+        """start(after) launches the call once the calls in after are done; returns its future or task."""
+        writes = [self.last_write] if self.last_write is not None else []
+        if function_name in CART_WRITES:
+            call = start(writes + self.reads)
+            self.last_write, self.reads = call, []
+        elif function_name in CART_READS:
+            call = start(writes)
+            self.reads.append(call)
         else:
-            return "Thank you for your message! I’d love to assist you, but I’m not entirely sure I understand your request. Could you please clarify or provide a bit more detail about what you're looking for?", False
-    else:
+            call = start([])
+        return call
+
+UNCLEAR_REQUEST = "Thank you for your message! I’d love to assist you, but I’m not entirely sure I understand your request. Could you please clarify or provide a bit more detail about what you're looking for?"
+
+def parse_tool_call(tool_call):
+    """(name, arguments) of a tool call; arguments is None if the model sent invalid JSON."""
+    try:
+        return tool_call.function.name, json.loads(tool_call.function.arguments or "{}")
+    except json.JSONDecodeError:
+        return tool_call.function.name, None
+
+def run_tool(function_name, function_args):
+    handler = tool_handlers.get(function_name)
+    if templates.RESPONSE_MODE == "template":
+        handler = row_handlers.get(function_name, handler)
+    if handler is None or function_args is None:
+        return f"Error: can't call {function_name}"
+    with tracing.span("tool", tool=function_name) as span:
+        try:
+            result = handler(**function_args)
+        except Exception as error:
+            result = f"Error: {error}"
+        span.set(**result_size(result))
+        return result
+
+def submit_tool(function_name, function_args, after=()):
+    """Run a tool call on tool_executor once the futures in after are done."""
+    run = tracing.in_context(run_tool)
+    if not after:
+        return tool_executor.submit(run, function_name, function_args)
+
+    def run_after():
+        ## after was submitted earlier to the same FIFO pool, so it is already running or done
+        wait(after)
+        return run(function_name, function_args)
+    return tool_executor.submit(run_after)
+
+def result_size(result):
+    """Span attributes of a tool result: rows for row results, chars for text."""
+    if isinstance(result, list):
+        return {"rows": len(result)}
+    return {"chars": len(str(result)), "error": str(result).startswith("Error")}
+
+def record_usage(span, chunk):
+    ## Only present on the last chunk, and only when tracing asked for it (tracing.stream_options)
+    usage = getattr(chunk, "usage", None)
+    if usage is not None:
+        span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+class ToolCallBuffer:
+    """
+    Accumulates streamed tool-call deltas. A call counts as complete as soon as its
+    arguments parse as JSON, so it can be dispatched before the stream has finished.
+    """
+
+    def __init__(self):
+        self.calls = {}
+
+    def add(self, tool_call_deltas):
+        """Feed one chunk's deltas; returns [(index, name, arguments)] of calls that just completed."""
+        completed = []
+        for tool_call_delta in tool_call_deltas or []:
+            call = self.calls.setdefault(tool_call_delta.index, {"name": "", "arguments": "", "dispatched": False})
+            if tool_call_delta.function:
+                call["name"] += tool_call_delta.function.name or ""
+                call["arguments"] += tool_call_delta.function.arguments or ""
+            if not call["dispatched"] and call["name"] and call["arguments"].rstrip().endswith("}"):
+                try:
+                    function_args = json.loads(call["arguments"])
+                except json.JSONDecodeError:
+                    continue
+                call["dispatched"] = True
+                completed.append((tool_call_delta.index, call["name"], function_args))
+        return completed
+
+    def remaining(self):
+        """Calls not dispatched yet when the stream ends; arguments is None if they never parsed."""
+        remaining = []
+        for index, call in self.calls.items():
+            if call["dispatched"]:
+                continue
+            call["dispatched"] = True
+            try:
+                function_args = json.loads(call["arguments"] or "{}")
+            except json.JSONDecodeError:
+                function_args = None
+            remaining.append((index, call["name"], function_args))
+        return remaining
+
+    def summary(self):
+        return [(call["name"], call["arguments"]) for _, call in sorted(self.calls.items())]
+
+def follow_up_messages(prompt, results):
+    """One follow-up completion for all tool results, using each tool's write-up instructions."""
+    if len(results) == 1:
+        function_name, formatted_results = results[0]
+        return [
+            {"role": "system", "content": function_prompts[function_name]},
+            {"role": "user", "content": prompt + "\n\nSources:\n\n" + formatted_results}
+        ]
+
+    instructions = []
+    sources = ""
+    for function_name, formatted_results in results:
+        if function_prompts[function_name] not in instructions:
+            instructions.append(function_prompts[function_name])
+        sources += f"### {function_name}\n\n{formatted_results}\n\n"
+
+    return [
+        {"role": "system", "content": "The user asked for several things at once. Answer every part in one reply, in the order of the sources. For each part: " + " ".join(instructions)},
+        {"role": "user", "content": prompt + "\n\nSources:\n\n" + sources}
+    ]
+
+def local_reply(results):
+    """The whole reply rendered from templates, or None if any result needs the model (search, errors)."""
+    if templates.RESPONSE_MODE != "template":
+        return None
+    rendered = [templates.render(function_name, result) for function_name, result in results]
+    if any(text is None for text in rendered):
+        return None
+    return "\n\n".join(rendered)
+
+def results_as_text(results):
+    return [
+        (function_name, row_formatters[function_name](result) if isinstance(result, list) else result)
+        for function_name, result in results
+    ]
+
+def cacheable_search(calls):
+    """Arguments of a turn that is a single successful search_products call, whose answer may be cached."""
+    if not result_cache.SEARCH_CACHE_ANSWERS or len(calls) != 1:
+        return None
+    function_name, function_args, result = calls[0]
+    if function_name != "search_products" or not function_args or str(result).startswith("Error"):
+        return None
+    return {
+        "search_query": function_args.get("search_query"),
+        "filters": function_args.get("filters"),
+    }
+
+def _reply_stream(client, routing_stream, prompt):
+    """
+    Yield the reply text as it is produced. Text of the routing completion goes out at once;
+    each tool call is sent to the tool pool as soon as its arguments are complete (in CallOrder).
+    """
+    buffer = ToolCallBuffer()
+    order = CallOrder()
+    futures = {}
+    wrote_text = False
+
+    with tracing.span("routing.stream") as span:
+        started = time.perf_counter()
+        for chunk in routing_stream:
+            record_usage(span, chunk)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                if not wrote_text:
+                    span.set(first_token_ms=round((time.perf_counter() - started) * 1000, 1))
+                wrote_text = True
+                yield delta.content
+            for index, function_name, function_args in buffer.add(delta.tool_calls):
+                futures[index] = (function_name, function_args, order.schedule(
+                    function_name, lambda after: submit_tool(function_name, function_args, after)))
+
+        for index, function_name, function_args in buffer.remaining():
+            futures[index] = (function_name, function_args, order.schedule(
+                function_name, lambda after: submit_tool(function_name, function_args, after)))
+        span.set(tool_calls=[call[0] for call in buffer.summary()])
+    if not futures:
+        return
+
+    with tracing.span("tools.wait"):
+        calls = [(function_name, function_args, future.result()) for _, (function_name, function_args, future) in sorted(futures.items())]
+    if wrote_text:
+        yield "\n\n"
+    yield from _answer_stream(client, calls, prompt)
+
+def _routed_stream(function_name, function_args, prompt):
+    """Reply to a turn the intent router matched: its tool runs at once, without the routing completion."""
+    result = run_tool(function_name, function_args)
+    yield from _answer_stream(None, [(function_name, function_args, result)], prompt)
+
+def _answer_stream(client, calls, prompt):
+    """Yield the reply to the turn's [(name, arguments, result)] tool calls: rendered locally, cached, or written up by the model."""
+    results = [(function_name, result) for function_name, _, result in calls if function_name in tool_handlers]
+    if not results:
+        yield UNCLEAR_REQUEST
+        return
+
+    ## Deterministic results skip the second completion
+    with tracing.span("render.local") as span:
+        reply = local_reply(results)
+        span.set(rendered=reply is not None)
+    if reply is not None:
+        yield reply
+        return
+
+    search_args = cacheable_search(calls)
+    if search_args is not None:
+        reply = db_llm.cached_search_answer(**search_args)
+        if reply is not None:
+            yield reply
+            return
+
+    with tracing.span("follow_up") as span:
+        started = time.perf_counter()
+        answer = []
+        client = client or clients.get_openai_client()
+        response_stream = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=follow_up_messages(prompt, results_as_text(results)),
+            stream=True,
+            **tracing.stream_options()
+        )
+        for chunk in response_stream:
+            record_usage(span, chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not answer:
+                    span.set(first_token_ms=round((time.perf_counter() - started) * 1000, 1))
+                answer.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+
+    if search_args is not None:
+        db_llm.store_search_answer(answer="".join(answer), answer_seconds=time.perf_counter() - started, **search_args)
+
+def routed_arguments(function_args, user_id):
+    """Routed tool arguments for the conversation's user instead of intent_router.USER_ID."""
+    return dict(function_args, user_id=user_id) if "user_id" in function_args else function_args
+
+def reply_prompt(messages, prompt, history=None, user_id=intent_router.USER_ID):
+    """
+    Returns (text generator, True). The routing completion is already streaming when this returns,
+    so plain answers reach the UI at the model's time-to-first-token.
+    history is the conversation's HistoryManager; pass the same one every turn so the summary
+    of older turns is extended instead of rebuilt.
+    Obvious commands matched by the intent router skip the routing completion (INTENT_ROUTER).
+    """
+    if intent_router.INTENT_ROUTER:
+        route = intent_router.route(prompt)
+        if route is not None:
+            function_name, function_args, _ = route
+            return _routed_stream(function_name, routed_arguments(function_args, user_id), prompt), True
+
+    if history is None:
+        history = chat_history.HistoryManager()
+    with tracing.span("history.fit") as span:
+        fitted = history.fit(messages)
+        span.set(messages=len(fitted), summarized=history.summarized)
+
+    client = clients.get_openai_client()
+    with tracing.span("routing.open"):
+        routing_stream = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=system_messages(user_id) + fitted,
+            tools=tools,
+            tool_choice="auto",  # Automatically call the tools if needed
+            parallel_tool_calls=True,
+            stream=True,
+            **tracing.stream_options()
+        )
 
-        return response_message.content, False
+    return _reply_stream(client, routing_stream, prompt), True
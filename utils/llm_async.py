@@ -0,0 +1,170 @@
+## asyncio version of llm.reply_prompt, for serving many conversations from one event loop
+import time
+import asyncio
+from utils import clients
+from utils import db_llm_async
+from utils import history as chat_history
+from utils import intent_router
+from utils import templates
+from utils import tracing
+from utils.llm import (
+    MODEL_NAME, TOOL_WORKERS, UNCLEAR_REQUEST, CallOrder, system_messages, routed_arguments, tools, follow_up_messages,
+    local_reply, results_as_text, cacheable_search, result_size, record_usage, ToolCallBuffer,
+)
+
+tool_handlers = {
+    "search_products": db_llm_async.search_products_llm,
+    "show_cart": db_llm_async.show_cart,
+    "add_product_to_cart": db_llm_async.add_product_to_cart,
+    "add_products_to_cart": db_llm_async.add_products_to_cart,
+    "remove_product_from_cart": db_llm_async.remove_product_from_cart,
+    "update_product_quantity": db_llm_async.update_product_quantity,
+    "pay_cart": db_llm_async.pay_cart,
+    "check_products_status": db_llm_async.check_products_status,
+}
+
+row_handlers = {
+    "show_cart": db_llm_async.get_cart_items,
+    "check_products_status": db_llm_async.get_products_status,
+}
+
+async def stream_text(response_stream, span=tracing.NOOP_SPAN):
+    """Yield only the text deltas of an async completion stream."""
+    async for chunk in response_stream:
+        record_usage(span, chunk)
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def run_tool(function_name, function_args, limit):
+    handler = tool_handlers.get(function_name)
+    if templates.RESPONSE_MODE == "template":
+        handler = row_handlers.get(function_name, handler)
+    if handler is None or function_args is None:
+        return f"Error: can't call {function_name}"
+    async with limit:
+        with tracing.span("tool", tool=function_name) as span:
+            try:
+                result = await handler(**function_args)
+            except Exception as error:
+                result = f"Error: {error}"
+            span.set(**result_size(result))
+            return result
+
+async def run_tool_after(after, function_name, function_args, limit):
+    """run_tool once the tasks in after are done (CallOrder)."""
+    if after:
+        await asyncio.wait(after)
+    return await run_tool(function_name, function_args, limit)
+
+async def _reply_stream(client, routing_stream, prompt):
+    """Async twin of llm._reply_stream: text goes out at once, tool calls start as soon as they are complete."""
+    buffer = ToolCallBuffer()
+    limit = asyncio.Semaphore(TOOL_WORKERS)
+    order = CallOrder()
+    tasks = {}
+    wrote_text = False
+
+    with tracing.span("routing.stream") as span:
+        started = time.perf_counter()
+        async for chunk in routing_stream:
+            record_usage(span, chunk)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                if not wrote_text:
+                    span.set(first_token_ms=round((time.perf_counter() - started) * 1000, 1))
+                wrote_text = True
+                yield delta.content
+            for index, function_name, function_args in buffer.add(delta.tool_calls):
+                tasks[index] = (function_name, function_args, order.schedule(function_name, lambda after: asyncio.create_task(
+                    run_tool_after(after, function_name, function_args, limit))))
+
+        for index, function_name, function_args in buffer.remaining():
+            tasks[index] = (function_name, function_args, order.schedule(function_name, lambda after: asyncio.create_task(
+                run_tool_after(after, function_name, function_args, limit))))
+        span.set(tool_calls=[call[0] for call in buffer.summary()])
+    if not tasks:
+        return
+
+    with tracing.span("tools.wait"):
+        calls = [(function_name, function_args, await task) for _, (function_name, function_args, task) in sorted(tasks.items())]
+    if wrote_text:
+        yield "\n\n"
+    async for text in _answer_stream(client, calls, prompt):
+        yield text
+
+async def _routed_stream(function_name, function_args, prompt):
+    """Async twin of llm._routed_stream."""
+    result = await run_tool(function_name, function_args, asyncio.Semaphore(1))
+    async for text in _answer_stream(None, [(function_name, function_args, result)], prompt):
+        yield text
+
+async def _answer_stream(client, calls, prompt):
+    """Async twin of llm._answer_stream."""
+    results = [(function_name, result) for function_name, _, result in calls if function_name in tool_handlers]
+    if not results:
+        yield UNCLEAR_REQUEST
+        return
+
+    ## Deterministic results skip the second completion
+    with tracing.span("render.local") as span:
+        reply = local_reply(results)
+        span.set(rendered=reply is not None)
+    if reply is not None:
+        yield reply
+        return
+
+    search_args = cacheable_search(calls)
+    if search_args is not None:
+        reply = await db_llm_async.cached_search_answer(**search_args)
+        if reply is not None:
+            yield reply
+            return
+
+    with tracing.span("follow_up") as span:
+        started = time.perf_counter()
+        answer = []
+        client = client or clients.get_async_openai_client()
+        response_stream = await client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=follow_up_messages(prompt, results_as_text(results)),
+            stream=True,
+            **tracing.stream_options()
+        )
+        async for text in stream_text(response_stream, span):
+            if not answer:
+                span.set(first_token_ms=round((time.perf_counter() - started) * 1000, 1))
+            answer.append(text)
+            yield text
+
+    if search_args is not None:
+        await db_llm_async.store_search_answer(answer="".join(answer), answer_seconds=time.perf_counter() - started, **search_args)
+
+async def reply_prompt(messages, prompt, history=None, user_id=intent_router.USER_ID):
+    """Same contract as llm.reply_prompt: (async text generator, True)."""
+    if intent_router.INTENT_ROUTER:
+        route = intent_router.route(prompt)
+        if route is not None:
+            function_name, function_args, _ = route
+            return _routed_stream(function_name, routed_arguments(function_args, user_id), prompt), True
+
+    if history is None:
+        history = chat_history.HistoryManager()
+    with tracing.span("history.fit") as span:
+        fitted = await history.afit(messages)
+        span.set(messages=len(fitted), summarized=history.summarized)
+
+    client = clients.get_async_openai_client()
+    with tracing.span("routing.open"):
+        routing_stream = await client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=system_messages(user_id) + fitted,
+            tools=tools,
+            tool_choice="auto",  # Automatically call the tools if needed
+            parallel_tool_calls=True,
+            stream=True,
+            **tracing.stream_options()
+        )
+
+    return _reply_stream(client, routing_stream, prompt), True
@@ -0,0 +1,45 @@
+import os
+import glob
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database", "migrations")
+
+
+def apply_migrations(conn, migrations_dir=MIGRATIONS_DIR):
+    """Run database/migrations/*.sql in name order, each once and in its own transaction."""
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("SELECT name FROM schema_migrations")
+        applied = {row[0] for row in cur.fetchall()}
+
+    done = []
+    try:
+        conn.autocommit = False
+        for path in sorted(glob.glob(os.path.join(migrations_dir, "*.sql"))):
+            name = os.path.basename(path)
+            if name in applied:
+                continue
+            with open(path) as file:
+                sql = file.read()
+            with conn, conn.cursor() as cur:
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+            done.append(name)
+    finally:
+        conn.autocommit = autocommit
+
+    return done
+
+
+if __name__ == "__main__":
+    from utils import pool
+
+    with pool.connection() as conn:
+        for name in apply_migrations(conn):
+            print(f"Applied {name}")
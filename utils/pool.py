@@ -0,0 +1,208 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool as pg_pool
+from pgvector.psycopg2 import register_vector
+from dotenv import load_dotenv
+from utils import vector_storage
+
+load_dotenv(override=True)
+
+## Set up Postgres
+DBUSER = os.environ["DBUSER"]
+DBPASS = os.environ["DBPASS"]
+DBHOST = os.environ["DBHOST"]
+DBNAME = os.environ["DBNAME"]
+DBPORT = int(os.getenv("DBPORT", 5432))
+## Use SSL if not connecting to localhost
+DBSSL = "disable"
+if DBHOST != "localhost":
+    DBSSL = "require"
+
+## Pool settings
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))                  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_AFTER = float(os.getenv("DB_POOL_HEALTHCHECK_AFTER", 60))  # ping connections idle longer than this
+
+def get_db_url():
+    return f"postgresql://{DBUSER}:{DBPASS}@{DBHOST}:{DBPORT}/{DBNAME}"
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _VectorConnectionPool(pg_pool.ThreadedConnectionPool):
+    """Every new connection is autocommit and understands the pgvector type."""
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        conn.autocommit = True
+        register_vector(conn)
+        with conn.cursor() as cur:
+            for setting in vector_storage.session_settings():
+                try:
+                    cur.execute(setting)
+                except psycopg2.Error:
+                    pass
+        return conn
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 pool. Callers block (up to timeout) instead of failing when all
+    connections are checked out, and broken connections are replaced transparently.
+    """
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 healthcheck_after=DB_POOL_HEALTHCHECK_AFTER, **connect_kwargs):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+        self._pool = _VectorConnectionPool(minconn, maxconn, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.in_use = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+        self.reconnects = 0
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0.0) < self.healthcheck_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        conn = self._pool.getconn()
+        if not self._healthy(conn):
+            self._pool.putconn(conn, close=True)
+            with self._lock:
+                self.reconnects += 1
+            conn = self._pool.getconn()
+        return conn
+
+    @contextmanager
+    def connection(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+        conn = None
+        broken = False
+        try:
+            conn = self._checkout()
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if conn is not None:
+                broken = broken or bool(conn.closed)
+                if not broken and not conn.autocommit:
+                    conn.rollback()
+                    conn.autocommit = True
+                self._last_used.pop(id(conn), None)
+                if not broken:
+                    self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn, close=broken)
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def cursor(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            yield cur
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.maxconn,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "wait_seconds_avg": self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+                "timeouts": self.timeouts,
+                "reconnects": self.reconnects,
+            }
+
+    def close(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Process-wide pool, created on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                try:
+                    _pool = ConnectionPool(database=DBNAME, user=DBUSER, password=DBPASS, host=DBHOST, port=DBPORT, sslmode=DBSSL)
+                except Exception as error:
+                    print(f"Error connecting to the database: {error}")
+                    raise error
+                check_embedding_model(_pool)
+    return _pool
+
+def configure(user=None, password=None, host=None, port=None, database=None, sslmode=None):
+    """
+    Point the app at another database (benchmarks, scripts) instead of the DB* settings. The current
+    pool is closed; the next get_pool() connects with the new settings, as does db_llm_async.
+    """
+    global DBUSER, DBPASS, DBHOST, DBPORT, DBNAME, DBSSL, _pool
+    with _pool_lock:
+        DBUSER = DBUSER if user is None else user
+        DBPASS = DBPASS if password is None else password
+        DBHOST = DBHOST if host is None else host
+        DBPORT = DBPORT if port is None else int(port)
+        DBNAME = DBNAME if database is None else database
+        DBSSL = DBSSL if sslmode is None else sslmode
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def check_embedding_model(pool):
+    """Warn once at startup when no catalog vector matches the embedding provider (utils/embedding_providers.py)."""
+    from utils import embedding_providers
+
+    try:
+        with pool.cursor() as cur:
+            cur.execute(embedding_providers.CATALOG_MODELS_SQL)
+            rows = cur.fetchall()
+    except psycopg2.Error:
+        ## Migration 008 not applied yet
+        return
+    warning = embedding_providers.catalog_warning(rows)
+    if warning:
+        print(warning)
+
+def connection():
+    return get_pool().connection()
+
+def cursor():
+    return get_pool().cursor()
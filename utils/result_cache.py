@@ -0,0 +1,182 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from utils import search_filters
+
+load_dotenv(override=True)
+
+## Semantic result cache settings
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1000))                   # cached searches, 0 disables the cache
+SEARCH_CACHE_DISTANCE = float(os.getenv("SEARCH_CACHE_DISTANCE", 0.05))         # max cosine distance to reuse a result
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 3600))                   # seconds, 0 = never expire
+SEARCH_CACHE_ANSWERS = os.getenv("SEARCH_CACHE_ANSWERS", "0") == "1"            # also reuse the written answer
+SEARCH_CACHE_VERSION_INTERVAL = float(os.getenv("SEARCH_CACHE_VERSION_INTERVAL", 5))  # seconds between catalog_version checks
+
+CATALOG_VERSION_SQL = "SELECT version FROM catalog_version"
+
+
+class SemanticCache:
+    """
+    search_products results keyed on the query embedding and the search filters. A new query
+    reuses the closest cached entry within max_distance (cosine) of it, so "best whey protein
+    under $20" and "whey protein under 20 dollars" share one search.
+    Two tiers per entry: the ranked product ids, and optionally the final written answer.
+    Everything is dropped when the catalog_version counter changes or after invalidate().
+    """
+
+    def __init__(self, max_size=SEARCH_CACHE_SIZE, max_distance=SEARCH_CACHE_DISTANCE, ttl=SEARCH_CACHE_TTL,
+                 version_interval=SEARCH_CACHE_VERSION_INTERVAL):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self.version = None
+        self._version_checked = 0.0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._matrix = None
+        self._matrix_ids = []
+        self._matrix_keys = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.answer_hits = 0
+        self.saved_seconds = 0.0
+
+    def _expired(self, entry):
+        return self.ttl and time.time() - entry["created_at"] > self.ttl
+
+    def _rebuild(self):
+        ## Rebuilt lazily after a change, so a lookup is one matrix-vector product
+        entry_ids = list(self._entries)
+        if entry_ids:
+            self._matrix = np.vstack([self._entries[entry_id]["embedding"] for entry_id in entry_ids])
+            self._matrix_keys = np.array([self._entries[entry_id]["filter_key"] for entry_id in entry_ids])
+        else:
+            self._matrix = None
+            self._matrix_keys = None
+        self._matrix_ids = entry_ids
+
+    def _nearest(self, embedding, conditions):
+        if self._matrix is None and self._entries:
+            self._rebuild()
+        if self._matrix is None:
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return None
+        similarities = np.where(self._matrix_keys == search_filters.key(conditions), self._matrix @ (query / norm), -np.inf)
+        row = int(np.argmax(similarities))
+        if 1.0 - similarities[row] > self.max_distance:
+            return None
+
+        entry_id = self._matrix_ids[row]
+        entry = self._entries[entry_id]
+        if self._expired(entry):
+            self._remove(entry_id)
+            return None
+        self._entries.move_to_end(entry_id)
+        return entry
+
+    def _remove(self, entry_id):
+        self._entries.pop(entry_id, None)
+        self._matrix = None
+
+    def version_due(self):
+        """True when the catalog_version counter should be read again before trusting the cache."""
+        return time.time() - self._version_checked > self.version_interval
+
+    def set_version(self, version):
+        """Record the current catalog_version; a change means products changed, so every entry is dropped."""
+        with self._lock:
+            self._version_checked = time.time()
+            if version != self.version:
+                if self.version is not None:
+                    self._entries.clear()
+                    self._matrix = None
+                self.version = version
+
+    def lookup(self, embedding, conditions=()):
+        """The ranked product ids of a close enough cached search, or None."""
+        if not self.max_size:
+            return None
+        with self._lock:
+            entry = self._nearest(embedding, conditions)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += entry["search_seconds"]
+            return entry["ids"]
+
+    def store(self, embedding, conditions, ids, search_seconds):
+        if not self.max_size:
+            return
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return
+        with self._lock:
+            self._entries[self._next_id] = {
+                "embedding": query / norm,
+                "filter_key": search_filters.key(conditions),
+                "ids": list(ids),
+                "search_seconds": search_seconds,
+                "answer": None,
+                "answer_seconds": 0.0,
+                "created_at": time.time(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def lookup_answer(self, embedding, conditions=()):
+        """Second tier: the written answer of a close enough cached search, or None."""
+        if not (self.max_size and SEARCH_CACHE_ANSWERS):
+            return None
+        with self._lock:
+            entry = self._nearest(embedding, conditions)
+            if entry is None or entry["answer"] is None:
+                return None
+            self.answer_hits += 1
+            self.saved_seconds += entry["answer_seconds"]
+            return entry["answer"]
+
+    def store_answer(self, embedding, conditions, answer, answer_seconds):
+        if not (self.max_size and SEARCH_CACHE_ANSWERS):
+            return
+        with self._lock:
+            entry = self._nearest(embedding, conditions)
+            if entry is not None:
+                entry["answer"] = answer
+                entry["answer_seconds"] = answer_seconds
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "answer_hits": self.answer_hits,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "catalog_version": self.version,
+            }
+
+
+search_cache = SemanticCache()
+
+def invalidate():
+    search_cache.invalidate()
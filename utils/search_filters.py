@@ -0,0 +1,100 @@
+## Structured filters of search_products. Tool arguments are turned into a canonical tuple of
+## (field, operator, value) conditions, which become the arguments of the hybrid_search() SQL function,
+## bound predicates and a mask for the numpy engine, and a key for the search cache.
+import operator
+import numpy as np
+
+## field: SQL expression it filters on (see database/migrations/005_product_listing_filters.sql for the indexes)
+FIELDS = {
+    "price": "discount_price_dollar",
+    "ratings": "ratings",
+    "discount_percent": "discount_percent",
+    "main_category": "lower(main_category)",
+    "sub_category": "lower(sub_category)",
+}
+TEXT_FIELDS = ("main_category", "sub_category")
+
+COMPARISON_OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "=": operator.eq,
+}
+
+## search_products "filters" argument: name -> (field, operator)
+TOOL_FILTERS = {
+    "min_price": ("price", ">="),
+    "max_price": ("price", "<="),
+    "main_category": ("main_category", "="),
+    "sub_category": ("sub_category", "="),
+    "min_rating": ("ratings", ">="),
+    "min_discount_percent": ("discount_percent", ">="),
+}
+
+
+def _value(field, value):
+    if field in TEXT_FIELDS:
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"{field} must be a non-empty string")
+        return value.strip().lower()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number, got {value!r}")
+
+def parse(filters=None):
+    """Canonical conditions of the search_products filters argument."""
+    conditions = set()
+    for name, value in (filters or {}).items():
+        if value is None or value == "":
+            continue
+        if name not in TOOL_FILTERS:
+            raise ValueError(f"Unsupported filter: {name}")
+        field, comparison = TOOL_FILTERS[name]
+        conditions.add((field, comparison, _value(field, value)))
+
+    return tuple(sorted(conditions))
+
+def key(conditions):
+    """Search cache key: searches are only reused under the same filters."""
+    return "&".join(f"{field}{comparison}{value}" for field, comparison, value in conditions)
+
+def to_sql(conditions):
+    """(predicate, params) of the conditions joined with AND, with %(filter_n)s placeholders; predicate is "" without conditions."""
+    predicates = []
+    params = {}
+    for position, (field, comparison, value) in enumerate(conditions):
+        ## Both come from the whitelists above, values are always bound
+        if field not in FIELDS or comparison not in COMPARISON_OPERATORS:
+            raise ValueError(f"Unsupported filter: {field} {comparison}")
+        params[f"filter_{position}"] = value
+        predicates.append(f"{FIELDS[field]} {comparison} %(filter_{position})s")
+
+    return " AND ".join(predicates), params
+
+def function_args(conditions):
+    """Filter arguments of the hybrid_search() SQL function (database/migrations/006_hybrid_search_function.sql)."""
+    args = dict.fromkeys(("min_price", "max_price", "main_category", "sub_category", "min_rating", "min_discount_percent"))
+    lower_bounds = {"price": "min_price", "ratings": "min_rating", "discount_percent": "min_discount_percent"}
+    for field, comparison, value in conditions:
+        if field in TEXT_FIELDS:
+            args[field] = value
+            continue
+        if comparison in (">=", "=") and field in lower_bounds:
+            name = lower_bounds[field]
+            args[name] = value if args[name] is None else max(args[name], value)
+        if comparison in ("<=", "=") and field == "price":
+            args["max_price"] = value if args["max_price"] is None else min(args["max_price"], value)
+    return args
+
+def mask(conditions, columns):
+    """Boolean row mask for the numpy engine; columns maps each field to an array (NaN/None never match)."""
+    selected = None
+    for field, comparison, value in conditions:
+        column = columns[field]
+        if field in TEXT_FIELDS:
+            matches = np.array([item is not None and COMPARISON_OPERATORS[comparison](item, value) for item in column],
+                               dtype=bool)
+        else:
+            matches = COMPARISON_OPERATORS[comparison](column, value)
+        selected = matches if selected is None else selected & matches
+    return selected
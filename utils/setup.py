@@ -0,0 +1,92 @@
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+## Modules the Streamlit app imports at startup
+STARTUP_MODULES = ["utils.image", "utils.db", "utils.db_llm", "utils.llm"]
+
+
+def setup_database():
+    """One-time schema work that used to run on every import: pgvector extension, migrations, cache table."""
+    import psycopg2
+    from utils import pool
+    from utils import embedding
+    from utils.migrate import apply_migrations
+
+    ## Plain connection: the pooled ones register the vector type, which needs the extension first
+    conn = psycopg2.connect(database=pool.DBNAME, user=pool.DBUSER, password=pool.DBPASS, host=pool.DBHOST, port=pool.DBPORT, sslmode=pool.DBSSL)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            print("pgvector extension is ready")
+
+            if embedding.EMBED_CACHE_BACKEND == "postgres":
+                with open(os.path.join(ROOT_DIR, "database", "embedding_cache.sql")) as file:
+                    cur.execute(file.read())
+                print("embedding_cache table is ready")
+
+        for name in apply_migrations(conn):
+            print(f"Applied {name}")
+    finally:
+        conn.close()
+
+
+def archive_orders(older_than_days=90):
+    """Move orders that arrived more than older_than_days ago to shopping_cart_archive; returns the rows moved."""
+    from utils import pool
+
+    with pool.cursor() as cur:
+        cur.execute("SELECT archive_orders(make_interval(days => %s))", (older_than_days,))
+        return cur.fetchone()[0]
+
+
+def measure_startup(runs=5, modules=STARTUP_MODULES):
+    """Import the app's modules in fresh interpreters and return the import times in seconds."""
+    code = (
+        "import time; started = time.perf_counter(); "
+        + "; ".join(f"import {module}" for module in modules)
+        + "; print(time.perf_counter() - started)"
+    )
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT_DIR, check=True, capture_output=True, text=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Set up the database and check app cold start.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("db", help="create the pgvector extension and apply database/migrations")
+    archive = subparsers.add_parser("archive-orders", help="move old orders out of shopping_cart (still listed by check_products_status)")
+    archive.add_argument("--older-than-days", type=int, default=90)
+    startup = subparsers.add_parser("startup-time", help="measure how long importing the app's modules takes")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--max-seconds", type=float, help="exit non-zero if the median is above this")
+    args = parser.parse_args()
+
+    if args.command == "db":
+        setup_database()
+        return
+    if args.command == "archive-orders":
+        print(f"Archived {archive_orders(args.older_than_days)} order rows")
+        return
+
+    timings = measure_startup(runs=args.runs)
+    median = statistics.median(timings)
+    print(f"import {', '.join(STARTUP_MODULES)}: median {median * 1000:.0f} ms, "
+          f"min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms over {args.runs} runs")
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"Startup regression: median is above {args.max_seconds * 1000:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+## "template" renders deterministic tool results locally, "llm" always asks the model to write them up
+RESPONSE_MODE = os.getenv("RESPONSE_MODE", "template")
+
+## Tools whose result is rendered from rows instead of the formatted text
+ROW_TOOLS = ("show_cart", "check_products_status")
+
+CONFIRMATIONS = {
+    "add_product_to_cart": {
+        "Done. The product is in the shopping cart.": "✅ Added to your shopping cart. Is there anything else you'd like to buy?",
+        "Done. Already add your product more.": "✅ Added more of it to your shopping cart. Is there anything else you'd like to buy?",
+    },
+    "remove_product_from_cart": {
+        "Done": "🗑️ Removed from your shopping cart. Is there anything else you'd like to buy?",
+        "The product isn't in the cart.": "I couldn't find that product in your shopping cart. Would you like me to show your cart?",
+    },
+    "update_product_quantity": {
+        "Done": "✅ Quantity updated in your shopping cart. Is there anything else you'd like to buy?",
+        "Please validate your quantity. They are same.": "That product already has this quantity in your shopping cart.",
+        "The product is not in the cart.": "I couldn't find that product in your shopping cart. Would you like me to show your cart?",
+    },
+    "pay_cart": {
+        "Done": "🎉 Payment complete! Your products will arrive in a few days. (This is a fake payment.)",
+        "There are no products in the shopping cart.": "There are no products in your shopping cart yet. Take a look at our top products above!",
+    },
+}
+CONFIRMATIONS["add_products_to_cart"] = CONFIRMATIONS["add_product_to_cart"]
+
+
+def _escape(text):
+    return str(text).replace("|", "\\|")
+
+
+def format_date(value):
+    """'ddd d mmm yy', e.g. 'Mon 3 Jun 24'."""
+    if value is None:
+        return "-"
+    return f"{value:%a} {value.day} {value:%b %y}"
+
+
+def cart_table(cart_items):
+    """cart_items are (name, price, quantity, total_price) rows."""
+    if not cart_items:
+        return "Your shopping cart is empty. Take a look at our top products above, I'm sure there's something you'll love!"
+
+    lines = ["| Product | Price | Quantity | Total |", "|---|---:|---:|---:|"]
+    total_all_prices = 0
+    for product_name, price, quantity, total_price in cart_items:
+        total_all_prices += total_price
+        lines.append(f"| {_escape(product_name)} | ${price:.2f} | {quantity} | ${total_price:.2f} |")
+
+    return "\n".join(lines) + f"\n\n**Total Price: ${total_all_prices:.2f}**"
+
+
+def status_table(items):
+    """items are (name, quantity, status, estimated_arrival_date) rows."""
+    if not items:
+        return "There are no products in your orders or cart yet. Take a look at our top products above!"
+
+    lines = ["| Product | Quantity | Status | Estimated Arrival |", "|---|---:|---|---|"]
+    for product_name, quantity, status, est_arrival in items:
+        lines.append(f"| {_escape(product_name)} | {quantity} | {status} | {format_date(est_arrival)} |")
+
+    return "\n".join(lines)
+
+
+def render(function_name, result):
+    """Markdown for a deterministic tool result, or None when the model should write it up (search, errors)."""
+    if function_name == "show_cart" and isinstance(result, list):
+        return cart_table(result)
+    if function_name == "check_products_status" and isinstance(result, list):
+        return status_table(result)
+    if isinstance(result, str):
+        return CONFIRMATIONS.get(function_name, {}).get(result)
+    return None
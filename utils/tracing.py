@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import contextvars
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+## Tracing settings; with TRACING off every span() is a shared no-op object
+TRACING = os.getenv("TRACING", "0") == "1"
+TRACE_LOG = os.getenv("TRACE_LOG", "")            # JSON lines file, empty = stderr
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # serve /metrics on this port, 0 = off
+METRICS_FILE = os.getenv("METRICS_FILE", "")      # rewrite this file after every finished turn
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current = contextvars.ContextVar("current_span", default=None)
+## Called with (span, duration) for every finished span, e.g. by the benchmark to time stages
+_listeners = []
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Histogram:
+    """Cumulative Prometheus histogram for one label set; durations in seconds unless other buckets are given."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    """Span durations as histograms, and token/row counts as counters, in the Prometheus text format."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, value, buckets=BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in sorted({key[0] for key in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{name}_bucket{_labels(labels, le=bound)} {count}")
+                    lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {histogram.count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+            for name in sorted({key[0] for key in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+metrics = Metrics()
+
+
+class Span:
+    """One timed stage. Attributes set with set() go to the JSON log; tokens/rows also become counters."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        parent = _current.get()
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = uuid.uuid4().hex[:16]
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self._started
+        _current.reset(self._token)
+        if exc is not None:
+            self.attributes["error"] = repr(exc)
+        _finish(self, duration)
+        return False
+
+
+def span(name, **attributes):
+    """with tracing.span("stage", key=value) as span: ... span.set(rows=3)"""
+    if not TRACING:
+        return NOOP_SPAN
+    _start_exporters()
+    return Span(name, attributes)
+
+def current():
+    return _current.get() or NOOP_SPAN
+
+def configure(enabled=None, trace_log=None):
+    """Turn tracing on or off at run time, and/or send the span log to another file (os.devnull to drop it)."""
+    global TRACING, TRACE_LOG, _log_file
+    if enabled is not None:
+        TRACING = enabled
+    if trace_log is not None:
+        with _log_lock:
+            if _log_file is not None and _log_file is not sys.stderr:
+                _log_file.close()
+            TRACE_LOG, _log_file = trace_log, None
+
+def add_listener(listener):
+    _listeners.append(listener)
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+def stream_options():
+    """Ask streamed completions for token usage only while tracing."""
+    if not TRACING:
+        return {}
+    return {"stream_options": {"include_usage": True}}
+
+def in_context(function):
+    """Run function in the caller's trace when it is handed to another thread (tool pool)."""
+    if not TRACING:
+        return function
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+
+_log_lock = threading.Lock()
+_log_file = None
+
+def _finish(finished, duration):
+    labels = {"stage": finished.name}
+    if "tool" in finished.attributes:
+        labels["tool"] = finished.attributes["tool"]
+    metrics.observe("chat_stage_seconds", labels, duration)
+    for counter in ("tokens", "prompt_tokens", "completion_tokens", "rows"):
+        value = finished.attributes.get(counter)
+        if isinstance(value, (int, float)):
+            metrics.inc(f"chat_{counter}_total", labels, value)
+
+    record = {
+        "trace_id": finished.trace_id,
+        "span_id": finished.span_id,
+        "parent_id": finished.parent_id,
+        "name": finished.name,
+        "start": round(finished.started_at, 6),
+        "duration_ms": round(duration * 1000, 3),
+        **finished.attributes,
+    }
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        global _log_file
+        if _log_file is None:
+            _log_file = open(TRACE_LOG, "a", buffering=1) if TRACE_LOG else sys.stderr
+        _log_file.write(line + "\n")
+
+    if METRICS_FILE and finished.parent_id is None:
+        write_metrics(METRICS_FILE)
+    for listener in list(_listeners):
+        listener(finished, duration)
+
+def write_metrics(path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(metrics.render())
+    os.replace(tmp_path, path)
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+def _start_exporters():
+    global _exporters_started
+    if _exporters_started:
+        return
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+        if METRICS_PORT:
+            serve_metrics(METRICS_PORT)
+
+def serve_metrics(port=METRICS_PORT, host="0.0.0.0"):
+    """Expose /metrics for Prometheus from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            data = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as error:
+        ## Streamlit may load the app in more than one process; only the first one serves
+        print(f"Error: metrics endpoint not started: {error}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
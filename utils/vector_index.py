@@ -0,0 +1,216 @@
+import os
+import time
+import threading
+import numpy as np
+import psycopg2
+from utils import embedding_providers
+from utils import result_cache
+from utils import search_filters
+
+VECTOR_INDEX_SYNC_INTERVAL = float(os.getenv("VECTOR_INDEX_SYNC_INTERVAL", 5))  # seconds between catalog_version checks
+
+## Columns kept next to the vectors for search_filters, as (field, SELECT expression)
+FILTER_COLUMNS = (
+    ("price", "discount_price_dollar"),
+    ("ratings", "ratings"),
+    ("discount_percent", "CASE WHEN actual_price_dollar > 0 THEN 100 * (1 - discount_price_dollar / actual_price_dollar) END"),
+    ("main_category", "lower(main_category)"),
+    ("sub_category", "lower(sub_category)"),
+)
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+class VectorIndex:
+    """
+    In-memory copy of product_listing.embedded_description for catalogs that fit in RAM.
+    Rows are L2-normalized once, so cosine similarity is a single matrix-vector product.
+    Only vectors of embedding_model are loaded (default: the EMBED_PROVIDER model).
+    Any change to product_listing, from this process or another (utils.ingest), bumps catalog_version
+    (database/migrations/003_catalog_version.sql), which makes the next ensure_fresh reload the index.
+    """
+
+    def __init__(self, sync_interval=VECTOR_INDEX_SYNC_INTERVAL, embedding_model=None):
+        self.sync_interval = sync_interval
+        self.embedding_model = embedding_model
+        self.ids = np.empty(0, dtype=np.int64)
+        self.columns = _empty_columns()
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self._row_of = {}
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_sync = 0.0
+        self.version = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _model(self):
+        return self.embedding_model or embedding_providers.get_provider().tag
+
+    def _fetch(self, conn, product_ids=None):
+        ## Stream rows with a server-side cursor so a large catalog isn't buffered twice
+        select = ", ".join(expression for _, expression in FILTER_COLUMNS)
+        with conn.cursor(name=f"vector_index_load_{threading.get_ident()}", withhold=True) as cur:
+            cur.itersize = 10000
+            if product_ids is None:
+                cur.execute(f"""
+                    SELECT id, {select}, embedded_description
+                    FROM product_listing
+                    WHERE embedded_description IS NOT NULL AND embedding_model = %s
+                    ORDER BY id
+                """, (self._model(),))
+            else:
+                cur.execute(f"""
+                    SELECT id, {select}, embedded_description
+                    FROM product_listing
+                    WHERE embedded_description IS NOT NULL AND embedding_model = %s AND id = ANY(%s)
+                """, (self._model(), list(product_ids)))
+            rows = list(cur)
+
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        columns = {}
+        for position, (field, _) in enumerate(FILTER_COLUMNS, start=1):
+            values = [row[position] for row in rows]
+            if field in search_filters.TEXT_FIELDS:
+                columns[field] = np.array(values, dtype=object)
+            else:
+                columns[field] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        if rows:
+            matrix = _normalize_rows(np.vstack([np.asarray(row[-1], dtype=np.float32) for row in rows]))
+        else:
+            matrix = np.empty((0, self.matrix.shape[1]), dtype=np.float32)
+        return ids, columns, matrix
+
+    def _catalog_version(self, conn):
+        """Current catalog_version, or None when migration 003 isn't applied."""
+        try:
+            with conn.cursor() as cur:
+                cur.execute(result_cache.CATALOG_VERSION_SQL)
+                return cur.fetchone()[0]
+        except psycopg2.Error:
+            return None
+
+    def load(self, conn):
+        """Load the whole catalog, replacing whatever was indexed before."""
+        ## Read before the rows: a change made during the load moves the version again
+        version = self._catalog_version(conn)
+        ids, columns, matrix = self._fetch(conn)
+        with self._lock:
+            self.version = version
+            self.ids, self.columns, self.matrix = ids, columns, matrix
+            self._row_of = {int(product_id): row for row, product_id in enumerate(ids)}
+            self._loaded = True
+            self._last_sync = time.time()
+
+    def refresh(self, conn, product_ids):
+        """Re-read only the given products: changed rows are overwritten, new rows appended, missing rows dropped."""
+        product_ids = [int(product_id) for product_id in product_ids]
+        if not product_ids:
+            return
+        ids, columns, matrix = self._fetch(conn, product_ids)
+
+        with self._lock:
+            found = set(ids.tolist())
+            self._remove([product_id for product_id in product_ids if product_id not in found])
+
+            new_rows = []
+            for row, product_id in enumerate(ids.tolist()):
+                existing = self._row_of.get(product_id)
+                if existing is None:
+                    new_rows.append(row)
+                else:
+                    self.matrix[existing] = matrix[row]
+                    for field, values in columns.items():
+                        self.columns[field][existing] = values[row]
+
+            if new_rows:
+                start = len(self.ids)
+                if self.matrix.size == 0:
+                    self.matrix = np.ascontiguousarray(matrix[new_rows])
+                else:
+                    self.matrix = np.ascontiguousarray(np.vstack([self.matrix, matrix[new_rows]]))
+                self.ids = np.concatenate([self.ids, ids[new_rows]])
+                self.columns = {field: np.concatenate([self.columns[field], values[new_rows]])
+                                for field, values in columns.items()}
+                for offset, product_id in enumerate(ids[new_rows].tolist()):
+                    self._row_of[product_id] = start + offset
+
+    def _remove(self, product_ids):
+        rows = [self._row_of[product_id] for product_id in product_ids if product_id in self._row_of]
+        if not rows:
+            return
+        self.ids = np.delete(self.ids, rows)
+        self.columns = {field: np.delete(values, rows) for field, values in self.columns.items()}
+        self.matrix = np.ascontiguousarray(np.delete(self.matrix, rows, axis=0))
+        self._row_of = {int(product_id): row for row, product_id in enumerate(self.ids)}
+
+    def sync(self, conn):
+        """Pick up inserted and deleted ids without re-reading unchanged vectors (updated rows keep their old values)."""
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM product_listing WHERE embedded_description IS NOT NULL AND embedding_model = %s",
+                        (self._model(),))
+            current = {row[0] for row in cur.fetchall()}
+
+        with self._lock:
+            known = set(self._row_of)
+            self._remove(list(known - current))
+            self._last_sync = time.time()
+        self.refresh(conn, current - known)
+
+    def ensure_fresh(self, conn):
+        """Load on first use, then reload whenever catalog_version has moved since the last load."""
+        if not self._loaded:
+            self.load(conn)
+        elif self.sync_interval and time.time() - self._last_sync > self.sync_interval:
+            version = self._catalog_version(conn)
+            if version is None:
+                ## No version counter: inserted and deleted ids are all that can be detected
+                self.sync(conn)
+            elif version != self.version:
+                self.load(conn)
+            else:
+                self._last_sync = time.time()
+
+    def search(self, query_embedding, k=20, conditions=()):
+        """Return [(product_id, rank)] of the k nearest products matching the search_filters conditions, rank starting at 1."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        with self._lock:
+            if len(self.ids) == 0:
+                return []
+            similarities = self.matrix @ query
+            ids = self.ids
+            if conditions:
+                similarities = np.where(search_filters.mask(conditions, self.columns), similarities, -np.inf)
+
+        k = min(k, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        top = top[np.isfinite(similarities[top])]
+
+        return [(int(ids[row]), rank) for rank, row in enumerate(top, start=1)]
+
+
+def _empty_columns():
+    return {
+        field: np.empty(0, dtype=object if field in search_filters.TEXT_FIELDS else np.float64)
+        for field, _ in FILTER_COLUMNS
+    }
+
+
+def reciprocal_rank_fusion(*rankings, k=60, limit=5):
+    """Fuse [(id, rank)] lists the same way the SQL FULL OUTER JOIN does: sum of 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for product_id, rank in ranking:
+            scores[product_id] = scores.get(product_id, 0.0) + 1.0 / (k + rank)
+
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
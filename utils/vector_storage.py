@@ -0,0 +1,188 @@
+import os
+import sys
+import time
+import random
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+## Compact search vectors. text-embedding-3 vectors can be shortened by keeping their first
+## N dimensions and re-normalizing, so the compact column is derived from embedded_description
+## in Postgres (pgvector >= 0.7) and never needs its own API calls.
+EMBED_SEARCH_DIMENSIONS = int(os.getenv("EMBED_SEARCH_DIMENSIONS", 0))   # 0 = search the full vectors only
+EMBED_SEARCH_PRECISION = os.getenv("EMBED_SEARCH_PRECISION", "half")    # half (halfvec) or full (vector)
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 100))            # compact matches re-ranked with full vectors
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "relaxed_order") # pgvector >= 0.8: keep scanning until filtered searches fill their LIMIT, "off" to disable
+
+
+def compact_type(dimensions=EMBED_SEARCH_DIMENSIONS, precision=EMBED_SEARCH_PRECISION):
+    return f"{'halfvec' if precision == 'half' else 'vector'}({dimensions})"
+
+def compact_expression(vector_sql, dimensions=EMBED_SEARCH_DIMENSIONS, precision=EMBED_SEARCH_PRECISION):
+    """SQL turning a full vector expression into its compact form."""
+    return f"l2_normalize(subvector(({vector_sql})::vector, 1, {dimensions}))::{compact_type(dimensions, precision)}"
+
+def session_settings(candidates=RERANK_CANDIDATES):
+    """
+    SET statements for every new connection. An HNSW scan returns at most hnsw.ef_search rows (40 by default),
+    which would silently cap the candidates to re-rank, and without iterative scans a filtered search
+    only keeps the matches among those rows. Older pgvector versions reject the iterative scan setting;
+    callers ignore statements that fail.
+    """
+    settings = []
+    if EMBED_SEARCH_DIMENSIONS and candidates > 40:
+        settings.append(f"SET hnsw.ef_search = {int(candidates)}")
+    if HNSW_ITERATIVE_SCAN in ("relaxed_order", "strict_order"):
+        settings.append(f"SET hnsw.iterative_scan = {HNSW_ITERATIVE_SCAN}")
+    return settings
+
+def nearest_sql(embedding_sql, where="", limit=20, dimensions=EMBED_SEARCH_DIMENSIONS, candidates=RERANK_CANDIDATES,
+                precision=EMBED_SEARCH_PRECISION):
+    """
+    Subquery of (id, distance) for the `limit` products nearest to embedding_sql, nearest first.
+    With EMBED_SEARCH_DIMENSIONS set, candidates come from the compact HNSW index and are
+    re-ranked by the full vectors; otherwise the full-vector index is searched directly.
+    """
+    if not dimensions:
+        return f"""
+            SELECT id, embedded_description <=> {embedding_sql} AS distance
+            FROM product_listing
+            {where}
+            ORDER BY embedded_description <=> {embedding_sql}
+            LIMIT {int(limit)}"""
+
+    return f"""
+            SELECT id, embedded_description <=> {embedding_sql} AS distance
+            FROM (
+                SELECT id, embedded_description
+                FROM product_listing
+                {where}
+                ORDER BY embedded_compact <=> {compact_expression(embedding_sql, dimensions, precision)}
+                LIMIT {int(max(candidates, limit))}
+            ) candidates
+            ORDER BY distance
+            LIMIT {int(limit)}"""
+
+def build_sql(dimensions=EMBED_SEARCH_DIMENSIONS, precision=EMBED_SEARCH_PRECISION):
+    """DDL of the generated compact column and its HNSW index; rebuilding drops the previous one."""
+    operator_class = "halfvec_cosine_ops" if precision == "half" else "vector_cosine_ops"
+    return [
+        "DROP INDEX IF EXISTS product_listing_compact_hnsw",
+        "ALTER TABLE product_listing DROP COLUMN IF EXISTS embedded_compact",
+        f"""ALTER TABLE product_listing ADD COLUMN embedded_compact {compact_type(dimensions, precision)}
+            GENERATED ALWAYS AS ({compact_expression("embedded_description", dimensions, precision)}) STORED""",
+        f"CREATE INDEX product_listing_compact_hnsw ON product_listing USING hnsw (embedded_compact {operator_class})",
+        "ANALYZE product_listing",
+    ]
+
+def storage_sizes(cur):
+    """Bytes used by the full and compact vectors and their indexes."""
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'product_listing' AND column_name = 'embedded_compact'
+    """)
+    compact_column = "embedded_compact" if cur.fetchone() else "NULL::int"
+    cur.execute(f"""
+        SELECT
+            (SELECT AVG(pg_column_size(embedded_description)) FROM product_listing),
+            (SELECT AVG(pg_column_size({compact_column})) FROM product_listing),
+            pg_relation_size(to_regclass('product_listing_embedding_hnsw')),
+            pg_relation_size(to_regclass('product_listing_compact_hnsw'))
+    """)
+    full_bytes, compact_bytes, full_index, compact_index = cur.fetchone()
+    return {
+        "full_vector_bytes": float(full_bytes or 0),
+        "compact_vector_bytes": float(compact_bytes or 0),
+        "full_index_bytes": full_index,
+        "compact_index_bytes": compact_index,
+    }
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+def measure_recall(cur, queries=100, k=10, candidates=(20, 50, 100, 200), dimensions=EMBED_SEARCH_DIMENSIONS,
+                   precision=EMBED_SEARCH_PRECISION, seed=0):
+    """
+    Recall@k and latency of each search plan against exact full-vector search.
+    Query vectors are stored product embeddings, so the measurement needs no API calls.
+    """
+    cur.execute("SELECT id FROM product_listing WHERE embedded_description IS NOT NULL")
+    ids = [row[0] for row in cur.fetchall()]
+    sample = random.Random(seed).sample(ids, min(queries, len(ids)))
+
+    ## name: (sql, hnsw.ef_search)
+    plans = {"hnsw_full": (nearest_sql("q.embedding", limit=k, dimensions=0), 40)}
+    if dimensions:
+        plans[f"compact_only_{dimensions}"] = (f"""
+            SELECT id FROM product_listing
+            ORDER BY embedded_compact <=> {compact_expression("q.embedding", dimensions, precision)}
+            LIMIT {int(k)}""", 40)
+        for count in candidates:
+            plans[f"rerank_{dimensions}_top{count}"] = (
+                nearest_sql("q.embedding", limit=k, dimensions=dimensions, candidates=count, precision=precision),
+                max(40, count),
+            )
+
+    results = {name: {"recall": [], "seconds": []} for name in plans}
+    for product_id in sample:
+        query_cte = f"WITH q AS (SELECT embedded_description AS embedding FROM product_listing WHERE id = {int(product_id)}) "
+
+        ## Ground truth: exact scan, indexes off
+        cur.execute("SET enable_indexscan = off")
+        cur.execute(query_cte + f"""
+            SELECT id FROM product_listing, q
+            ORDER BY embedded_description <=> q.embedding
+            LIMIT {int(k)}""")
+        exact = {row[0] for row in cur.fetchall()}
+        cur.execute("RESET enable_indexscan")
+
+        for name, (sql, ef_search) in plans.items():
+            cur.execute(f"SET hnsw.ef_search = {int(ef_search)}")
+            started = time.perf_counter()
+            cur.execute(query_cte + f"SELECT nearest.id FROM q CROSS JOIN LATERAL ({sql}) nearest")
+            found = {row[0] for row in cur.fetchall()}
+            results[name]["seconds"].append(time.perf_counter() - started)
+            results[name]["recall"].append(len(found & exact) / len(exact) if exact else 1.0)
+
+    return {
+        name: {
+            "recall_at_k": round(sum(values["recall"]) / len(values["recall"]), 4),
+            "p50_ms": round(_percentile(values["seconds"], 50) * 1000, 2),
+            "p95_ms": round(_percentile(values["seconds"], 95) * 1000, 2),
+        }
+        for name, values in results.items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build compact search vectors and measure their recall.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="add the generated compact column and its HNSW index")
+    build.add_argument("--dimensions", type=int, default=EMBED_SEARCH_DIMENSIONS or 256)
+    build.add_argument("--precision", choices=("half", "full"), default=EMBED_SEARCH_PRECISION)
+    recall = subparsers.add_parser("recall", help="recall@k and latency of full, compact and re-ranked search")
+    recall.add_argument("--queries", type=int, default=100)
+    recall.add_argument("-k", type=int, default=10)
+    recall.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100, 200])
+    recall.add_argument("--dimensions", type=int, default=EMBED_SEARCH_DIMENSIONS,
+                        help="dimensions of the built compact column (see the build command)")
+    recall.add_argument("--precision", choices=("half", "full"), default=EMBED_SEARCH_PRECISION)
+    args = parser.parse_args()
+
+    from utils import pool
+
+    with pool.cursor() as cur:
+        if args.command == "build":
+            for statement in build_sql(args.dimensions, args.precision):
+                cur.execute(statement)
+            print(f"embedded_compact is {compact_type(args.dimensions, args.precision)}; "
+                  f"set EMBED_SEARCH_DIMENSIONS={args.dimensions} EMBED_SEARCH_PRECISION={args.precision} to search it")
+            print(storage_sizes(cur))
+            sys.exit(0)
+
+        for name, stats in measure_recall(cur, args.queries, args.k, args.candidates, args.dimensions, args.precision).items():
+            print(f"{name:<28} recall@{args.k} {stats['recall_at_k']:.3f}  p50 {stats['p50_ms']:>7.2f} ms  p95 {stats['p95_ms']:>7.2f} ms")
+        print(storage_sizes(cur))